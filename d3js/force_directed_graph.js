@@ -4,6 +4,13 @@
 
     Additional features (directional links, highlighting) taken from:
         http://www.coppelia.io/2014/07/an-a-to-z-of-extra-features-for-the-d3-force-layout/
+
+    Level of detail: aggregate nodes (exported with garbo.py --d3js-lod) have a "detail" file,
+      clicking an aggregate node loads its resources, and "back" returns to the overview.
+
+    Served by garbo.py --serve: only the shown subgraph is fetched, filtered by application, region and type,
+      a page at a time. Clicking a resource loads its neighborhood, and "back" returns to the filtered view.
+      Otherwise, the static garbo.json export is loaded.
 */
 
 var width = 4000,
@@ -17,37 +24,120 @@ var force = d3.layout.force()
     .linkDistance(30)
     .size([width, height]);
 
+// the overview url, garbo.json or a filtered subgraph of the graph server
+var home = "garbo.json";
+
+var controls = d3.select("body").append("div");
+
+var back = controls.append("a")
+    .attr("href", "#")
+    .style("display", "none")
+    .text("back")
+    .on("click", function() {
+        d3.event.preventDefault();
+        render(home);
+    });
+
+var pages = controls.append("span");
+
+// graph server filters, by parameter name
+var filters = {};
+
+function query(params) {
+    var pairs = [];
+    for (var k in params) {
+        if (params[k] !== "" && params[k] !== undefined) pairs.push(k + "=" + encodeURIComponent(params[k]));
+    }
+    return "api/graph?" + pairs.join("&");
+}
+
+function filtered(offset) {
+    var params = {offset: offset || 0};
+    for (var k in filters) params[k] = filters[k].property("value");
+    return query(params);
+}
+
+function addFilter(name, counts) {
+    var select = controls.append("select").on("change", function() {
+        home = filtered(0);
+        render(home);
+    });
+    select.append("option").attr("value", "").text("all " + name);
+    Object.keys(counts).sort().forEach(function(k) {
+        select.append("option").attr("value", k).text(k + " (" + counts[k] + ")");
+    });
+    filters[name] = select;
+}
+
+function showPages(url, graph) {
+    // pagination of graph server subgraphs
+    pages.selectAll("*").remove();
+    if (graph.total === undefined) return;
+    pages.append("span").text(" " + (graph.offset + 1) + "-" + (graph.offset + graph.nodes.length) +
+                              " of " + graph.total + " ");
+    [["previous", graph.offset > 0 ? Math.max(0, graph.offset - graph.limit) : null],
+     ["next", graph.next]].forEach(function(p) {
+        if (p[1] === null) return;
+        pages.append("a").attr("href", "#").text(p[0] + " ").on("click", function() {
+            d3.event.preventDefault();
+            render(url.replace(/([?&])offset=\d*/, "$1").replace(/&$/, "") + "&offset=" + p[1]);
+        });
+    });
+}
+
 var svg = d3.select("body").append("svg")
     .attr("width", width)
     .attr("height", height);
 
-d3.json("garbo.json", function(error, graph) {
+var canvas = svg.append("g");
+
+function radius(d) {
+    // aggregate nodes grow with the number of resources they hold
+    if (d.count) return 5 + Math.sqrt(d.count);
+    return d.group > 1 ? 5 : 10;
+}
+
+function render(url) {
+  back.style("display", url == home ? "none" : null);
+  canvas.selectAll("*").remove();
+
+  d3.json(url, function(error, graph) {
+  showPages(url, graph);
+  // precomputed layouts (garbo.py --layout) are rendered as is, without a simulation
+  graph.nodes.forEach(function(d) { d.fixed = graph.layout; });
   force
       .nodes(graph.nodes)
       .links(graph.links)
       .start();
+  if (graph.layout) force.stop();
 
-  var link = svg.selectAll(".link")
+  var link = canvas.selectAll(".link")
       .data(graph.links)
     .enter().append("line")
       .attr("class", "link")
       .style("marker-end",  "url(#suit)")
       .style("stroke-width", function(d) { return Math.sqrt(d.value); });
 
-  var node = svg.selectAll(".node")
+  var node = canvas.selectAll(".node")
       .data(graph.nodes)
     .enter().append("circle")
       .attr("class", "node")
       // .attr("r", 5)
-      .style("r", function(d) { return d.group > 1 ? 5 : 10; })
+      .style("r", radius)
+      .attr("r", radius)
       .style("fill", function(d) { return d.group > 1 ? color(d.group) : (d.group == 0 ? "#2ca02c" : "#d62728"); })
       .call(force.drag)
+      .on('click', function(d) {
+          if (d3.event.defaultPrevented) return;
+          if (d.detail) render(d.detail);
+          else if (home != "garbo.json") render(query({urid: d.name, depth: 2}));
+      })
       .on('dblclick', connectedNodes);
 
   node.append("title")
-      .text(function(d) { return d.name; });
+      .text(function(d) { return d.count ? d.name + " (" + d.count + " resources)" : d.name; });
 
-  force.on("tick", function() {
+  function tick() {
     link.attr("x1", function(d) { return d.source.x; })
         .attr("y1", function(d) { return d.source.y; })
         .attr("x2", function(d) { return d.target.x; })
@@ -55,7 +145,9 @@ d3.json("garbo.json", function(error, graph) {
 
     node.attr("cx", function(d) { return d.x; })
         .attr("cy", function(d) { return d.y; });
-  });
+  }
+  force.on("tick", tick);
+  if (graph.layout) tick();
 
     //Toggle stores whether the highlighting is on
     var toggle = 0;
@@ -90,7 +182,8 @@ d3.json("garbo.json", function(error, graph) {
             toggle = 0;
         }
     }
-});
+  });
+}
 
 svg.append("defs").selectAll("marker")
     .data(["suit", "licensing", "resolved"])
@@ -106,3 +199,16 @@ svg.append("defs").selectAll("marker")
     .attr("d", "M0,-5L10,0L0,5 L10,0 L0, -5")
     .style("stroke", "#4679BD")
     .style("opacity", "0.6");
+
+d3.json("api/summary", function(error, summary) {
+    if (error) {
+        // no graph server, the static export
+        render(home);
+        return;
+    }
+    addFilter("application", summary.applications);
+    addFilter("region", summary.regions);
+    addFilter("rtype", summary.rtypes);
+    home = filtered(0);
+    render(home);
+});
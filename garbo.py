@@ -2,15 +2,21 @@
 ...
 """
 
+from __future__ import print_function
+
 import argparse
 import logging
+import sys
 
-import yaml
+from garbo import config, metrics, plugins, utils
+from garbo.graph import CompactGraph
+from garbo.model import AbstractResource
+from garbo.storage import LOD_MODES
 
-from garbo import config, utils
-from garbo.discovery import aws
-from garbo.storage.dummy import dump_graph, load_graph
-from garbo.storage.d3js import D3JSForce
+try:
+    read_input = raw_input
+except NameError:
+    read_input = input
 
 __author__ = 'nati'
 
@@ -24,18 +30,106 @@ def _get_parsed_arguments():
     parser.add_argument('--discovery', '-d', action='store_true', default=False,
                         help='Perform a discovery (don\'t use stored graph). default: False')
 
+    parser.add_argument('--max-age', type=float, default=None,
+                        help='Perform a discovery, reusing discovery shards of up to MAX_AGE seconds (implies -d). '
+                             'default: rediscover all shards')
+
+    parser.add_argument('--pipeline', '-p', action='store_true', default=False,
+                        help='Store and index the discovery while it runs, so the sweep starts as soon as it ends '
+                             '(with -d). default: False')
+
     parser.add_argument('--gen-d3js', '-g', action='store_true', default=False,
                         help='Generate a json file for D3JS Directed Force Graph. default: False')
 
-    return parser.parse_args()
+    parser.add_argument('--d3js-lod', choices=LOD_MODES, default=None,
+                        help='D3JS level of detail, aggregate resources by type, region or connected component. '
+                             'default: export all resources')
+
+    parser.add_argument('--layout', action='store_true', default=False,
+                        help='Precompute the D3JS graph layout (instead of simulating it in the browser). '
+                             'default: False')
+
+    parser.add_argument('--ownership', '-o', default=False,
+                        help='YAML file to write the applications using each resource into (requires -a)')
+
+    parser.add_argument('--incremental', '-i', default=False,
+                        help='State file of an incremental mark & sweep, sweeping only the changes since the '
+                             'previous run (requires -a)')
+
+    parser.add_argument('--usage', '-u', action='store_true', default=False,
+                        help='Probe the usage of resources (e.g. CloudWatch activity), and keep the resources in use '
+                             '(requires -a). default: False')
+
+    parser.add_argument('--retention', '-r', action='store_true', default=False,
+                        help='Record why every used resource is kept, for garbo.py --explain (requires -a). '
+                             'default: False')
+
+    parser.add_argument('--cleanup', action='store_true', default=False,
+                        help='Delete the unused resources, in dependency order (requires -a). Resources in use are '
+                             'kept even without -u, and an interrupted cleanup resumes on the next run. '
+                             'default: False')
+
+    parser.add_argument('--dry-run', action='store_true', default=False,
+                        help='Only log the cleanup plan (with --cleanup). default: False')
+
+    parser.add_argument('--yes', '-y', action='store_true', default=False,
+                        help='Don\'t ask for a confirmation before deleting resources (with --cleanup). '
+                             'default: False')
+
+    parser.add_argument('--force', action='store_true', default=False,
+                        help='Clean up even if the graph is incomplete, eg. a collector or an account failed to '
+                             'discover (with --cleanup). default: False')
+
+    parser.add_argument('--explain', '-e', metavar='URID', default=None,
+                        help='Explain why a resource is kept, using the retention index recorded by the last sweep '
+                             '(see --retention)')
+
+    parser.add_argument('--serve', '-s', action='store_true', default=False,
+                        help='Serve the D3JS viewer, and filtered subgraphs of the stored graph (by application '
+                             'with -a). default: False')
+
+    parser.add_argument('--host', default=None, help='Server host (with --serve). default: config.server.host')
+
+    parser.add_argument('--port', type=int, default=None,
+                        help='Server port (with --serve). default: config.server.port')
 
+    args = parser.parse_args()
+    if args.retention and args.incremental:
+        parser.error('--retention is not supported by an incremental sweep (-i)')
+    return args
 
-def _gen_d3js(graph):
-    # TODO: move to d3js.py ?
-    fdg = D3JSForce()
-    for item in graph:
-        fdg.add_item(item)
-    fdg.export('d3js/garbo.json')
+
+def _explain(urid):
+    """
+    :return: exit status, non-zero when there is no readable retention index
+    """
+    import sqlite3
+    from garbo.storage.retention import explain
+
+    try:
+        explanation = explain(urid)
+    except (IOError, OSError, sqlite3.Error) as e:
+        logging.error('unable to explain %s: %s', urid, e)
+        return 1
+    if explanation is None:
+        print('%s is not kept by any application' % urid)
+        return 0
+    path, applications = explanation
+    print('%s is kept by: %s' % (urid, ', '.join(applications)))
+    for i, (node, root_of) in enumerate(path):
+        print('%s%s%s' % ('  -> ' if i else '  ', node, ' (root of %s)' % ', '.join(root_of) if root_of else ''))
+    return 0
+
+
+def _confirm_cleanup(unused_graph):
+    """
+    :return: True if the user confirmed the deletion of the unused resources
+    """
+    count = sum(1 for item in unused_graph if isinstance(item, AbstractResource))
+    if not sys.stdin.isatty():
+        logging.error('not deleting %d unused resources without a confirmation, see --yes', count)
+        return False
+    return read_input('Delete %d unused resources? [y/N] ' % count).strip().lower() in ('y', 'yes')
 
 
 def main():
@@ -43,31 +137,122 @@ def main():
     config.load()
     logging.basicConfig(level=logging.INFO)
     args = _get_parsed_arguments()
+    if args.explain:
+        # answered from the retention index, without a discovery or a sweep
+        return _explain(args.explain)
+    # plugins are imported only when needed, so runs without a discovery don't import boto
+    storage = plugins.load(plugins.STORAGE, config.storage.backend)
 
-    if args.discovery:
-        # Perform discovery into selected storage
-        graph = list(aws.collect_all())
-        dump_graph(graph)
+    if args.discovery or args.max_age is not None:
+        from garbo.graph import GraphBuilder
+        from garbo.storage.shards import shard_store
+
+        aws = plugins.load(plugins.DISCOVERY, 'aws')
+        # Perform discovery into selected storage, dropping duplicate resources and relations
+        # (checkpointed into shards, resuming an interrupted discovery)
+        if config.aws.accounts_file:
+            # all accounts, discovered in parallel processes
+            accounts = aws.load_accounts(config.aws.accounts_file)
+            discovered = aws.collect_accounts(accounts, shard_store(), max_age=args.max_age)
+        else:
+            discovered = aws.collect_all(shards=shard_store(), max_age=args.max_age)
+        builder = GraphBuilder()
+        discovered = builder.feed(discovered)
+        if args.pipeline:
+            from garbo import pipeline
+
+            # storage writes and graph indexing overlap the discovery
+            with metrics.timed_stage('discovery'):
+                graph = pipeline.run(discovered, storage)
+        elif hasattr(storage, 'record'):
+            # streaming storage, write while discovering
+            with metrics.timed_stage('discovery'):
+                for _ in storage.record(discovered):
+                    pass
+            # the final (merged) items, see GraphBuilder.feed
+            graph = list(builder)
+        else:
+            with metrics.timed_stage('discovery'):
+                for _ in discovered:
+                    pass
+                graph = list(builder)
+            with metrics.timed_stage('storage'):
+                storage.dump_graph(graph)
     else:
-        # Read resources and relations from storage
-        graph = load_graph()
+        # Read resources and relations from storage (might be a lazy generator, iterated once)
+        graph = storage.load_graph()
 
-    unused_graph = []
+    if args.serve or args.cleanup:
+        # kept in memory, to be swept and then served (or to check the cleanup against)
+        graph = graph if isinstance(graph, CompactGraph) else CompactGraph(graph)
+
+    unused_graph, ownership, status = [], None, 0
     if args.applications:
+        import yaml
+
         # Read applications file
         with open(args.applications) as applications_file:
-            applications = yaml.load(applications_file)
-        root_resources = [r for app in applications for r in applications[app]]
+            applications = yaml.safe_load(applications_file)
 
-        # Perform mark & Sweep
-        unused_graph = utils.mark_and_sweep(graph, root_resources)
+        if args.usage:
+            from garbo import usage
+
+            # Batched usage probes, resources in use become roots as well
+            graph = graph if isinstance(graph, CompactGraph) else list(graph)
+            with metrics.timed_stage('usage'):
+                logging.info('%d resources are in use', usage.evaluate(graph))
+
+        # Perform mark & Sweep (for all applications at once), a cleanup always keeps the resources in use
+        used_as_roots = args.usage or args.cleanup
+        with metrics.timed_stage('sweep'):
+            if args.incremental:
+                from garbo.incremental import IncrementalSweep
+
+                # keep the marks between runs, and update them by the graph changes
+                sweep = IncrementalSweep.load(args.incremental)
+                sweep.update(graph, applications, used_as_roots=used_as_roots)
+                sweep.save(args.incremental)
+                unused_graph, ownership = sweep.unused_graph(), sweep.ownership()
+            else:
+                unused_graph, ownership = utils.sweep_applications(graph, applications,
+                                                                   used_as_roots=used_as_roots,
+                                                                   retention=args.retention)
+        if args.ownership:
+            with open(args.ownership, 'w') as ownership_file:
+                yaml.safe_dump({urid: sorted(apps) for urid, apps in ownership.items()}, ownership_file,
+                               default_flow_style=False)
+
+        if args.cleanup:
+            from garbo import cleanup
+
+            failures = metrics.discovery_failures()
+            if failures and not args.force:
+                # the resources of the failed parts are missing, so the resources they use look unused
+                logging.error('not cleaning up an incomplete graph, failed: %s (see --force)', ', '.join(failures))
+                status = 1
+            elif args.dry_run or args.yes or _confirm_cleanup(unused_graph):
+                with metrics.timed_stage('cleanup'):
+                    cleanup.execute(unused_graph, dry_run=args.dry_run, graph=graph)
 
     out_graph = unused_graph if args.applications else graph
 
     if args.gen_d3js:
         # Generate a graph
-        _gen_d3js(out_graph)
+        with metrics.timed_stage('export'):
+            exporter = plugins.load(plugins.EXPORTERS, 'd3js')
+            exporter.export_graph(out_graph, 'd3js/garbo.json', lod=args.d3js_lod, layout=args.layout)
+
+    if config.metrics.json_filename:
+        metrics.write_json(config.metrics.json_filename)
+    if config.metrics.prometheus_filename:
+        metrics.write_prometheus(config.metrics.prometheus_filename)
+
+    if args.serve:
+        from garbo.server import serve
+
+        serve(graph, ownership, host=args.host, port=args.port)
+    return status
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""
+    Graph-scale benchmarks- time and memory-profile garbo stages over synthetic AWS accounts
+
+    usage: python -m garbo.benchmark [--sizes 10000 100000 1000000] [--output benchmark.json]
+                                     [--discovery [--discovery-latency 0.05] [--throttling-rate 0.05]]
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from garbo import config, utils
+from garbo.graph import CompactGraph
+from garbo.storage import dummy, snapshot, sqlite, stream
+from garbo.storage.d3js import D3JSForce
+from garbo.synthetic import SyntheticAccount
+
+__author__ = 'nati'
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+def _measure(results, stage, f, *args):
+    """
+    Run f(*args), recording its wall time (and peak traced memory) as a stage result
+    """
+    profile_memory = tracemalloc is not None and tracemalloc.is_tracing()
+    if profile_memory:
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.clear_traces()
+        start_memory = tracemalloc.get_traced_memory()[0]
+    start = _timer()
+    value = f(*args)
+    result = {'seconds': round(_timer() - start, 6)}
+    if profile_memory:
+        result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1] - start_memory
+    results[stage] = result
+    logging.info('%s: %s', stage, result)
+    return value
+
+
+def _storage_round_trip(storage, graph):
+    storage.dump_graph(graph)
+    return sum(1 for _ in storage.load_graph())
+
+
+def _snapshot_sweep(applications):
+    mapped = snapshot.load_graph()
+    try:
+        return utils.sweep_applications(mapped, applications)
+    finally:
+        mapped.close()
+
+
+def _discovery(account, results, latency, throttling_rate):
+    """
+    Discover account through the fake AWS backend, recording its API calls
+    """
+    # imported here, so the other stages don't require boto
+    from garbo.discovery.aws import collect_all
+    from garbo.discovery.aws.fake import FakeAWS
+
+    regions, config.aws.regions = config.aws.regions, account.regions
+    try:
+        with FakeAWS(account, latency=latency, throttling_rate=throttling_rate) as fake:
+            count = _measure(results, 'discovery', lambda: sum(1 for _ in collect_all('fake', 'fake')))
+    finally:
+        config.aws.regions = regions
+    results['discovery'].update(api_calls=sum(fake.calls.values()), throttled=sum(fake.throttled.values()))
+    return count
+
+
+def _d3js_export(graph, filename):
+    fdg = D3JSForce()
+    for item in graph:
+        fdg.add_item(item)
+    fdg.export(filename)
+
+
+def run_size(size, seed, working_dir, applications=10, discovery=None):
+    """
+    Benchmark all stages over a single synthetic account
+
+    :param discovery: dict of FakeAWS latency and throttling_rate, to benchmark the discovery (default: skip it)
+
+    :return: dict of stage -> result
+    """
+    results = {}
+    account = SyntheticAccount(size, seed=seed)
+    graph = _measure(results, 'generate', lambda: list(account.graph()))
+    if discovery is not None:
+        _discovery(account, results, **discovery)
+    apps = account.applications(applications)
+    compact = _measure(results, 'compact_graph', CompactGraph, graph)
+    _measure(results, 'mark_and_sweep', utils.mark_and_sweep, graph, [r for app in apps.values() for r in app])
+    _measure(results, 'sweep_applications', utils.sweep_applications, compact, apps)
+    for name, storage in (('dummy_storage', dummy), ('stream_storage', stream), ('sqlite_storage', sqlite),
+                          ('snapshot_storage', snapshot)):
+        getattr(config, name).working_dir = working_dir
+        _measure(results, name, _storage_round_trip, storage, graph)
+    _measure(results, 'snapshot_sweep', _snapshot_sweep, apps)
+    _measure(results, 'd3js_export', _d3js_export, graph, '%s/garbo.json' % working_dir)
+    results['resources'] = len(account)
+    results['relations'] = len(account.relations)
+    return results
+
+
+def _git_commit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                                           cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark garbo over synthetic AWS accounts')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='number of resources per synthetic account. default: %s' % (DEFAULT_SIZES,))
+    parser.add_argument('--seed', type=int, default=0, help='synthetic account random seed. default: 0')
+    parser.add_argument('--no-memory', action='store_true', default=False,
+                        help='don\'t profile memory (faster, more accurate timings). default: False')
+    parser.add_argument('--output', default='benchmark.json', help='results file. default: benchmark.json')
+    parser.add_argument('--discovery', action='store_true', default=False,
+                        help='benchmark the AWS discovery, against a fake AWS backend (requires boto). default: False')
+    parser.add_argument('--discovery-latency', type=float, default=0.0,
+                        help='seconds per fake AWS API call. default: 0')
+    parser.add_argument('--throttling-rate', type=float, default=0.0,
+                        help='share of fake AWS API calls to throttle. default: 0')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if tracemalloc is not None and not args.no_memory:
+        tracemalloc.start()
+    working_dir = tempfile.mkdtemp(prefix='garbo-benchmark-')
+    try:
+        discovery = {'latency': args.discovery_latency, 'throttling_rate': args.throttling_rate} \
+            if args.discovery else None
+        results = {str(size): run_size(size, args.seed, working_dir, discovery=discovery) for size in args.sizes}
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+    with open(args.output, 'w') as output:
+        json.dump({'commit': _git_commit(), 'python': platform.python_version(), 'seed': args.seed,
+                   'results': results}, output, indent=2, sort_keys=True)
+    logging.info('benchmark results written to %s', args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+"""
+    Cleanup engine- delete the unused resources of a sweep, in dependency order
+
+    A resource is only deleted after all the unused resources depending on it (eg. an Image before its
+      EBSSnapshot, an Instance before its SecurityGroup), so the deletions form a DAG. Every resource becomes
+      ready once its dependents are gone, and ready resources are deleted concurrently by a pool of workers,
+      batched by their deleter (eg. a single TerminateInstances call for many instances). AWS deletions go
+      through the request scheduler, so they run within each service and region rate limit, and the
+      throughput scales with the number of independent resources rather than with the total count.
+      Resources are deleted with the credentials of their account.
+
+    Resources in use are refused, even if no application keeps them. A deletion affecting other resources
+      (eg. of an auto scaling group, affecting its instances) is refused unless all of them are unused as well.
+
+    Deleted resources are checkpointed, so an interrupted cleanup resumes where it stopped.
+"""
+
+from abc import ABCMeta, abstractmethod
+from collections import defaultdict, deque
+import logging
+import os
+import threading
+
+try:
+    import Queue
+except ImportError:
+    # noinspection PyPep8Naming
+    import queue as Queue
+
+from garbo import config
+from garbo.model import AbstractResource, Relation
+from garbo.utils import aws_connection
+
+__author__ = 'nati'
+
+# log the progress every PROGRESS_INTERVAL deletions
+PROGRESS_INTERVAL = 100
+
+
+class CleanupRefused(Exception):
+    """
+    The cleanup refuses to delete a resource (eg. a resource in use, or an auto scaling group of kept instances)
+    """
+
+
+class Deleter(object):
+    """
+    Base class of deleters, deleting many resources of a single region (and account) at once
+    """
+
+    __metaclass__ = ABCMeta
+
+    # maximal number of resources per delete call
+    batch_size = 1
+    # types of the resources a deletion affects along with the deleted one (eg. the instances of an auto scaling
+    #   group), a resource is refused while any of its members is kept
+    members = ()
+
+    @abstractmethod
+    def delete(self, region, resources):
+        """
+        Delete resources, raising an exception if any of them wasn't deleted
+
+        :param region: region of all the resources
+        :param resources: list of up to batch_size resources, all of the same account
+        """
+        pass
+
+
+class AWSDeleter(Deleter):
+    """
+    Delete resources with a boto connection method, taking a resource ID (or a list of IDs when batched)
+    """
+
+    def __init__(self, service, action, argument=None, batch_size=1, members=(), **kwargs):
+        """
+        :param service: boto service module, with a connect_to_region function (eg. boto.ec2)
+        :param action: connection method name (eg. delete_snapshot)
+        :param argument: keyword argument taking the resource ID (default: the first positional argument)
+        :param batch_size: if above 1, action takes a list of resource IDs
+        :param members: resource types the deletion affects, see Deleter.members
+        :param kwargs: additional action arguments
+        """
+        self.service = service
+        self.action = action
+        self.argument = argument
+        self.batch_size = batch_size
+        self.members = members
+        self.kwargs = kwargs
+
+    def delete(self, region, resources):
+        conn = aws_connection(self.service, region, resources[0].account)
+        ids = [r.resource_id for r in resources]
+        resource_id = ids if self.batch_size > 1 else ids[0]
+        kwargs = dict(self.kwargs)
+        if self.argument:
+            kwargs[self.argument] = resource_id
+            getattr(conn, self.action)(**kwargs)
+        else:
+            getattr(conn, self.action)(resource_id, **kwargs)
+
+
+class ElasticIPDeleter(AWSDeleter):
+    """
+    Release Elastic IPs, discovered by their public IP (VPC addresses are released by their allocation ID)
+    """
+
+    def __init__(self):
+        super(ElasticIPDeleter, self).__init__('boto.ec2', 'release_address')
+
+    def delete(self, region, resources):
+        conn = aws_connection(self.service, region, resources[0].account)
+        for address in conn.get_all_addresses(addresses=[r.resource_id for r in resources]):
+            if address.allocation_id:
+                conn.release_address(allocation_id=address.allocation_id)
+            else:
+                conn.release_address(public_ip=address.public_ip)
+
+
+class CleanupLog(object):
+    """
+    Append-only log of the deleted urids, to resume an interrupted cleanup
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.deleted = set()
+        if os.path.exists(filename):
+            with open(filename) as log_file:
+                self.deleted = {line.strip() for line in log_file if line.strip()}
+        self._file = None
+        self._lock = threading.Lock()
+
+    def record(self, urids):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.filename, 'a')
+            self._file.write(''.join(urid + '\n' for urid in urids))
+            self._file.flush()
+
+    def close(self, completed=False):
+        """
+        :param completed: the cleanup completed, so the log isn't needed anymore
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if completed and os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+def _log():
+    return CleanupLog(os.path.join(config.cleanup.working_dir, config.cleanup.log_filename))
+
+
+class _DeletionGraph(object):
+    """
+    The unused resources, the number of (unused) dependents each one waits for, and the refused ones
+    """
+
+    def __init__(self, unused_graph, graph=None):
+        self.resources = {}
+        relations = []
+        for item in unused_graph:
+            if isinstance(item, AbstractResource):
+                self.resources[item.urid()] = item
+            elif isinstance(item, Relation):
+                relations.append(item)
+        self.dependencies = defaultdict(set)
+        for relation in relations:
+            if relation.dependency and relation.source != relation.target and \
+                    relation.source in self.resources and relation.target in self.resources:
+                self.dependencies[relation.source].add(relation.target)
+        self.waiting = defaultdict(int)
+        for targets in self.dependencies.values():
+            for target in targets:
+                self.waiting[target] += 1
+        # refusal reason by urid
+        self.refused = {}
+        for urid, resource in self.resources.items():
+            if resource.used:
+                reason = 'it is in use'
+            else:
+                reason = self._kept_member(urid, getattr(resource.deleter, 'members', ()), graph)
+            if reason:
+                self.refused[urid] = reason
+
+    def _kept_member(self, urid, members, graph):
+        """
+        :return: why a resource affecting members can't be deleted, None if all its members are unused
+        """
+        if not members:
+            return None
+        node = graph.node(urid) if graph is not None else None
+        if node is None:
+            return 'unable to check its %s members' % ', '.join(members)
+        for target in graph.successors(node):
+            if graph.rtype(target) in members and (graph.urids[target] not in self.resources or graph.used(target)):
+                return 'its member %s is kept' % graph.urids[target]
+        return None
+
+    def ready(self):
+        return [urid for urid in self.resources if not self.waiting[urid] and urid not in self.refused]
+
+    def deleted(self, urid):
+        """
+        :return: the dependencies of urid which became ready
+        """
+        ready = []
+        for target in self.dependencies.get(urid, ()):
+            self.waiting[target] -= 1
+            if not self.waiting[target] and target not in self.refused:
+                ready.append(target)
+        return ready
+
+
+def plan(unused_graph, graph=None):
+    """
+    Order the deletions of the unused resources
+
+    :param unused_graph: unused resources and the relations between them, see garbo.utils.mark_and_sweep
+    :param graph: the whole swept graph (a CompactGraph), to check the members of resources (see Deleter.members).
+      Without it, resources with members are refused
+    :return: (list of waves, each a list of resources which can be deleted concurrently once the previous
+      waves are deleted, list of (refused resource, reason), list of resources which can't be ordered as they
+      depend on each other or on refused resources)
+    """
+    deletions = _DeletionGraph(unused_graph, graph)
+    waves = []
+    wave = deletions.ready()
+    while wave:
+        waves.append([deletions.resources[urid] for urid in sorted(wave)])
+        wave = [target for urid in wave for target in deletions.deleted(urid)]
+    ordered = {r.urid() for w in waves for r in w}
+    refused = [(deletions.resources[urid], reason) for urid, reason in sorted(deletions.refused.items())]
+    blocked = [r for urid, r in sorted(deletions.resources.items())
+               if urid not in ordered and urid not in deletions.refused]
+    return waves, refused, blocked
+
+
+def _batch_key(resource):
+    deleter = getattr(resource, 'deleter', None)
+    return deleter, getattr(resource, 'region', None), getattr(resource, 'account', None)
+
+
+def _delete(batch):
+    """
+    Delete a batch of resources of a single (deleter, region, account)
+    """
+    deleter = getattr(batch[0], 'deleter', None)
+    if deleter is not None:
+        deleter.delete(batch[0].region, batch)
+    else:
+        # resources with custom cleanups
+        for resource in batch:
+            resource.cleanup()
+
+
+def execute(unused_graph, workers=None, dry_run=False, log=None, graph=None):
+    """
+    Delete the unused resources, in dependency order
+
+    A resource which fails to delete (or is refused) is kept, as well as the resources it depends on.
+
+    :param unused_graph: unused resources and the relations between them, see garbo.utils.mark_and_sweep
+    :param workers: number of concurrent delete calls (default: config.cleanup.workers)
+    :param dry_run: only log the deletion plan
+    :param log: CleanupLog of the deleted resources, resumed if it isn't empty (default: configured by
+      config.cleanup)
+    :param graph: the whole swept graph (a CompactGraph), to check the members of resources, see plan
+    :return: (deleted urids, dict of failed (or refused) urid -> error, urids not deleted since they depend on
+      each other or on failed resources)
+    """
+    if dry_run:
+        waves, refused, blocked = plan(unused_graph, graph)
+        for i, wave in enumerate(waves):
+            logging.info('cleanup wave %d: %s', i, ', '.join(str(r) for r in wave))
+        for resource, reason in refused:
+            logging.warn('refusing to delete %s: %s', resource, reason)
+        if blocked:
+            logging.warn('unable to order the cleanup of %s', ', '.join(str(r) for r in blocked))
+        return ([r.urid() for wave in waves for r in wave],
+                {r.urid(): CleanupRefused(reason) for r, reason in refused}, [r.urid() for r in blocked])
+
+    deletions = _DeletionGraph(unused_graph, graph)
+    log = log or _log()
+    workers = int(workers or config.cleanup.workers)
+    deleted, failed = [], {}
+    for urid in sorted(deletions.refused):
+        if urid in log.deleted:
+            # deleted by an interrupted cleanup
+            del deletions.refused[urid]
+        else:
+            logging.warn('refusing to delete %s: %s', urid, deletions.refused[urid])
+            failed[urid] = CleanupRefused(deletions.refused[urid])
+
+    # resume: resources deleted by an interrupted cleanup release their dependencies right away
+    ready = deque(deletions.ready())
+    pending = deque()
+    while ready:
+        urid = ready.popleft()
+        if urid in log.deleted:
+            deleted.append(urid)
+            ready.extend(deletions.deleted(urid))
+        else:
+            pending.append(urid)
+    if deleted:
+        logging.info('resuming cleanup, %d resources were already deleted', len(deleted))
+
+    tasks = Queue.Queue()
+    results = Queue.Queue()
+
+    def worker():
+        while True:
+            batch = tasks.get()
+            if batch is None:
+                break
+            try:
+                _delete(batch)
+                results.put((batch, None))
+            except Exception as e:
+                results.put((batch, e))
+
+    threads = [threading.Thread(target=worker, name='garbo-cleanup-%d' % i) for i in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    def dispatch():
+        # batch the ready resources by deleter, region and account
+        groups = defaultdict(list)
+        while pending:
+            resource = deletions.resources[pending.popleft()]
+            groups[_batch_key(resource)].append(resource)
+        count = 0
+        for (deleter, _, _), group in groups.items():
+            size = deleter.batch_size if deleter is not None else 1
+            for i in range(0, len(group), size):
+                tasks.put(group[i:i + size])
+                count += 1
+        return count
+
+    running = 0
+    try:
+        running += dispatch()
+        while running:
+            batch, error = results.get()
+            running -= 1
+            urids = [r.urid() for r in batch]
+            if error is not None:
+                logging.warn('unable to delete %s: %s', ', '.join(urids), error)
+                failed.update((urid, error) for urid in urids)
+            else:
+                log.record(urids)
+                for urid in urids:
+                    deleted.append(urid)
+                    if len(deleted) % PROGRESS_INTERVAL == 0:
+                        logging.info('deleted %d/%d resources', len(deleted), len(deletions.resources))
+                    pending.extend(deletions.deleted(urid))
+            running += dispatch()
+    finally:
+        for _ in threads:
+            tasks.put(None)
+        log.close()
+
+    kept = set(deleted) | set(failed)
+    blocked = [urid for urid in sorted(deletions.resources) if urid not in kept]
+    log.close(completed=not failed and not blocked)
+    logging.info('deleted %d resources, %d failed, %d blocked', len(deleted), len(failed), len(blocked))
+    return deleted, failed, blocked
@@ -4,10 +4,21 @@ except ImportError:
     # noinspection PyPep8Naming
     import configparser as ConfigParser
 
-import pkgutil
+import types
 
 from garbo.config import aws
+from garbo.config import cleanup
 from garbo.config import dummy_storage
+from garbo.config import metrics
+from garbo.config import pipeline
+from garbo.config import retention
+from garbo.config import server
+from garbo.config import shards
+from garbo.config import snapshot_storage
+from garbo.config import sqlite_storage
+from garbo.config import storage
+from garbo.config import stream_storage
+from garbo.config import usage
 
 __author__ = 'nati'
 
@@ -18,12 +29,36 @@ def load(filename='garbo.cfg'):
 
     :type filename: configuration file. default: garbo.cfg in current directory
     """
-    # TODO: remove ugly hack
-    config_modules = set([name for _, name, _ in
-                          pkgutil.iter_modules(['garbo/config'])])
+    sections = _sections()
     config = ConfigParser.RawConfigParser()
     config.read(filename)
     for section in config.sections():
-        if section in config_modules:
+        if section in sections:
             for k, v in config.items(section):
-                globals().get(section).__setattr__(k, v)
+                setattr(sections[section], k, v)
+
+
+def _sections():
+    return {name: module for name, module in globals().items()
+            if isinstance(module, types.ModuleType) and module.__name__ == 'garbo.config.%s' % name}
+
+
+def snapshot():
+    """
+    :return: the current configuration, by section (eg. to configure worker processes)
+    """
+    return {name: {k: v for k, v in vars(module).items()
+                   if not k.startswith('_') and not isinstance(v, types.ModuleType)}
+            for name, module in _sections().items()}
+
+
+def restore(settings):
+    """
+    Restore a configuration snapshot
+
+    :param settings: see snapshot
+    """
+    sections = _sections()
+    for section, values in settings.items():
+        for k, v in values.items():
+            setattr(sections[section], k, v)
@@ -5,5 +5,24 @@ import os
 access_key = os.environ.get('AMAZON_ACCESS_KEY_ID', '')
 secret_access_key = os.environ.get('AMAZON_SECRET_ACCESS_KEY', '')
 
+# YAML list of accounts to discover (see garbo.discovery.aws.accounts.load_accounts),
+#   leave empty to discover only the account of access_key
+accounts_file = ''
+# number of accounts to discover concurrently, each by its own worker process
+account_processes = 4
+
 # which regions to discover, set to [] for all regions
 regions = ['us-east-1', 'eu-west-1']
+
+# number of (region, collector) pairs to discover concurrently, set to 1 for a sequential discovery
+workers = 8
+
+# maximal number of resources to fetch per API call (capped by each API's own limit)
+page_size = 1000
+
+# initial requests per second, and concurrent requests, per service and region
+#   (both adapt to AWS throttling during the discovery)
+request_rate = 10
+request_concurrency = 4
+# how many times to retry a throttled request
+max_retries = 8
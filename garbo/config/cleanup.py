@@ -0,0 +1,7 @@
+__author__ = 'nati'
+
+working_dir = '.'
+# deleted resources of an interrupted cleanup, removed once a cleanup completes
+log_filename = 'cleanup.log'
+# concurrent delete calls (each also limited by the AWS request scheduler)
+workers = 16
@@ -0,0 +1,6 @@
+__author__ = 'nati'
+
+# JSON summary of the run metrics, leave empty to disable
+json_filename = ''
+# Prometheus text format metrics (eg. in the node exporter textfile directory), leave empty to disable
+prometheus_filename = ''
@@ -0,0 +1,4 @@
+__author__ = 'nati'
+
+# maximal number of discovered items waiting for each pipeline stage (storage, index)
+queue_size = 10000
@@ -0,0 +1,5 @@
+__author__ = 'nati'
+
+# retention index, see garbo.storage.retention
+working_dir = '.'
+filename = 'retention.db'
@@ -0,0 +1,10 @@
+__author__ = 'nati'
+
+host = '127.0.0.1'
+port = 8000
+# directory of the viewer files
+static_dir = 'd3js'
+# default number of resources per subgraph page
+page_size = 1000
+# maximal depth of a resource neighborhood (number of relations away from the resource)
+max_depth = 10
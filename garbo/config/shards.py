@@ -0,0 +1,7 @@
+__author__ = 'nati'
+
+# discovery shards directory, see garbo.storage.shards
+working_dir = '.'
+dirname = 'shards'
+# resume an interrupted discovery only if it started up to resume_max_age seconds ago
+resume_max_age = 86400
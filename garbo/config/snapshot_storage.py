@@ -0,0 +1,4 @@
+__author__ = 'nati'
+
+working_dir = '.'
+snapshot_filename = 'graph.snapshot'
@@ -0,0 +1,4 @@
+__author__ = 'nati'
+
+working_dir = '.'
+db_filename = 'graph.db'
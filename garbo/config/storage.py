@@ -0,0 +1,4 @@
+__author__ = 'nati'
+
+# storage backend plugin (dummy, stream, sqlite, snapshot), see garbo.plugins
+backend = 'dummy'
@@ -0,0 +1,6 @@
+__author__ = 'nati'
+
+working_dir = '.'
+graph_filename = 'graph.log'
+# gzip the graph log
+compress = False
@@ -0,0 +1,10 @@
+__author__ = 'nati'
+
+working_dir = '.'
+cache_filename = 'usage.p'
+# seconds to reuse a usage probe result
+ttl = 3600
+# concurrent usage probe batches
+workers = 8
+# a resource is used if it was active during the last period_days days
+period_days = 14
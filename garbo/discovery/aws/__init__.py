@@ -3,6 +3,7 @@
 """
 
 from garbo.discovery.aws.utils import collect_all
+from garbo.discovery.aws.accounts import Account, collect_accounts, load_accounts
 
 from garbo.discovery.aws import ec2, storage
 
@@ -0,0 +1,171 @@
+"""
+    Multi-account AWS discovery
+
+    Every account is discovered by its own worker process (running its own concurrent collectors, under its
+      own request scheduler) into its own shards, and the shards are merged into a single graph. Resources
+      urids are qualified by their account ID, so relations between accounts (eg. shared AMIs, peered
+      security groups) resolve as edges between the accounts resources.
+"""
+
+import logging
+import multiprocessing
+import re
+import threading
+import time
+
+import boto.sts
+import yaml
+
+from garbo import config, metrics
+from garbo.discovery.aws.utils import collect_all
+
+__author__ = 'nati'
+
+_ROLE_ARN_ACCOUNT = re.compile(r'^arn:aws[\w-]*:iam::(\d{12}):')
+
+# seconds to reuse the credentials of an account (assumed role sessions last an hour)
+CREDENTIALS_TTL = 3000
+
+# (time, credentials) by account ID, see account_credentials
+_credentials = {}
+_credentials_lock = threading.Lock()
+
+
+class Account(object):
+    """
+    An AWS account to discover, with its own credentials or a role to assume
+    """
+
+    def __init__(self, account_id, name=None, access_key=None, secret_key=None, role_arn=None, external_id=None):
+        """
+        :param account_id: AWS account ID (12 digits)
+        :param name: display name (default: the account ID)
+        :param access_key: access key of the account (default: config.aws.access_key)
+        :param secret_key: secret key of the account (default: config.aws.secret_access_key)
+        :param role_arn: role to assume (using the access key) for discovering the account
+        :param external_id: external ID required by the role
+        """
+        self.id = str(account_id)
+        self.name = name or self.id
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.role_arn = role_arn
+        self.external_id = external_id
+
+    def credentials(self):
+        """
+        :return: (access key, secret key, security token) of the account, assuming its role if it has one
+        """
+        access_key = self.access_key or config.aws.access_key
+        secret_key = self.secret_key or config.aws.secret_access_key
+        if not self.role_arn:
+            return access_key, secret_key, None
+        sts = boto.sts.STSConnection(aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+        role = sts.assume_role(self.role_arn, 'garbo-discovery', external_id=self.external_id)
+        return role.credentials.access_key, role.credentials.secret_key, role.credentials.session_token
+
+    def __str__(self):
+        return self.name if self.name == self.id else '%s (%s)' % (self.name, self.id)
+
+
+def load_accounts(filename):
+    """
+    Load accounts from a YAML list, eg.
+        - name: production
+          role_arn: arn:aws:iam::123456789012:role/garbo
+        - id: '210987654321'
+          access_key: ...
+          secret_key: ...
+
+    :return: list of Account
+    """
+    with open(filename) as accounts_file:
+        entries = yaml.safe_load(accounts_file) or []
+    accounts = []
+    for entry in entries:
+        account_id = entry.get('id')
+        if not account_id and entry.get('role_arn'):
+            match = _ROLE_ARN_ACCOUNT.match(entry['role_arn'])
+            account_id = match and match.group(1)
+        if not account_id:
+            raise ValueError('account %s has no id (or role_arn)' % entry)
+        accounts.append(Account(account_id, name=entry.get('name'), access_key=entry.get('access_key'),
+                                secret_key=entry.get('secret_key'), role_arn=entry.get('role_arn'),
+                                external_id=entry.get('external_id')))
+    return accounts
+
+
+def account_credentials(account_id=None):
+    """
+    Credentials of the account owning discovered resources, eg. to probe or delete them
+
+    :param account_id: account ID qualifying the resources, None for a single account discovery
+    :return: (access key, secret key, security token)
+    """
+    if account_id is None:
+        return config.aws.access_key, config.aws.secret_access_key, None
+    with _credentials_lock:
+        entry = _credentials.get(account_id)
+        if entry is None or time.time() - entry[0] > CREDENTIALS_TTL:
+            accounts = load_accounts(config.aws.accounts_file) if config.aws.accounts_file else []
+            account = next((a for a in accounts if a.id == account_id), None)
+            if account is None:
+                raise ValueError('account %s is not in the accounts file (config.aws.accounts_file)' % account_id)
+            entry = _credentials[account_id] = (time.time(), account.credentials())
+        return entry[1]
+
+
+def _discover_account(task):
+    """
+    Discover a single account into its shards (in a worker process)
+
+    :return: the account, the (account, region, collector) keys of its shards (None if the discovery failed),
+      and the collector metrics of the discovery (see garbo.metrics.collectors)
+    """
+    account, account_ids, shards, max_age, settings = task
+    config.restore(settings)
+    # a worker process discovers several accounts, each reports only its own metrics
+    metrics.reset()
+    try:
+        aws_access_key, aws_secret_key, aws_security_token = account.credentials()
+        count = 0
+        for _ in collect_all(aws_access_key, aws_secret_key, shards=shards, max_age=max_age,
+                             aws_security_token=aws_security_token, account=account.id, accounts=account_ids):
+            count += 1
+        logging.info('discovered %d items in account %s', count, account)
+        return account, sorted(shards.completed), metrics.collectors()
+    except Exception:
+        logging.exception('unable to discover account %s', account)
+        return account, None, metrics.collectors()
+
+
+def collect_accounts(accounts, shards, processes=None, max_age=None):
+    """
+    Yield all the resources and relations of multiple AWS accounts, merged from their shards
+
+    The collector metrics of the worker processes are merged into this process's, and the accounts whose
+      discovery failed are left out of the graph and recorded (see garbo.metrics.discovery_failures)
+
+    :param accounts: list of Account
+    :param shards: garbo.storage.shards.ShardStore the accounts are discovered into
+    :param processes: number of accounts to discover concurrently (default: config.aws.account_processes)
+    :param max_age: reuse shards of up to max_age seconds, see collect_all
+    """
+    processes = min(int(processes or config.aws.account_processes), len(accounts))
+    account_ids = [a.id for a in accounts]
+    settings = config.snapshot()
+    logging.info('discovering %d AWS accounts with %d processes', len(accounts), processes)
+    pool = multiprocessing.Pool(processes)
+    try:
+        tasks = [(account, account_ids, shards, max_age, settings) for account in accounts]
+        for account, completed, collectors in pool.imap_unordered(_discover_account, tasks):
+            # collector metrics of the worker processes, summed over the accounts
+            metrics.merge_collectors(collectors)
+            if completed is None:
+                metrics.count_failure('account %s' % account.id)
+                continue
+            for account_id, region, collector in completed:
+                for item in shards.read(account_id, region, collector):
+                    yield item
+    finally:
+        pool.terminate()
@@ -0,0 +1,86 @@
+"""
+    Reusable AWS connections for garbo collectors
+"""
+
+import functools
+import logging
+import threading
+
+from garbo import metrics
+from garbo.discovery.aws.scheduler import scheduled
+
+__author__ = 'nati'
+
+# boto connections are not thread safe, each thread keeps its own pool of connections
+_local = threading.local()
+
+# connects instead of boto when set, see set_backend
+_backend = None
+
+
+def set_backend(backend):
+    """
+    Route new connections to a fake AWS backend (eg. garbo.discovery.aws.fake.FakeAWS), None to use boto
+
+    :param backend: object with a connect(connect, region, **credentials) method, returning a connection
+    """
+    global _backend
+    _backend = backend
+
+
+def get_connection(connect, region, aws_access_key, aws_secret_key, aws_security_token=None):
+    """
+    Return a connection for (service, region, credentials), reusing a previously opened one if possible
+
+    Connections are kept per thread, so they can be safely used by concurrent collectors, while the
+      underlying HTTP connections are kept alive between collectors running on the same thread.
+    API calls made through the connection are rate limited and retried by the request scheduler.
+
+    :param connect: boto connect_to_region function of the service (eg. boto.ec2.connect_to_region)
+    :param region: AWS region name
+    :param aws_access_key:
+    :param aws_secret_key:
+    :param aws_security_token: session token of temporary credentials (eg. of an assumed role)
+    """
+    pool = getattr(_local, 'connections', None)
+    if pool is None:
+        pool = _local.connections = {}
+    backend = _backend
+    key = (connect, region, aws_access_key, aws_secret_key, aws_security_token, backend)
+    conn = pool.get(key)
+    if conn is None:
+        open_connection = functools.partial(backend.connect, connect) if backend is not None else connect
+        conn = pool[key] = scheduled(_instrumented(open_connection(region,
+                                                                   aws_access_key_id=aws_access_key,
+                                                                   aws_secret_access_key=aws_secret_key,
+                                                                   security_token=aws_security_token)),
+                                     service=connect.__module__, region=region)
+    return conn
+
+
+def _instrumented(conn):
+    """
+    Count every API request made through the connection
+    """
+    make_request = conn.make_request
+
+    @functools.wraps(make_request)
+    def counted_make_request(*args, **kwargs):
+        metrics.count_api_call()
+        return make_request(*args, **kwargs)
+
+    conn.make_request = counted_make_request
+    return conn
+
+
+def close_all():
+    """
+    Close all the connections opened by the current thread
+    """
+    pool = getattr(_local, 'connections', None) or {}
+    for conn in pool.values():
+        try:
+            conn.close()
+        except Exception:
+            logging.debug('unable to close connection %s', conn, exc_info=True)
+    pool.clear()
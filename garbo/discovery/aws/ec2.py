@@ -8,7 +8,7 @@ import boto.ec2.autoscale
 import boto.ec2.elb
 import boto.exception
 
-from garbo.discovery.aws.utils import aws_collector
+from garbo.discovery.aws.utils import aws_collector, paginate, page_size
 from garbo.model.aws import EBSSnapshot, EBSVolume, Image, Instance, LoadBalancer, SecurityGroup, ElasticIP, \
     KeyPair, AutoScalingGroup, LaunchConfiguration
 from garbo.model import Relation
@@ -17,224 +17,265 @@ __author__ = 'nati'
 
 
 @aws_collector()
-def snapshots(conn):
+def snapshots(conn, inventory):
     """
     Collect EC2 EBS Snapshots created by this account
 
     :param conn: boto EC2 connection
+    :param inventory: region inventory
+    :type inventory: garbo.discovery.aws.utils.RegionInventory
     """
-    volume_ids = [v.id for v in conn.get_all_volumes()]
-    for snapshot in conn.get_all_snapshots(owner='self'):
-        snapshot_resource = EBSSnapshot(region=conn.region.name, resource_id=snapshot.id,
-                                        created=boto.utils.parse_ts(snapshot.start_time))
+    # listed once per region, by the inventory. Relations wait for the volumes listing, so the snapshots are
+    #   yielded as their pages arrive
+    related = []
+    for snapshot_id, (start_time, volume_id) in inventory.walk_snapshots():
+        snapshot_resource = EBSSnapshot(region=conn.region.name, resource_id=snapshot_id,
+                                        created=boto.utils.parse_ts(start_time), account=inventory.account)
         yield snapshot_resource
-        if snapshot.volume_id in volume_ids:
-            yield Relation(snapshot_resource,
-                           EBSVolume(region=conn.region.name, resource_id=snapshot.volume_id))
+        if volume_id:
+            related.append((snapshot_resource, volume_id))
+    volumes = inventory.volumes
+    for snapshot_resource, volume_id in related:
+        if volume_id in volumes:
+            yield Relation(snapshot_resource, EBSVolume.make_urid(conn.region.name, volume_id, inventory.account))
 
 
 @aws_collector(conn_obj=boto.ec2.elb.connect_to_region)
-def load_balancers(conn):
+def load_balancers(conn, inventory):
     """
     Collect EC2 Elastic Load Balances (ELBs)
 
     :param conn: boto EC2 connection
+    :param inventory: region inventory
+    :type inventory: garbo.discovery.aws.utils.RegionInventory
     """
-    for elb in conn.get_all_load_balancers():
+    for elb in paginate(conn.get_all_load_balancers, token_arg='marker', token_attr='next_marker'):
         lb_resource = LoadBalancer(region=conn.region.name, resource_id=elb.name,
-                                   created=boto.utils.parse_ts(elb.created_time))
+                                   created=boto.utils.parse_ts(elb.created_time), account=inventory.account)
         yield lb_resource
         # security groups relations
         for group_id in elb.security_groups:
             yield Relation(lb_resource,
-                           SecurityGroup(region=conn.region.name, resource_id=group_id),
+                           SecurityGroup.make_urid(conn.region.name, group_id, inventory.account),
                            dependency=True)
         # instances relations
         for instance_id in {i.id for i in elb.instances}:
             yield Relation(lb_resource,
-                           Instance(region=conn.region.name, resource_id=instance_id),
+                           Instance.make_urid(conn.region.name, instance_id, inventory.account),
                            dependency=True)
 
 
 @aws_collector()
-def security_groups(conn):
+def security_groups(conn, inventory):
     """
     Collect EC2 Security Groups
 
     :param conn: boto EC2 connection
+    :param inventory: region inventory
+    :type inventory: garbo.discovery.aws.utils.RegionInventory
     """
     for group in conn.get_all_security_groups():
         # Fun fact: there is no creation/modification date associated with AWS security groups
         sg_resource = SecurityGroup(region=conn.region.name, resource_id=group.id,
-                                    cleanup_candidate=SecurityGroup.is_cleanup_candidate(group))
+                                    cleanup_candidate=SecurityGroup.is_cleanup_candidate(group),
+                                    account=inventory.account)
         yield sg_resource
         # add cross-group dependency
         for group_id in {g.group_id for r in group.rules + group.rules_egress for g in r.grants
                          if g.group_id and g.owner_id == group.owner_id}:
             yield Relation(sg_resource,
-                           SecurityGroup(region=conn.region.name, resource_id=group_id),
+                           SecurityGroup.make_urid(conn.region.name, group_id, inventory.account),
+                           dependency=True)
+        # peered groups of other discovered accounts
+        for group_id, owner_id in {(g.group_id, g.owner_id) for r in group.rules + group.rules_egress
+                                   for g in r.grants
+                                   if g.group_id and g.owner_id != group.owner_id and g.owner_id in inventory.accounts}:
+            yield Relation(sg_resource,
+                           SecurityGroup.make_urid(conn.region.name, group_id, owner_id),
                            dependency=True)
 
 
 @aws_collector()
-def key_pairs(conn):
+def key_pairs(conn, inventory):
     """
     Collect EC2 Key Pairs
 
     :param conn: boto EC2 connection
+    :param inventory: region inventory
+    :type inventory: garbo.discovery.aws.utils.RegionInventory
     """
     for key_pair in conn.get_all_key_pairs():
-        yield KeyPair(region=conn.region.name, resource_id=key_pair.name)
+        yield KeyPair(region=conn.region.name, resource_id=key_pair.name, account=inventory.account)
 
 
-@aws_collector()
-def launch_configurations(conn):
+@aws_collector(conn_obj=boto.ec2.autoscale.connect_to_region)
+def launch_configurations(conn, inventory):
     """
     Collect EC2 Elastic IPs
 
     :param conn: boto EC2 connection
+    :param inventory: region inventory
+    :type inventory: garbo.discovery.aws.utils.RegionInventory
     """
-    # using EC2 connection to fetch self owned image ids
-    image_ids = [i.id for i in conn.get_all_images(owners='self')]
-    # switching to autoscale connection to fetch Launch Configurations
-    conn = boto.ec2.autoscale.connect_to_region(conn.region.name,
-                                                aws_access_key_id=conn.provider.access_key,
-                                                aws_secret_access_key=conn.provider.secret_key)
-    for lc in conn.get_all_launch_configurations():
+    for lc in paginate(conn.get_all_launch_configurations, max_records=page_size(100)):
         # Fun Fact: LaunchConfiguration created_time is not an ISO 8601, but a parsed datetime
         lc_resource = LaunchConfiguration(region=conn.region.name, resource_id=lc.name,
-                                          created=lc.created_time)
+                                          created=lc.created_time, account=inventory.account)
         yield lc_resource
         # key pair relation
         if lc.key_name:
             yield Relation(lc_resource,
-                           KeyPair(region=conn.region.name, resource_id=lc.key_name),
+                           KeyPair.make_urid(conn.region.name, lc.key_name, inventory.account),
                            dependency=True)
         # self owned image relation
-        if lc.image_id in image_ids:
+        if lc.image_id in inventory.images:
             yield Relation(lc_resource,
-                           Image(region=conn.region.name, resource_id=lc.image_id),
+                           Image.make_urid(conn.region.name, lc.image_id, inventory.account),
+                           dependency=True)
+        # image shared by another discovered account
+        elif lc.image_id in inventory.shared_images:
+            yield Relation(lc_resource,
+                           Image.make_urid(conn.region.name, lc.image_id, inventory.shared_images[lc.image_id]),
                            dependency=True)
         # security groups relations
         for group_id in set(lc.security_groups):
             yield Relation(lc_resource,
-                           SecurityGroup(region=conn.region.name, resource_id=group_id),
+                           SecurityGroup.make_urid(conn.region.name, group_id, inventory.account),
                            dependency=True)
 
 
 @aws_collector(conn_obj=boto.ec2.autoscale.connect_to_region)
-def auto_scaling_groups(conn):
+def auto_scaling_groups(conn, inventory):
     """
     Collect EC2 Elastic IPs
 
     :param conn: boto EC2 connection
+    :param inventory: region inventory
+    :type inventory: garbo.discovery.aws.utils.RegionInventory
     """
-    for asg in conn.get_all_groups():
+    for asg in paginate(conn.get_all_groups, max_records=page_size(100)):
         asg_resource = AutoScalingGroup(region=conn.region.name, resource_id=asg.name,
-                                        created=boto.utils.parse_ts(asg.created_time))
+                                        created=boto.utils.parse_ts(asg.created_time), account=inventory.account)
         yield asg_resource
         # Auto Scaling Group is associated with multiple instances
         for instance_id in {i.instance_id for i in asg.instances}:
             yield Relation(asg_resource,
-                           Instance(region=conn.region.name, resource_id=instance_id),
+                           Instance.make_urid(conn.region.name, instance_id, inventory.account),
                            dependency=True)
         # Launch Configuration
         if asg.launch_config_name:
             yield Relation(asg_resource,
-                           LaunchConfiguration(region=conn.region.name, resource_id=asg.launch_config_name),
+                           LaunchConfiguration.make_urid(conn.region.name, asg.launch_config_name, inventory.account),
                            dependency=True)
         # Associated Load Balancers
         for lb_name in asg.load_balancers:
-            yield Relation(LoadBalancer(region=conn.region.name, resource_id=lb_name),
+            yield Relation(LoadBalancer.make_urid(conn.region.name, lb_name, inventory.account),
                            asg_resource,
                            dependency=True)
 
 
 @aws_collector()
-def elastic_ips(conn):
+def elastic_ips(conn, inventory):
     """
     Collect EC2 Elastic IPs
 
     :param conn: boto EC2 connection
+    :param inventory: region inventory
+    :type inventory: garbo.discovery.aws.utils.RegionInventory
     """
     for address in conn.get_all_addresses():
-        address_resource = ElasticIP(region=conn.region.name, resource_id=address.public_ip)
+        address_resource = ElasticIP(region=conn.region.name, resource_id=address.public_ip, account=inventory.account)
         yield address_resource
         # an address is usually associated with an instance
         if address.instance_id:
-            yield Relation(Instance(region=conn.region.name, resource_id=address.instance_id),
+            yield Relation(Instance.make_urid(conn.region.name, address.instance_id, inventory.account),
                            address_resource,
                            dependency=True)
 
 
 @aws_collector()
-def images(conn):
+def images(conn, inventory):
     """
     Collect EC2 Amazon Machine Images (AMIs) created by this account
 
     :param conn: boto EC2 connection
+    :param inventory: region inventory
+    :type inventory: garbo.discovery.aws.utils.RegionInventory
     """
-    snapshot_ids = [s.id for s in conn.get_all_snapshots(owner='self')]
-    for image in conn.get_all_images(owners='self'):
+    for image in inventory.images.values():
         image_resource = Image(region=conn.region.name, resource_id=image.id,
-                               created=boto.utils.parse_ts(image.creationDate))
+                               created=boto.utils.parse_ts(image.creationDate), account=inventory.account)
         yield image_resource
         # Images can have mapping to an EBS snapshot (stored in S3)
         for snapshot_id in {v.snapshot_id for v in image.block_device_mapping.values()
-                            if v.snapshot_id in snapshot_ids}:
+                            if v.snapshot_id in inventory.snapshots}:
             yield Relation(image_resource,
-                           EBSSnapshot(region=conn.region.name, resource_id=snapshot_id),
+                           EBSSnapshot.make_urid(conn.region.name, snapshot_id, inventory.account),
                            dependency=True)
 
 
 @aws_collector()
-def instances(conn):
+def instances(conn, inventory):
     """
     Collect EC2 Instances
 
     :param conn: boto EC2 connection
+    :param inventory: region inventory
+    :type inventory: garbo.discovery.aws.utils.RegionInventory
     """
-    image_ids = [i.id for i in conn.get_all_images(owners='self')]
-    for instance in conn.get_only_instances():
+    for instance in (i for r in paginate(conn.get_all_reservations, max_results=page_size(1000))
+                     for i in r.instances):
         instance_resource = Instance(region=conn.region.name, resource_id=instance.id,
                                      created=boto.utils.parse_ts(instance.launch_time),
                                      used=Instance.is_running(instance),
-                                     cleanup_candidate=Instance.is_cleanup_candidate(instance))
+                                     cleanup_candidate=Instance.is_cleanup_candidate(instance),
+                                     account=inventory.account)
         yield instance_resource
         if instance.key_name:
             yield Relation(instance_resource,
-                           KeyPair(region=conn.region.name, resource_id=instance.key_name),
+                           KeyPair.make_urid(conn.region.name, instance.key_name, inventory.account),
                            dependency=True)
-        # only yield relations for self-owned images
-        if instance.image_id in image_ids:
+        # only yield relations for self-owned images, or images shared by other discovered accounts
+        if instance.image_id in inventory.images:
+            yield Relation(instance_resource,
+                           Image.make_urid(conn.region.name, instance.image_id, inventory.account))
+        elif instance.image_id in inventory.shared_images:
             yield Relation(instance_resource,
-                           Image(region=conn.region.name, resource_id=instance.image_id))
+                           Image.make_urid(conn.region.name, instance.image_id,
+                                           inventory.shared_images[instance.image_id]))
         # security groups relations
         for group_id in {sg.id for sg in instance.groups}:
             yield Relation(instance_resource,
-                           SecurityGroup(region=conn.region.name, resource_id=group_id),
+                           SecurityGroup.make_urid(conn.region.name, group_id, inventory.account),
                            dependency=True)
 
 
 @aws_collector()
-def ebs_volumes(conn):
+def ebs_volumes(conn, inventory):
     """
     Collect EC2 EBS Volumes
 
     :param conn: boto EC2 connection
+    :param inventory: region inventory
+    :type inventory: garbo.discovery.aws.utils.RegionInventory
     """
-    snapshot_ids = [s.id for s in conn.get_all_snapshots(owner='self')]
-    for volume in conn.get_all_volumes():
-        ebs_volume_resource = EBSVolume(region=conn.region.name, resource_id=volume.id,
-                                        created=boto.utils.parse_ts(volume.create_time))
+    # listed once per region, by the inventory. Relations to snapshots wait for the snapshots listing, so the
+    #   volumes are yielded as their pages arrive
+    related = []
+    for volume_id, (create_time, instance_id, snapshot_id) in inventory.walk_volumes():
+        ebs_volume_resource = EBSVolume(region=conn.region.name, resource_id=volume_id,
+                                        created=boto.utils.parse_ts(create_time), account=inventory.account)
         yield ebs_volume_resource
         # If volume is attached, yield a relation to the instance
-        if volume.attach_data.status in ('attaching', 'attached'):
-            yield Relation(Instance(region=conn.region.name,
-                                    resource_id=volume.attach_data.instance_id),
+        if instance_id is not None:
+            yield Relation(Instance.make_urid(conn.region.name, instance_id, inventory.account),
                            ebs_volume_resource,
                            dependency=True)
-        # Which snapshot was this volume created from
-        if volume.snapshot_id in snapshot_ids:
+        if snapshot_id:
+            related.append((ebs_volume_resource, snapshot_id))
+    # Which snapshot was each volume created from
+    snapshots = inventory.snapshots
+    for ebs_volume_resource, snapshot_id in related:
+        if snapshot_id in snapshots:
             yield Relation(ebs_volume_resource,
-                           EBSSnapshot(region=conn.region.name, resource_id=volume.snapshot_id))
+                           EBSSnapshot.make_urid(conn.region.name, snapshot_id, inventory.account))
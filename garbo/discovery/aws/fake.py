@@ -0,0 +1,268 @@
+"""
+    Fake AWS backend- an in-process stand-in for the boto connections used by the collectors
+
+    The backend serves a garbo.synthetic.SyntheticAccount through the API calls the collectors make, with
+      configurable per-call latency, page sizes and throttling error rate, so the discovery (concurrency,
+      pagination, retries) can be tested and benchmarked deterministically, without a network:
+
+        with FakeAWS(SyntheticAccount(10000), latency=0.02, throttling_rate=0.05):
+            graph = list(collect_all('fake', 'fake'))
+
+    Fake connections go through the same connection pools and request scheduler as boto connections. Whether
+      a request is throttled depends only on the seed, the request and its attempt number, so a run is
+      reproducible whatever the order the concurrent collectors make their requests.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+import random
+import threading
+import time
+
+import boto.exception
+
+from garbo.discovery.aws import connections
+from garbo.model.aws import EBSSnapshot, EBSVolume, Image, Instance, LoadBalancer, SecurityGroup, ElasticIP, \
+    KeyPair, AutoScalingGroup, LaunchConfiguration, CacheCluster
+
+__author__ = 'nati'
+
+FAKE_ACCOUNT_ID = '000000000000'
+# creation time of all the fake resources
+CREATED = '2016-01-01T00:00:00.000Z'
+# Instance state code of the fake instances (stopped), matching the synthetic graph (not in use)
+INSTANCE_STATE_CODE = 80
+
+_THROTTLING_BODY = ('<Response><Errors><Error><Code>Throttling</Code><Message>Rate exceeded</Message></Error>'
+                    '</Errors></Response>')
+
+
+class _Item(object):
+    """
+    A boto response object, with the given attributes
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class _Page(list):
+    """
+    A boto ResultSet page
+    """
+
+    def __init__(self, items, **tokens):
+        super(_Page, self).__init__(items)
+        self.__dict__.update(tokens)
+
+
+class _Region(object):
+    """
+    The API responses items of a single region of a synthetic account
+    """
+
+    def __init__(self, account, region):
+        ids = {cls: sorted(resource_id for r, resource_id in keys if r == region)
+               for cls, keys in account.resources.items()}
+        # relation targets by (source class, source ID), by target class
+        targets = defaultdict(lambda: defaultdict(list))
+        sources = defaultdict(lambda: defaultdict(list))
+        for source_cls, (r, source), target_cls, (_, target), _ in account.relations:
+            if r == region:
+                targets[(source_cls, source)][target_cls].append(target)
+                sources[(target_cls, target)][source_cls].append(source)
+
+        def first(values):
+            return values[0] if values else None
+
+        self.snapshots = [_Item(id=i, start_time=CREATED,
+                                volume_id=first(targets[(EBSSnapshot, i)][EBSVolume]))
+                          for i in ids[EBSSnapshot]]
+        self.volumes = [_Item(id=i, create_time=CREATED,
+                              attach_data=_Item(status='attached' if sources[(EBSVolume, i)][Instance] else None,
+                                                instance_id=first(sources[(EBSVolume, i)][Instance])),
+                              snapshot_id=first(targets[(EBSVolume, i)][EBSSnapshot]))
+                        for i in ids[EBSVolume]]
+        self.security_groups = [_Item(id=i, name=i, owner_id=FAKE_ACCOUNT_ID, rules_egress=[],
+                                      rules=[_Item(grants=[_Item(group_id=g, owner_id=FAKE_ACCOUNT_ID)
+                                                           for g in targets[(SecurityGroup, i)][SecurityGroup]])])
+                                for i in ids[SecurityGroup]]
+        self.key_pairs = [_Item(name=i) for i in ids[KeyPair]]
+        self.addresses = [_Item(public_ip=i, instance_id=first(sources[(ElasticIP, i)][Instance]))
+                          for i in ids[ElasticIP]]
+        self.images = [_Item(id=i, owner_id=FAKE_ACCOUNT_ID, creationDate=CREATED,
+                             block_device_mapping={'/dev/sd%s' % chr(ord('a') + n): _Item(snapshot_id=s)
+                                                   for n, s in enumerate(targets[(Image, i)][EBSSnapshot])})
+                       for i in ids[Image]]
+        self.reservations = [_Item(instances=[_Item(id=i, launch_time=CREATED, state_code=INSTANCE_STATE_CODE,
+                                                    key_name=first(targets[(Instance, i)][KeyPair]),
+                                                    image_id=first(targets[(Instance, i)][Image]),
+                                                    groups=[_Item(id=g)
+                                                            for g in targets[(Instance, i)][SecurityGroup]])])
+                             for i in ids[Instance]]
+        self.load_balancers = [_Item(name=i, created_time=CREATED,
+                                     security_groups=targets[(LoadBalancer, i)][SecurityGroup],
+                                     instances=[_Item(id=n) for n in targets[(LoadBalancer, i)][Instance]])
+                               for i in ids[LoadBalancer]]
+        self.launch_configurations = [_Item(name=i, created_time=datetime(2016, 1, 1),
+                                            key_name=first(targets[(LaunchConfiguration, i)][KeyPair]),
+                                            image_id=first(targets[(LaunchConfiguration, i)][Image]),
+                                            security_groups=targets[(LaunchConfiguration, i)][SecurityGroup])
+                                      for i in ids[LaunchConfiguration]]
+        self.groups = [_Item(name=i, created_time=CREATED,
+                             instances=[_Item(instance_id=n) for n in targets[(AutoScalingGroup, i)][Instance]],
+                             launch_config_name=first(targets[(AutoScalingGroup, i)][LaunchConfiguration]),
+                             load_balancers=sources[(AutoScalingGroup, i)][LoadBalancer])
+                       for i in ids[AutoScalingGroup]]
+        self.cache_clusters = [{'CacheClusterId': i, 'CacheClusterCreateTime': 1451606400,
+                                'SecurityGroups': [{'SecurityGroupId': g, 'Status': 'active'}
+                                                   for g in targets[(CacheCluster, i)][SecurityGroup]]}
+                               for i in ids[CacheCluster]]
+
+
+class FakeConnection(object):
+    """
+    A fake boto connection of a single (service, region), with the methods used by the collectors
+
+    Every API call goes through get_list and make_request, like boto's, so fake connections are scheduled
+      and instrumented just like boto connections.
+    """
+
+    def __init__(self, backend, region, aws_access_key_id=None, aws_secret_access_key=None, security_token=None):
+        self._backend = backend
+        self.region = _Item(name=region)
+        self.provider = _Item(access_key=aws_access_key_id, secret_key=aws_secret_access_key,
+                              security_token=security_token)
+
+    def make_request(self, action, params=None, path='/', verb='GET'):
+        self._backend.request(self.region.name, action, params or {})
+
+    def get_list(self, action, params, markers=None, path='/', parent=None, verb='GET'):
+        self.make_request(action, params, path, verb)
+        return self._backend.respond(self.region.name, action, params)
+
+    def close(self):
+        pass
+
+    # EC2
+    def get_all_security_groups(self):
+        return self.get_list('DescribeSecurityGroups', {})
+
+    def get_all_key_pairs(self):
+        return self.get_list('DescribeKeyPairs', {})
+
+    def get_all_addresses(self):
+        return self.get_list('DescribeAddresses', {})
+
+    def get_all_images(self, owners=None, executable_by=None):
+        return self.get_list('DescribeImages', {'Owner': owners, 'ExecutableBy': executable_by})
+
+    def get_all_reservations(self, max_results=None, next_token=None):
+        return self.get_list('DescribeInstances', {'MaxResults': max_results, 'NextToken': next_token})
+
+    # ELB
+    def get_all_load_balancers(self, marker=None):
+        return self.get_list('DescribeLoadBalancers', {'Marker': marker})
+
+    # Auto Scaling
+    def get_all_launch_configurations(self, max_records=None, next_token=None):
+        return self.get_list('DescribeLaunchConfigurations', {'MaxRecords': max_records, 'NextToken': next_token})
+
+    def get_all_groups(self, max_records=None, next_token=None):
+        return self.get_list('DescribeAutoScalingGroups', {'MaxRecords': max_records, 'NextToken': next_token})
+
+    # ElastiCache
+    def describe_cache_clusters(self, max_records=None, marker=None):
+        return self.get_list('DescribeCacheClusters', {'MaxRecords': max_records, 'Marker': marker})
+
+
+class FakeAWS(object):
+    """
+    Fake AWS backend serving a synthetic account, installed into garbo's connections while used as a context
+    """
+
+    # API page size limits
+    _LIMITS = {'DescribeSnapshots': 1000, 'DescribeVolumes': 500, 'DescribeInstances': 1000,
+               'DescribeLoadBalancers': 400, 'DescribeLaunchConfigurations': 100,
+               'DescribeAutoScalingGroups': 100, 'DescribeCacheClusters': 100}
+
+    def __init__(self, account, latency=0.0, page_size=None, throttling_rate=0.0, seed=0):
+        """
+        :param account: garbo.synthetic.SyntheticAccount to serve
+        :param latency: seconds per API call
+        :param page_size: maximal number of items per page (default: the API limits)
+        :param throttling_rate: probability of a request to be throttled
+        :param seed: throttling random seed
+        """
+        self.latency = latency
+        self.page_size = page_size
+        self.throttling_rate = throttling_rate
+        self.seed = seed
+        self._regions = {region: _Region(account, region) for region in account.regions}
+        self._lock = threading.Lock()
+        self._attempts = defaultdict(int)
+        # API calls (and throttled calls) by action
+        self.calls = defaultdict(int)
+        self.throttled = defaultdict(int)
+
+    def connect(self, connect, region, **credentials):
+        """
+        :param connect: boto connect_to_region function the connection stands for
+        """
+        return FakeConnection(self, region, **credentials)
+
+    def request(self, region, action, params):
+        """
+        Make a request, waiting for its latency and raising throttling errors
+        """
+        key = (region, action, tuple(sorted((k, str(v)) for k, v in params.items())))
+        with self._lock:
+            attempt = self._attempts[key]
+            self._attempts[key] += 1
+            self.calls[action] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.throttling_rate and \
+                random.Random('%s/%s/%d' % (self.seed, key, attempt)).random() < self.throttling_rate:
+            with self._lock:
+                self.throttled[action] += 1
+            raise boto.exception.BotoServerError(400, 'Bad Request', _THROTTLING_BODY)
+
+    def _page(self, items, action, size, token):
+        limit = self._LIMITS[action]
+        size = min(int(size or limit), limit, self.page_size or limit)
+        offset = int(token or 0)
+        return items[offset:offset + size], (str(offset + size) if offset + size < len(items) else None)
+
+    def respond(self, region, action, params):
+        data = self._regions.get(region)
+        if data is None:
+            return _Page([], next_token=None, next_marker=None)
+        if action in ('DescribeSnapshots', 'DescribeVolumes', 'DescribeInstances'):
+            items = {'DescribeSnapshots': data.snapshots, 'DescribeVolumes': data.volumes,
+                     'DescribeInstances': data.reservations}[action]
+            page, token = self._page(items, action, params.get('MaxResults'), params.get('NextToken'))
+            return _Page(page, next_token=token)
+        if action == 'DescribeLoadBalancers':
+            page, token = self._page(data.load_balancers, action, None, params.get('Marker'))
+            return _Page(page, next_marker=token)
+        if action in ('DescribeLaunchConfigurations', 'DescribeAutoScalingGroups'):
+            items = data.launch_configurations if action == 'DescribeLaunchConfigurations' else data.groups
+            page, token = self._page(items, action, params.get('MaxRecords'), params.get('NextToken'))
+            return _Page(page, next_token=token)
+        if action == 'DescribeCacheClusters':
+            page, token = self._page(data.cache_clusters, action, params.get('MaxRecords'), params.get('Marker'))
+            return {'DescribeCacheClustersResponse': {'DescribeCacheClustersResult': {'CacheClusters': page,
+                                                                                      'Marker': token}}}
+        if action == 'DescribeImages':
+            # images aren't shared with the fake account
+            return _Page([] if params.get('ExecutableBy') else data.images)
+        return _Page({'DescribeSecurityGroups': data.security_groups, 'DescribeKeyPairs': data.key_pairs,
+                      'DescribeAddresses': data.addresses}[action])
+
+    def __enter__(self):
+        connections.set_backend(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        connections.set_backend(None)
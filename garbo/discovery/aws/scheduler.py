@@ -0,0 +1,167 @@
+"""
+    Throttling-aware AWS request scheduler
+
+    Every (service, region) gets a token bucket rate limit and a concurrency limit. Both adapt AIMD-style:
+      they back off sharply (multiplicative decrease) when AWS throttles a request, and ramp up slowly
+      (additive increase) while requests succeed. Throttled requests are retried with exponential backoff
+      and full jitter.
+"""
+
+import random
+import threading
+import time
+
+import boto.exception
+
+from garbo import config, metrics
+
+__author__ = 'nati'
+
+# AWS error codes of throttled requests
+THROTTLING_ERROR_CODES = ('Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'SlowDown')
+
+_BACKOFF_BASE = 0.5
+_BACKOFF_MAX = 30.0
+# multiplicative decrease factor on throttling
+_DECREASE = 0.5
+
+
+def is_throttling(error):
+    return isinstance(error, boto.exception.BotoServerError) and error.error_code in THROTTLING_ERROR_CODES
+
+
+class AdaptiveLimits(object):
+    """
+    Adaptive request rate (token bucket) and concurrency limits of a single (service, region)
+    """
+
+    def __init__(self, rate, concurrency, max_concurrency):
+        self.rate = float(rate)
+        self.min_rate = self.rate / 16
+        self.max_rate = self.rate * 16
+        self.concurrency = float(concurrency)
+        self.max_concurrency = max(float(max_concurrency), self.concurrency)
+        self.active = 0
+        self._tokens = self.rate
+        self._updated = time.time()
+        self._condition = threading.Condition()
+
+    def _refill(self):
+        now = time.time()
+        # allow bursts of up to a second worth of requests
+        self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """
+        Block until a request is allowed by both the rate and the concurrency limits
+        """
+        with self._condition:
+            while True:
+                self._refill()
+                if self.active < int(self.concurrency) and self._tokens >= 1:
+                    self._tokens -= 1
+                    self.active += 1
+                    return
+                if self.active < int(self.concurrency):
+                    # waiting for a token
+                    self._condition.wait((1 - self._tokens) / self.rate)
+                else:
+                    # waiting for a running request to finish
+                    self._condition.wait()
+
+    def release(self, throttled=False):
+        with self._condition:
+            self.active -= 1
+            if throttled:
+                self.rate = max(self.min_rate, self.rate * _DECREASE)
+                self.concurrency = max(1.0, self.concurrency * _DECREASE)
+            else:
+                self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            self._condition.notify_all()
+
+
+class Scheduler(object):
+    """
+    Schedule AWS requests under adaptive per (service, region) limits, retrying throttled requests
+    """
+
+    def __init__(self, rate, concurrency, max_concurrency, max_retries):
+        self._rate = rate
+        self._concurrency = concurrency
+        self._max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def limits(self, service, region):
+        with self._lock:
+            key = (service, region)
+            if key not in self._limits:
+                self._limits[key] = AdaptiveLimits(self._rate, self._concurrency, self._max_concurrency)
+            return self._limits[key]
+
+    def call(self, service, region, f, *args, **kwargs):
+        """
+        Call f(*args, **kwargs) as an AWS request of service in region
+
+        Throttled attempts are counted for the running collector, see garbo.metrics.count_throttle
+        """
+        limits = self.limits(service, region)
+        attempt = 0
+        while True:
+            limits.acquire()
+            throttled = False
+            try:
+                return f(*args, **kwargs)
+            except boto.exception.BotoServerError as e:
+                throttled = is_throttling(e)
+                if throttled:
+                    metrics.count_throttle()
+                if not throttled or attempt >= self.max_retries:
+                    raise
+            finally:
+                limits.release(throttled)
+            # exponential backoff with full jitter
+            time.sleep(random.uniform(0, min(_BACKOFF_MAX, _BACKOFF_BASE * 2 ** attempt)))
+            attempt += 1
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def scheduler():
+    """
+    :return: the global Scheduler, configured by config.aws
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler(rate=float(config.aws.request_rate),
+                                   concurrency=int(config.aws.request_concurrency),
+                                   max_concurrency=int(config.aws.workers),
+                                   max_retries=int(config.aws.max_retries))
+        return _scheduler
+
+
+def scheduled(conn, service, region):
+    """
+    Route the API calls of a boto connection through the global scheduler
+
+    :return: conn
+    """
+    for name in ('get_list', 'get_object', 'get_status', '_make_request'):
+        method = getattr(conn, name, None)
+        if method is not None:
+            setattr(conn, name, _scheduled_method(method, service, region))
+    return conn
+
+
+def _scheduled_method(method, service, region):
+    def scheduled_method(*args, **kwargs):
+        return scheduler().call(service, region, method, *args, **kwargs)
+
+    scheduled_method.__name__ = method.__name__
+    return scheduled_method
@@ -6,34 +6,49 @@ from datetime import datetime
 import boto.elasticache
 import boto.utils
 
-from garbo.discovery.aws.utils import aws_collector
+from garbo.discovery.aws.utils import aws_collector, page_size
 from garbo.model import Relation
 from garbo.model.aws import CacheCluster, SecurityGroup
 
 __author__ = 'nati'
 
 
+def _all_cache_clusters(conn):
+    """
+    Yield all cache clusters, fetching a single page at a time
+
+    :param conn: boto ElastiCache connection
+    """
+    marker = None
+    while True:
+        result = conn.describe_cache_clusters(max_records=page_size(100), marker=marker) \
+            .get('DescribeCacheClustersResponse', {}) \
+            .get('DescribeCacheClustersResult', {})
+        for cache_cluster in result.get('CacheClusters') or []:
+            yield cache_cluster
+        marker = result.get('Marker')
+        if not marker:
+            return
+
+
 @aws_collector(boto.elasticache.connect_to_region)
-def cache_clusters(conn):
+def cache_clusters(conn, inventory):
     """
     Collect AWS Elastic Cache clusters
 
     :param conn: boto EC2 connection
+    :param inventory: region inventory
+    :type inventory: garbo.discovery.aws.utils.RegionInventory
     """
-    # TODO: add paging (currently supporting only the first 100)
-    all_cache_clusters = conn.describe_cache_clusters() \
-        .get('DescribeCacheClustersResponse', {}) \
-        .get('DescribeCacheClustersResult', {}) \
-        .get('CacheClusters', [])
-    for cache_cluster in all_cache_clusters:
+    for cache_cluster in _all_cache_clusters(conn):
         cc_resource = CacheCluster(region=conn.region.name, resource_id=cache_cluster.get('CacheClusterId'),
-                                   created=datetime.utcfromtimestamp(cache_cluster.get('CacheClusterCreateTime')))
+                                   created=datetime.utcfromtimestamp(cache_cluster.get('CacheClusterCreateTime')),
+                                   account=inventory.account)
         yield cc_resource
         # security groups relations
         for sg in cache_cluster.get('SecurityGroups', []):
             if sg.get('Status') == 'active':
                 yield Relation(cc_resource,
-                               SecurityGroup(region=conn.region.name,
-                                             resource_id=sg.get('SecurityGroupId')),
+                               SecurityGroup.make_urid(conn.region.name, sg.get('SecurityGroupId'), inventory.account),
                                dependency=True)
                 # TODO: CacheParameterGroup relations
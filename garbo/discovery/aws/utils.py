@@ -1,60 +1,384 @@
 __author__ = 'nati'
 
+import functools
 import logging
+import threading
+import time
+
+try:
+    import Queue
+except ImportError:
+    # noinspection PyPep8Naming
+    import queue as Queue
 
 import boto.ec2
+import boto.ec2.snapshot
+import boto.ec2.volume
+import boto.exception
 
-from garbo import config
+from garbo import config, metrics
+from garbo.discovery.aws.connections import get_connection, close_all
 
 _resource_collectors = set()
 
+# marks a finished discovery worker in the items queue
+_WORKER_DONE = object()
+
 
 def aws_collector(conn_obj=None):
     """
     Collect AWS collectors to a global module set
 
+    Collectors are called with a connection and the RegionInventory shared by all collectors of the region
+
     :param conn_obj: AWS connection function (default: EC2 connection)
     """
 
     def wrap(f):
-        def wrapped_f(conn):
+        def wrapped_f(conn, inventory):
             if conn_obj:
-                # convert the EC2 connection to conn_obj
-                conn = conn_obj(conn.region.name,
-                                aws_access_key_id=conn.provider.access_key,
-                                aws_secret_access_key=conn.provider.secret_key)
+                # convert the EC2 connection to a (pooled) conn_obj connection
+                conn = get_connection(conn_obj, conn.region.name, conn.provider.access_key,
+                                      conn.provider.secret_key, conn.provider.security_token)
             logging.info('calling %s', f.__name__)
-            # wrapping the generator
-            for r in f(conn):
+            # wrapping (and instrumenting) the generator
+            for r in metrics.instrument(f.__name__, conn.region.name, f(conn, inventory)):
                 yield r
 
+        wrapped_f.__name__ = f.__name__
         _resource_collectors.add(wrapped_f)
         return wrapped_f
 
     return wrap
 
 
-def collect_all(aws_access_key=None, aws_secret_key=None):
+def page_size(limit):
+    """
+    Configured page size, capped by the API limit
+
+    :param limit: maximal page size supported by the API
+    """
+    return min(int(config.aws.page_size), limit)
+
+
+def paginate(fetch, token_arg='next_token', token_attr='next_token', **kwargs):
+    """
+    Yield all items of a paginated boto call, fetching a single page at a time
+
+    :param fetch: boto function returning a ResultSet page
+    :param token_arg: name of the fetch argument of the next page token
+    :param token_attr: name of the page attribute holding the next page token
+    :param kwargs: additional fetch arguments
+    """
+    while True:
+        page = fetch(**kwargs)
+        for item in page:
+            yield item
+        token = getattr(page, token_attr, None)
+        if not token:
+            return
+        kwargs[token_arg] = token
+
+
+def paginate_ec2(conn, action, markers, limit, **params):
+    """
+    Yield all items of an EC2 describe action, for actions that boto doesn't paginate
+
+    :param conn: boto EC2 connection
+    :param action: EC2 API action (eg. DescribeSnapshots)
+    :param markers: boto ResultSet markers (eg. [('item', Snapshot)])
+    :param limit: maximal MaxResults supported by the action
+    :param params: additional API parameters
+    """
+    def fetch(NextToken=None):
+        page_params = dict(params, MaxResults=page_size(limit))
+        if NextToken:
+            page_params['NextToken'] = NextToken
+        return conn.get_list(action, page_params, markers, verb='POST')
+
+    return paginate(fetch, token_arg='NextToken')
+
+
+def snapshots_of(conn):
+    """
+    Yield all EBS snapshots owned by this account
+
+    :param conn: boto EC2 connection
+    """
+    return paginate_ec2(conn, 'DescribeSnapshots', [('item', boto.ec2.snapshot.Snapshot)], 1000,
+                        **{'Owner.1': 'self'})
+
+
+def volumes_of(conn):
+    """
+    Yield all EBS volumes
+
+    :param conn: boto EC2 connection
+    """
+    return paginate_ec2(conn, 'DescribeVolumes', [('item', boto.ec2.volume.Volume)], 500)
+
+
+class RegionInventory(object):
+    """
+    Per-run, per-region cache of the expensive EC2 describe calls, shared by all collectors of a region
+
+    Each inventory is fetched once (on first access, even when accessed by concurrent collectors),
+      and is indexed by resource ID for O(1) membership checks.
+    Paginated inventories only keep the few fields the collectors need, so memory stays small in very large
+      accounts, and each listing is walked once per region: by the collector of its resources (which yields
+      them as the pages arrive), or by the first collector relating to them.
+    """
+
+    def __init__(self, region, aws_access_key, aws_secret_key, aws_security_token=None, account=None, accounts=()):
+        """
+        :param account: AWS account ID qualifying the discovered resources, None for a single account discovery
+        :param accounts: IDs of all the discovered accounts, for cross-account relations
+        """
+        self.region = region
+        self.account = account
+        self.accounts = frozenset(accounts)
+        self._aws_access_key = aws_access_key
+        self._aws_secret_key = aws_secret_key
+        self._aws_security_token = aws_security_token
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._inventories = {}
+
+    def connection(self):
+        """
+        :return: an EC2 connection of the region, with the inventory's credentials
+        """
+        return get_connection(boto.ec2.connect_to_region, self.region, self._aws_access_key, self._aws_secret_key,
+                              self._aws_security_token)
+
+    def _get(self, key, fetch):
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self._inventories:
+                logging.info('fetching %s inventory for region %s', key, self.region)
+                self._inventories[key] = fetch(self.connection())
+            return self._inventories[key]
+
+    def _walk(self, key, listing, entry):
+        """
+        Yield the (resource ID, entry) pairs of a paginated inventory as its pages arrive, filling the inventory as
+          a side effect (or from the inventory, when it was already fetched).
+        Concurrent accessors of the inventory wait for the walk to complete, an interrupted walk leaves it unfetched.
+        """
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            inventory = self._inventories.get(key)
+            if inventory is None:
+                logging.info('walking %s inventory for region %s', key, self.region)
+                inventory = {}
+                for resource in listing(self.connection()):
+                    inventory[resource.id] = entry(resource)
+                    yield resource.id, inventory[resource.id]
+                self._inventories[key] = inventory
+                return
+        for pair in inventory.items():
+            yield pair
+
+    @staticmethod
+    def _snapshot_entry(snapshot):
+        return snapshot.start_time, snapshot.volume_id
+
+    @staticmethod
+    def _volume_entry(volume):
+        return (volume.create_time,
+                volume.attach_data.instance_id if volume.attach_data.status in ('attaching', 'attached') else None,
+                volume.snapshot_id)
+
+    @property
+    def snapshots(self):
+        """
+        EBS snapshots owned by this account, as (start time, volume ID) by snapshot ID
+        """
+        return self._get('snapshots', lambda conn: {s.id: self._snapshot_entry(s) for s in snapshots_of(conn)})
+
+    def walk_snapshots(self):
+        """
+        Yield the (snapshot ID, (start time, volume ID)) pairs of the snapshots inventory, while listing it
+        """
+        return self._walk('snapshots', snapshots_of, self._snapshot_entry)
+
+    @property
+    def volumes(self):
+        """
+        EBS volumes, as (create time, ID of the instance it is attached to or None, snapshot ID) by volume ID
+        """
+        return self._get('volumes', lambda conn: {v.id: self._volume_entry(v) for v in volumes_of(conn)})
+
+    def walk_volumes(self):
+        """
+        Yield the (volume ID, (create time, attached instance ID or None, snapshot ID)) pairs of the volumes
+          inventory, while listing it
+        """
+        return self._walk('volumes', volumes_of, self._volume_entry)
+
+    @property
+    def images(self):
+        """
+        AMIs owned by this account, by image ID (DescribeImages is not paginated)
+        """
+        return self._get('images', lambda conn: {i.id: i for i in conn.get_all_images(owners='self')})
+
+    @property
+    def shared_images(self):
+        """
+        Owner account IDs of the AMIs shared with this account by other discovered accounts, by image ID
+        """
+        others = self.accounts - {self.account}
+        if not others:
+            return {}
+        return self._get('shared_images', lambda conn: {i.id: i.owner_id for i in
+                                                        conn.get_all_images(owners=sorted(others),
+                                                                            executable_by=['self'])})
+
+
+def _run_collector(collector, region, inventory, shard=None):
+    """
+    Yield all items of a single collector in a single region, logging (and swallowing) AWS errors
+
+    :param shard: garbo.storage.shards.Shard to checkpoint the items into, committed only if the collector
+      completes
+    """
+    conn = inventory.connection()
+    try:
+        for item in collector(conn, inventory):
+            if shard:
+                shard.write(item)
+            yield item
+        if shard:
+            shard.commit()
+    except boto.exception.BotoServerError as e:
+        metrics.count_error(collector.__name__, region)
+        logging.warn('unable to run collector %s for region %s: %s',
+                     collector.__name__, region, e.message)
+    finally:
+        if shard:
+            shard.close()
+
+
+def _run_task(task, shards=None, since=None):
+    """
+    Yield all items of a (region, collector, inventory) task, from a fresh shard if there is one
+    """
+    region, collector, inventory = task
+    if shards is None:
+        return _run_collector(collector, region, inventory)
+    account = inventory.account or 'default'
+    if shards.is_fresh(account, region, collector.__name__, since):
+        logging.info('reusing %s shard of %s', collector.__name__, region)
+        return shards.read(account, region, collector.__name__)
+    return _run_collector(collector, region, inventory, shards.writer(account, region, collector.__name__))
+
+
+def _collect_concurrently(tasks, workers, run_task):
+    """
+    Run (region, collector) tasks on a bounded pool of worker threads, and yield their items as they arrive
+
+    :param tasks: list of (region, collector, inventory) tuples
+    :param workers: maximal number of concurrent collectors
+    :param run_task: function yielding the items of a task
+    """
+    pending = Queue.Queue()
+    for task in tasks:
+        pending.put(task)
+    # a bounded items queue keeps the memory flat when the consumer is slower than the collectors
+    items = Queue.Queue(maxsize=workers * 1000)
+
+    def worker():
+        try:
+            while True:
+                try:
+                    task = pending.get_nowait()
+                except Queue.Empty:
+                    break
+                for item in run_task(task):
+                    items.put(item)
+        except Exception as e:
+            # unexpected errors are raised by the consumer, just like in a sequential discovery
+            items.put(e)
+        finally:
+            try:
+                close_all()
+            finally:
+                items.put(_WORKER_DONE)
+
+    threads = [threading.Thread(target=worker, name='garbo-discovery-%d' % i)
+               for i in range(min(workers, len(tasks)))]
+    for thread in threads:
+        # don't block the interpreter exit when the consumer stops iterating
+        thread.daemon = True
+        thread.start()
+
+    running = len(threads)
+    while running:
+        item = items.get()
+        if item is _WORKER_DONE:
+            running -= 1
+        elif isinstance(item, Exception):
+            raise item
+        else:
+            yield item
+
+
+def collect_all(aws_access_key=None, aws_secret_key=None, workers=None, shards=None, max_age=None,
+                aws_security_token=None, account=None, accounts=()):
     """
     Yield all EC2 resources and relations associated with an AWS account
 
     :param aws_access_key:
     :param aws_secret_key:
+    :param workers: number of concurrent collectors (default: config.aws.workers)
+    :param shards: garbo.storage.shards.ShardStore to checkpoint the discovery into (default: no checkpoints).
+      Shards of a recently interrupted discovery are reused, resuming it (see config.shards.resume_max_age).
+    :param max_age: reuse shards of up to max_age seconds, instead of running their collectors again (and
+      instead of resuming an interrupted discovery)
+    :param aws_security_token: session token of temporary credentials (eg. of an assumed role)
+    :param account: AWS account ID qualifying the resources urids (and keying their shards), None for a
+      single account discovery
+    :param accounts: IDs of all the accounts being discovered, to resolve cross-account relations
     """
     aws_access_key = aws_access_key or config.aws.access_key
     aws_secret_key = aws_secret_key or config.aws.secret_access_key
+    workers = int(workers or config.aws.workers)
 
-    regions = config.aws.regions or (r.name for r in boto.ec2.regions())
-    for region in regions:
-        conn = boto.ec2.connect_to_region(region,
-                                          aws_access_key_id=aws_access_key,
-                                          aws_secret_access_key=aws_secret_key)
-        logging.info('running AWS collectors on %s', region)
+    since = time.time() - max_age if max_age is not None else None
+    if shards is not None:
+        interrupted = shards.begin_run(account or 'default')
+        if interrupted is not None and since is None:
+            # resume, reusing every shard completed since the interrupted discovery started
+            #   (max_age, when given, bounds the reused shards instead)
+            since = interrupted
+    run_task = functools.partial(_run_task, shards=shards, since=since)
 
-        for collector in _resource_collectors:
-            try:
-                for item in collector(conn):
-                    yield item
-            except boto.exception.BotoServerError as e:
-                logging.warn('unable to run collector %s for region %s: %s',
-                             collector.__name__, region, e.message)
+    regions = config.aws.regions or [r.name for r in boto.ec2.regions()]
+    inventories = {region: RegionInventory(region, aws_access_key, aws_secret_key, aws_security_token,
+                                           account=account, accounts=accounts)
+                   for region in regions}
+    try:
+        if workers > 1:
+            logging.info('running AWS collectors on %s with %d workers', ', '.join(regions), workers)
+            tasks = [(region, collector, inventories[region])
+                     for region in regions for collector in _resource_collectors]
+            for item in _collect_concurrently(tasks, workers, run_task):
+                yield item
+        else:
+            for region in regions:
+                logging.info('running AWS collectors on %s', region)
+
+                for collector in _resource_collectors:
+                    for item in run_task((region, collector, inventories[region])):
+                        yield item
+    except Exception:
+        # a failed discovery isn't resumed, only an interrupted one
+        if shards is not None:
+            shards.end_run(account or 'default')
+        raise
+
+    if shards is not None:
+        shards.end_run(account or 'default')
@@ -0,0 +1,324 @@
+"""
+    Compact graph representation for large garbo graphs
+
+    urids are interned into dense integer IDs, and relations are stored as integer edge arrays in CSR
+      (compressed sparse row) form, so traversals don't hash urid strings or allocate Relation objects.
+"""
+
+from array import array
+from collections import deque
+import copy
+
+from garbo.model import AbstractResource, Relation
+
+__author__ = 'nati'
+
+
+class UridTable(object):
+    """
+    Interning table mapping urids to dense integer IDs (and back)
+    """
+
+    __slots__ = ('_ids', 'urids')
+
+    def __init__(self):
+        self._ids = {}
+        self.urids = []
+
+    def intern(self, urid):
+        """
+        :return: the ID of urid, allocating a new one if urid is unknown
+        """
+        node = self._ids.get(urid)
+        if node is None:
+            node = self._ids[urid] = len(self.urids)
+            self.urids.append(urid)
+        return node
+
+    def get(self, urid):
+        """
+        :return: the ID of urid, or None if urid is unknown
+        """
+        return self._ids.get(urid)
+
+    def __getitem__(self, node):
+        return self.urids[node]
+
+    def __contains__(self, urid):
+        return urid in self._ids
+
+    def __len__(self):
+        return len(self.urids)
+
+
+class CompactGraph(object):
+    """
+    Immutable graph of resources and relations, built from any iterable of garbo resources and relations
+
+    Iterating a CompactGraph yields its resources followed by its relations, so it can be used wherever
+      a graph iterable is expected (storage backends, D3JSForce, mark_and_sweep)
+
+    :ivar urids: UridTable of all the nodes (resources, and urids only referred by relations)
+    :ivar resources: resource objects by node ID (None for nodes without a discovered resource)
+    :ivar cleanup_candidate: bytearray, 1 if the node is a resource and a cleanup candidate
+    :ivar offsets: CSR row offsets, edges of node n are in range(offsets[n], offsets[n + 1])
+    :ivar targets: CSR edge targets
+    :ivar dependency: bytearray, 1 if the edge is a dependency relation
+    """
+
+    def __init__(self, graph=()):
+        self.urids = UridTable()
+        self.resources = []
+        sources, targets, dependency = array('i'), array('i'), bytearray()
+        for item in graph:
+            if isinstance(item, AbstractResource):
+                node = self._node(item.urid())
+                self.resources[node] = item
+            elif isinstance(item, Relation):
+                sources.append(self._node(item.source))
+                targets.append(self._node(item.target))
+                dependency.append(1 if item.dependency else 0)
+        self.cleanup_candidate = bytearray(1 if r is not None and r.cleanup_candidate else 0
+                                           for r in self.resources)
+        self._build_csr(sources, targets, dependency)
+
+    def _node(self, urid):
+        node = self.urids.intern(urid)
+        if node == len(self.resources):
+            self.resources.append(None)
+        return node
+
+    def _build_csr(self, sources, targets, dependency):
+        """
+        Sort the edge list by source (counting sort), into CSR arrays
+        """
+        n = len(self.urids)
+        offsets = array('i', [0]) * (n + 1)
+        for source in sources:
+            offsets[source + 1] += 1
+        for node in range(n):
+            offsets[node + 1] += offsets[node]
+        position = array('i', offsets)
+        self.targets = array('i', [0]) * len(targets)
+        self.dependency = bytearray(len(targets))
+        for source, target, is_dependency in zip(sources, targets, dependency):
+            edge = position[source]
+            position[source] += 1
+            self.targets[edge] = target
+            self.dependency[edge] = is_dependency
+        self.offsets = offsets
+        self._merge_duplicate_edges()
+
+    def _merge_duplicate_edges(self):
+        """
+        Keep a relation discovered more than once (eg. replaced by a merged duplicate, see GraphBuilder.feed) as a
+          single edge, a dependency if any of its duplicates is
+        """
+        offsets, targets, dependency = self.offsets, self.targets, self.dependency
+        write = 0
+        for node in range(len(self.urids)):
+            start, end = offsets[node], offsets[node + 1]
+            offsets[node] = write
+            if end - start > 1 and len(set(targets[start:end])) < end - start:
+                kept = {}
+                for edge in range(start, end):
+                    target = targets[edge]
+                    if target in kept:
+                        dependency[kept[target]] |= dependency[edge]
+                    else:
+                        kept[target] = write
+                        targets[write], dependency[write] = target, dependency[edge]
+                        write += 1
+            else:
+                if write != start:
+                    targets[write:write + end - start] = targets[start:end]
+                    dependency[write:write + end - start] = dependency[start:end]
+                write += end - start
+        offsets[len(self.urids)] = write
+        del targets[write:]
+        del dependency[write:]
+
+    def __len__(self):
+        return len(self.urids)
+
+    def node(self, urid):
+        """
+        :return: the node ID of urid, or None if it is not part of the graph
+        """
+        return self.urids.get(urid)
+
+    def is_resource(self, node):
+        return self.resources[node] is not None
+
+    def rtype(self, node):
+        """
+        :return: the resource type of node, None if node has no resource
+        """
+        resource = self.resources[node]
+        return resource.rtype if resource is not None else None
+
+    def used(self, node):
+        resource = self.resources[node]
+        return resource is not None and resource.used
+
+    def set_used(self, node, used=True):
+        """
+        Mark the resource of node as used (or unused), eg. by a usage probe (see garbo.usage.evaluate)
+        """
+        self.resources[node].used = used
+
+    def region(self, node):
+        """
+        :return: the region of node, None if node has no resource (or a regionless one)
+        """
+        return getattr(self.resources[node], 'region', None)
+
+    def used_urids(self):
+        """
+        :return: urids of the resources being used
+        """
+        return [r.urid() for r in self.resources if r is not None and r.used]
+
+    def edges(self, node):
+        """
+        :return: range of the edge indices of node
+        """
+        return range(self.offsets[node], self.offsets[node + 1])
+
+    def successors(self, node, dependency_only=False):
+        """
+        Yield the target node IDs of node's relations
+        """
+        for edge in self.edges(node):
+            if not dependency_only or self.dependency[edge]:
+                yield self.targets[edge]
+
+    def relations(self):
+        """
+        Yield Relation objects for all edges
+        """
+        urids = self.urids
+        for source in range(len(urids)):
+            for edge in self.edges(source):
+                yield Relation(urids[source], urids[self.targets[edge]], dependency=bool(self.dependency[edge]))
+
+    def __iter__(self):
+        for resource in self.resources:
+            if resource is not None:
+                yield resource
+        for relation in self.relations():
+            yield relation
+
+
+def reachability(graph, applications, parents=None):
+    """
+    Find which applications keep each node alive, in a single pass over the dependency edges
+
+    Every application gets a bit, and nodes propagate the union of the bits reaching them to their
+      dependencies. A node is re-visited only when it gains new bits, so the cost is close to a single
+      BFS rather than a BFS per application.
+
+    :param graph: CompactGraph
+    :param applications: dict of application name -> iterable of root urids
+    :param parents: optional array (of -1 by node ID) to record the BFS parent of every marked node into.
+      A node is first marked by its parent's first visit, so parents form shortest paths from the roots.
+    :return: (application names by bit, list of application bitsets by node ID)
+    """
+    names = sorted(applications)
+    masks = [0] * len(graph)
+    queued = bytearray(len(graph))
+    pending = deque()
+    for bit, name in enumerate(names):
+        for urid in applications[name]:
+            node = graph.node(urid)
+            if node is not None and graph.is_resource(node):
+                masks[node] |= 1 << bit
+                if not queued[node]:
+                    queued[node] = 1
+                    pending.append(node)
+
+    is_resource = graph.is_resource
+    while pending:
+        node = pending.popleft()
+        queued[node] = 0
+        mask = masks[node]
+        for target in graph.successors(node, dependency_only=True):
+            if masks[target] | mask != masks[target] and is_resource(target):
+                if parents is not None and not masks[target]:
+                    parents[target] = node
+                masks[target] |= mask
+                if not queued[target]:
+                    queued[target] = 1
+                    pending.append(target)
+
+    return names, masks
+
+
+class GraphBuilder(object):
+    """
+    Deduplicate resources and relations as they arrive from a discovery
+
+    A resource discovered more than once is kept once, merged with the information of its duplicates
+      (creation time, usage, not being a cleanup candidate). A relation emitted more than once is kept
+      once, as a dependency if any of its duplicates is a dependency.
+    """
+
+    def __init__(self):
+        self.resources = {}
+        self.relations = {}
+
+    @staticmethod
+    def _merge_resource(kept, duplicate):
+        """
+        :return: a copy of kept merged with duplicate, or None if duplicate adds nothing to kept
+        """
+        created = kept.created if kept.created is not None else duplicate.created
+        used = kept.used or duplicate.used
+        cleanup_candidate = kept.cleanup_candidate and duplicate.cleanup_candidate
+        if (created, bool(used), cleanup_candidate) == (kept.created, bool(kept.used), kept.cleanup_candidate):
+            return None
+        merged = copy.copy(kept)
+        merged.created, merged.used, merged.cleanup_candidate = created, used, cleanup_candidate
+        return merged
+
+    def add(self, item):
+        """
+        Add an item, without changing the previously added ones
+
+        :return: the item to keep- item if it is new, a merged copy replacing the kept item if item adds to it,
+          or None if item is a duplicate adding nothing
+        """
+        if isinstance(item, AbstractResource):
+            kept = self.resources.setdefault(item.urid(), item)
+            if kept is not item:
+                item = self._merge_resource(kept, item)
+                if item is not None:
+                    self.resources[item.urid()] = item
+        elif isinstance(item, Relation):
+            key = (item.source, item.target)
+            kept = self.relations.setdefault(key, item)
+            if kept is not item:
+                item = Relation(*key, dependency=True) if item.dependency and not kept.dependency else None
+                if item is not None:
+                    self.relations[key] = item
+        return item
+
+    def feed(self, graph):
+        """
+        Yield the items of graph as they arrive, without duplicates
+
+        An item is never changed once it was yielded (eg. while a storage writer serializes it). A duplicate
+          adding to a yielded item (eg. a resource found to be used, a relation found to be a dependency) yields
+          a merged copy, replacing it: the last item of a urid (or of a source and target) is the final one, as
+          kept by CompactGraph and the storage backends.
+        """
+        for item in graph:
+            item = self.add(item)
+            if item is not None:
+                yield item
+
+    def __iter__(self):
+        for resource in self.resources.values():
+            yield resource
+        for relation in self.relations.values():
+            yield relation
@@ -0,0 +1,223 @@
+"""
+    Incremental mark & sweep- keep the marks between runs, and update them by graph deltas
+
+    Marks are application bitsets (as in garbo.graph.reachability), kept for used resources only. They are
+      maintained under added and removed resources, relations and roots:
+      - additions propagate marks forward from the changed nodes
+      - removals unmark everything downstream of the change (over-deletion), then re-derive the unmarked
+        nodes from their remaining marked dependents and roots
+    Both only visit the affected subgraph, so the cost scales with the size of the change. Finding the change
+      is up to the caller: update diffs a whole new graph against the state (a linear scan, without any
+      traversal), while callers knowing their changes apply them with the add_ and remove_ methods and sweep.
+"""
+
+from collections import defaultdict, deque
+import logging
+import pickle
+
+from garbo.model import AbstractResource, Relation
+from garbo.utils import USED_APPLICATION
+
+__author__ = 'nati'
+
+
+class IncrementalSweep(object):
+    """
+    Mark & sweep state, updated by graph deltas
+    """
+
+    def __init__(self):
+        self.resources = {}
+        self.relations = {}
+        # all relations targets by source, and dependency relations sources by target
+        self._successors = defaultdict(set)
+        self._dependents = defaultdict(set)
+        self.roots = defaultdict(set)
+        self._bits = {}
+        self._root_masks = defaultdict(int)
+        # application bitset of every used resource
+        self.masks = {}
+        self.unused = set()
+        # changed nodes, which may gain or lose marks on the next sweep
+        self._added = set()
+        self._removed = set()
+
+    def _dependencies(self, urid):
+        return (t for t in self._successors.get(urid, ()) if self.relations[(urid, t)].dependency)
+
+    def _refresh(self, urid):
+        resource = self.resources.get(urid)
+        if resource is not None and resource.cleanup_candidate and urid not in self.masks:
+            self.unused.add(urid)
+        else:
+            self.unused.discard(urid)
+
+    def add_resource(self, resource):
+        """
+        Add (or replace) a resource
+        """
+        urid = resource.urid()
+        if urid not in self.resources:
+            self._added.add(urid)
+        self.resources[urid] = resource
+        self._refresh(urid)
+
+    def remove_resource(self, urid):
+        if self.resources.pop(urid, None) is not None:
+            self._removed.add(urid)
+            self._refresh(urid)
+
+    def add_relation(self, relation):
+        """
+        Add (or replace) a relation
+        """
+        key = (relation.source, relation.target)
+        if key in self.relations:
+            self.remove_relation(*key)
+        self.relations[key] = relation
+        self._successors[relation.source].add(relation.target)
+        if relation.dependency:
+            self._dependents[relation.target].add(relation.source)
+            self._added.add(relation.target)
+
+    def remove_relation(self, source, target):
+        relation = self.relations.pop((source, target), None)
+        if relation is None:
+            return
+        self._successors[source].discard(target)
+        if relation.dependency:
+            self._dependents[target].discard(source)
+            self._removed.add(target)
+
+    def _bit(self, application):
+        if application not in self._bits:
+            self._bits[application] = 1 << len(self._bits)
+        return self._bits[application]
+
+    def add_root(self, application, urid):
+        if urid not in self.roots[application]:
+            self.roots[application].add(urid)
+            self._root_masks[urid] |= self._bit(application)
+            self._added.add(urid)
+
+    def remove_root(self, application, urid):
+        if urid in self.roots[application]:
+            self.roots[application].discard(urid)
+            self._root_masks[urid] &= ~self._bit(application)
+            self._removed.add(urid)
+
+    def sweep(self):
+        """
+        Update the marks (and unused resources) by the changes made since the last sweep
+
+        :return: number of nodes visited
+        """
+        # over-delete, unmarking everything downstream of the removals
+        affected = set()
+        pending = [urid for urid in self._removed if urid in self.masks]
+        while pending:
+            urid = pending.pop()
+            if urid not in affected:
+                affected.add(urid)
+                pending.extend(t for t in self._dependencies(urid) if t in self.masks and t not in affected)
+        for urid in affected:
+            del self.masks[urid]
+
+        # re-derive the affected and added nodes from their dependents, and propagate their marks forward
+        touched = affected | self._added | self._removed
+        pending = deque()
+        for urid in affected | self._added:
+            if urid in self.resources:
+                mask = self._root_masks.get(urid, 0)
+                for source in self._dependents.get(urid, ()):
+                    mask |= self.masks.get(source, 0)
+                if mask | self.masks.get(urid, 0) != self.masks.get(urid, 0):
+                    self.masks[urid] = self.masks.get(urid, 0) | mask
+                    pending.append(urid)
+        while pending:
+            urid = pending.popleft()
+            mask = self.masks[urid]
+            for target in self._dependencies(urid):
+                if target in self.resources and self.masks.get(target, 0) | mask != self.masks.get(target, 0):
+                    self.masks[target] = self.masks.get(target, 0) | mask
+                    touched.add(target)
+                    pending.append(target)
+
+        for urid in touched:
+            self._refresh(urid)
+        logging.info('incremental sweep of %d changes visited %d nodes',
+                     len(self._added) + len(self._removed), len(touched))
+        self._added.clear()
+        self._removed.clear()
+        return len(touched)
+
+    def update(self, graph, applications, used_as_roots=False):
+        """
+        Apply the delta between the current state and a new graph (and applications), then sweep
+
+        Every item of graph is compared with the state, so the diff is linear in the graph size (the sweep only
+          visits the changes). Apply known changes directly (see add_resource, remove_relation etc.) to skip it.
+
+        :param graph: iterable of resources and relations
+        :param applications: dict of application name -> iterable of root urids
+        :param used_as_roots: also keep resources being used, see garbo.utils.sweep_applications
+        :return: number of nodes visited by the sweep
+        """
+        resources, relations = {}, {}
+        for item in graph:
+            if isinstance(item, AbstractResource):
+                resources[item.urid()] = item
+            elif isinstance(item, Relation):
+                relations[(item.source, item.target)] = item
+        if used_as_roots:
+            applications = dict(applications)
+            applications[USED_APPLICATION] = [urid for urid, r in resources.items() if r.used]
+
+        for urid in [u for u in self.resources if u not in resources]:
+            self.remove_resource(urid)
+        for resource in resources.values():
+            self.add_resource(resource)
+        for key in [k for k in self.relations if k not in relations]:
+            self.remove_relation(*key)
+        for key, relation in relations.items():
+            if key not in self.relations or self.relations[key].dependency != relation.dependency:
+                self.add_relation(relation)
+
+        for application in set(self.roots) | set(applications):
+            roots = set(applications.get(application, ()))
+            for urid in self.roots[application] - roots:
+                self.remove_root(application, urid)
+            for urid in roots - self.roots[application]:
+                self.add_root(application, urid)
+        return self.sweep()
+
+    def ownership(self):
+        """
+        :return: dict of used urid -> set of the applications using it
+        """
+        names = {bit: name for name, bit in self._bits.items()}
+        return {urid: {name for bit, name in names.items() if mask & bit} for urid, mask in self.masks.items()}
+
+    def unused_graph(self):
+        """
+        :return: the unused cleanup candidates, and the relations between them
+        """
+        unused_graph = [self.resources[urid] for urid in self.unused]
+        unused_graph += [self.relations[(source, target)] for source in self.unused
+                         for target in self._successors.get(source, ()) if target in self.unused]
+        return unused_graph
+
+    def save(self, filename):
+        with open(filename, 'wb') as state_file:
+            pickle.dump(self, state_file, 2)
+
+    @staticmethod
+    def load(filename):
+        """
+        :return: the IncrementalSweep saved in filename, or a new one if there is none
+        """
+        try:
+            with open(filename, 'rb') as state_file:
+                return pickle.load(state_file)
+        except (IOError, EOFError):
+            return IncrementalSweep()
@@ -0,0 +1,224 @@
+"""
+    garbo instrumentation- per (collector, region) discovery metrics, and stage timings
+
+    Metrics can be exported as a JSON summary, or as a Prometheus text format file (eg. for the node
+      exporter textfile collector).
+"""
+
+from contextlib import contextmanager
+import json
+import threading
+import time
+
+from garbo.model import AbstractResource, Relation
+from garbo.utils import atomic_file
+
+__author__ = 'nati'
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+_lock = threading.Lock()
+_collectors = {}
+_stages = {}
+# parts of the graph which failed to discover or load (besides failed collectors), see count_failure
+_failures = set()
+# the collector stats of the collector running on the current thread, for counting its API calls
+_local = threading.local()
+
+
+class CollectorStats(object):
+    """
+    Metrics of a single collector in a single region
+    """
+
+    __slots__ = ('wall_time', 'first_item_time', 'resources', 'relations', 'api_calls', 'errors', 'throttles')
+
+    def __init__(self):
+        self.wall_time = 0.0
+        self.first_item_time = None
+        self.resources = 0
+        self.relations = 0
+        self.api_calls = 0
+        self.errors = 0
+        self.throttles = 0
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+def reset():
+    with _lock:
+        _collectors.clear()
+        _stages.clear()
+        _failures.clear()
+
+
+def collector_stats(collector, region):
+    """
+    :return: the (shared) CollectorStats of collector in region
+    """
+    with _lock:
+        return _collectors.setdefault((collector, region), CollectorStats())
+
+
+def collectors():
+    """
+    :return: picklable list of (collector, region, CollectorStats dict), eg. to merge them into another process
+    """
+    with _lock:
+        return [(c, r, s.to_dict()) for (c, r), s in _collectors.items()]
+
+
+def merge_collectors(collected):
+    """
+    Merge the collector stats of another process (eg. an account discovery worker) into this one's
+
+    :param collected: list of (collector, region, CollectorStats dict), see collectors
+    """
+    for collector, region, values in collected:
+        stats = collector_stats(collector, region)
+        with _lock:
+            for k, v in values.items():
+                if k == 'first_item_time':
+                    if v is not None and (stats.first_item_time is None or v < stats.first_item_time):
+                        stats.first_item_time = v
+                else:
+                    setattr(stats, k, getattr(stats, k) + v)
+
+
+def instrument(collector, region, items):
+    """
+    Yield items of a running collector, recording its wall time, time to first item and item counts
+
+    API calls (and throttled ones) made while the collector runs on this thread are counted too (see count_api_call
+      and count_throttle)
+    """
+    stats = collector_stats(collector, region)
+    start = _timer()
+    previous, _local.stats = getattr(_local, 'stats', None), stats
+    try:
+        for item in items:
+            if stats.first_item_time is None:
+                stats.first_item_time = _timer() - start
+            if isinstance(item, AbstractResource):
+                stats.resources += 1
+            elif isinstance(item, Relation):
+                stats.relations += 1
+            yield item
+    finally:
+        _local.stats = previous
+        stats.wall_time += _timer() - start
+
+
+def count_api_call():
+    """
+    Count an API call of the collector running on the current thread
+    """
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.api_calls += 1
+
+
+def count_throttle():
+    """
+    Count a throttled API request (retried or not) of the collector running on the current thread
+    """
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.throttles += 1
+
+
+def count_error(collector, region):
+    """
+    Count a collector which failed (eg. ran out of throttling retries), leaving its region partially discovered
+    """
+    stats = collector_stats(collector, region)
+    stats.errors += 1
+
+
+def count_failure(description):
+    """
+    Record a part of the graph which failed to discover or load (eg. 'account 123456789012'), leaving the
+      graph incomplete
+    """
+    with _lock:
+        _failures.add(description)
+
+
+def discovery_failures():
+    """
+    :return: sorted descriptions of the failed collectors and graph parts, the graph is incomplete unless empty
+    """
+    with _lock:
+        failures = ['collector %s in %s' % (c, r) for (c, r), s in _collectors.items() if s.errors]
+        failures += list(_failures)
+    return sorted(failures)
+
+
+@contextmanager
+def timed_stage(stage):
+    """
+    Time a garbo stage (eg. discovery, storage, sweep, export)
+    """
+    start = _timer()
+    try:
+        yield
+    finally:
+        with _lock:
+            _stages[stage] = _stages.get(stage, 0.0) + _timer() - start
+
+
+def summary():
+    """
+    :return: JSON serializable dict of all metrics
+    """
+    with _lock:
+        collectors = [dict(collector=c, region=r, **s.to_dict()) for (c, r), s in sorted(_collectors.items())]
+        for c in collectors:
+            c['items_per_second'] = (c['resources'] + c['relations']) / c['wall_time'] if c['wall_time'] else None
+        return {'collectors': collectors, 'stages': dict(_stages), 'failures': sorted(_failures)}
+
+
+# Prometheus metric name, help, and CollectorStats attribute
+_PROMETHEUS_COLLECTOR_METRICS = (
+    ('garbo_collector_duration_seconds', 'Collector wall time', 'wall_time'),
+    ('garbo_collector_first_item_seconds', 'Collector time to first item', 'first_item_time'),
+    ('garbo_collector_resources', 'Resources discovered by the collector', 'resources'),
+    ('garbo_collector_relations', 'Relations discovered by the collector', 'relations'),
+    ('garbo_collector_api_calls', 'API calls made by the collector', 'api_calls'),
+    ('garbo_collector_errors', 'Collector errors', 'errors'),
+    ('garbo_collector_throttles', 'Throttled API requests of the collector', 'throttles'),
+)
+
+
+def prometheus():
+    """
+    :return: all metrics in the Prometheus text format
+    """
+    metrics = summary()
+    lines = []
+    for name, description, attribute in _PROMETHEUS_COLLECTOR_METRICS:
+        lines += ['# HELP %s %s' % (name, description), '# TYPE %s gauge' % name]
+        lines += ['%s{collector="%s",region="%s"} %s' % (name, c['collector'], c['region'], c[attribute])
+                  for c in metrics['collectors'] if c[attribute] is not None]
+    lines += ['# HELP garbo_stage_duration_seconds Stage wall time', '# TYPE garbo_stage_duration_seconds gauge']
+    lines += ['garbo_stage_duration_seconds{stage="%s"} %s' % (stage, seconds)
+              for stage, seconds in sorted(metrics['stages'].items())]
+    lines += ['# HELP garbo_failures Graph parts which failed to discover or load', '# TYPE garbo_failures gauge',
+              'garbo_failures %d' % len(metrics['failures'])]
+    return '\n'.join(lines) + '\n'
+
+
+def _write_atomically(filename, content):
+    # scrapers should never read a partially written file
+    with atomic_file(filename) as temporary:
+        with open(temporary, 'w') as metrics_file:
+            metrics_file.write(content)
+
+
+def write_json(filename):
+    _write_atomically(filename, json.dumps(summary(), indent=2, sort_keys=True))
+
+
+def write_prometheus(filename):
+    _write_atomically(filename, prometheus())
@@ -8,13 +8,55 @@ __author__ = 'nati'
 
 from abc import ABCMeta, abstractmethod
 
+try:
+    intern
+except NameError:
+    from sys import intern
 
-class AbstractResource(object):
+
+def _intern(urid):
+    """
+    Intern a urid, Python 2 only interns byte strings (eg. sqlite3 returns unicode ones)
+    """
+    if not isinstance(urid, str):
+        try:
+            urid = str(urid)
+        except UnicodeEncodeError:
+            # non-ASCII urid, kept as is
+            return urid
+    return intern(urid)
+
+
+class _SlotsPickleMixin(object):
+    """
+    Pickle support for __slots__ classes (also loading graphs pickled before resources had slots)
+    """
+
+    __slots__ = ()
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for cls in type(self).__mro__ for k in getattr(cls, '__slots__', ())
+                if hasattr(self, k)}
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+
+
+class AbstractResource(_SlotsPickleMixin):
     """
     A cloud resource abstract class
+
+    Resources use __slots__ (subclasses should define __slots__ too) to keep large graphs small
     """
 
     __metaclass__ = ABCMeta
+    __slots__ = ('rtype', 'provider', 'created', 'rid', 'cleanup_candidate', '_used', '_urid')
+
+    # a garbo.usage.UsageProbe for a batched dynamic usage validation (see garbo.usage.evaluate)
+    usage_probe = None
+    # a garbo.cleanup.Deleter for batched cleanups (see garbo.cleanup.execute)
+    deleter = None
 
     def __init__(self, provider, rtype, rid, created=None, used=False, cleanup_candidate=True):
         """
@@ -29,6 +71,7 @@ class AbstractResource(object):
         self.rid = rid
         self.cleanup_candidate = cleanup_candidate
         self._used = used
+        self._urid = None
 
     """
     Used components are in the core of a GC operation, as they and all
@@ -43,9 +86,18 @@ class AbstractResource(object):
         Universal resource ID (across multiple resource types)
         :return:
         """
-        return '{provider}://{type}/{rid}'.format(provider=self.provider,
-                                                  type=self.rtype,
-                                                  rid=self.rid)
+        if getattr(self, '_urid', None) is None:
+            self._urid = AbstractResource.make_urid(self.provider, self.rtype, self.rid)
+        return self._urid
+
+    @staticmethod
+    def make_urid(provider, rtype, rid):
+        """
+        Universal resource ID of a resource, without creating the resource (eg. for relation endpoints)
+
+        urids are interned, so relations and indexes referring the same resource share a single string
+        """
+        return _intern('%s://%s/%s' % (provider, rtype, rid))
 
     def __str__(self):
         return self.urid()
@@ -53,11 +105,18 @@ class AbstractResource(object):
     def used_getter(self):
         """
         Override this function to implement a dynamic usage validation
+          (dynamic validations requiring API calls should rather define a batched usage_probe)
         :return: True if a resource is being used, False otherwise
         """
         return self._used
 
-    used = property(used_getter)
+    def used_setter(self, used):
+        """
+        Mark a resource as used or unused (eg. by a usage probe, or when merging duplicate resources)
+        """
+        self._used = used
+
+    used = property(used_getter, used_setter)
 
     @abstractmethod
     def cleanup(self):
@@ -72,7 +131,7 @@ class AbstractResource(object):
         pass
 
 
-class Relation(object):
+class Relation(_SlotsPickleMixin):
     """
     An class defining a directed relation between two cloud resources (source -> target)
 
@@ -80,16 +139,19 @@ class Relation(object):
     eg. instance is dependent on its security group, but a snapshot is not dependent on its source volume
     """
 
+    __slots__ = ('source', 'target', 'dependency')
+
     def __init__(self, source, target, dependency=False):
         """
-        :param source: garbo Resource
-        :type source: AbstractResource
-        :param target: garbo Resource
-        :type target: AbstractResource
+        :param source: garbo Resource, or its urid
+        :type source: AbstractResource | str
+        :param target: garbo Resource, or its urid
+        :type target: AbstractResource | str
         :param dependency: True if this is a dependency relation, False otherwise
         :type dependency: bool
         """
-        self.source, self.target = [o.urid() if isinstance(o, AbstractResource) else o for o in (source, target)]
+        self.source, self.target = [o.urid() if isinstance(o, AbstractResource) else _intern(o)
+                                    for o in (source, target)]
         self.dependency = dependency
 
     def __str__(self):
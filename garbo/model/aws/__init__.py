@@ -2,56 +2,110 @@
     garbo AWS resources
 """
 
+from abc import abstractproperty
+
+from garbo.cleanup import AWSDeleter, ElasticIPDeleter
 from garbo.model import AbstractResource
+from garbo.usage import CloudWatchActivityProbe
 
 __author__ = 'nati'
 
 
 class AWSBaseResource(AbstractResource):
-    def __init__(self, region, resource_id, created=None, used=False, cleanup_candidate=True):
-        rid = '/'.join((region, resource_id))
+    __slots__ = ('region', 'resource_id', 'account')
+
+    def __init__(self, region, resource_id, created=None, used=False, cleanup_candidate=True, account=None):
+        """
+        :param account: AWS account ID qualifying the resource (multi-account discoveries), None otherwise
+        """
+        self.region = region
+        self.resource_id = resource_id
+        self.account = account
         super(AWSBaseResource, self).__init__(provider='AWS',
                                               rtype=self.__class__.__name__,
-                                              rid=rid,
+                                              rid=AWSBaseResource._rid(region, resource_id, account),
                                               created=created,
                                               used=used,
                                               cleanup_candidate=cleanup_candidate)
 
+    def __setstate__(self, state):
+        # resources pickled before multi-account discoveries
+        self.account = None
+        super(AWSBaseResource, self).__setstate__(state)
+
+    @staticmethod
+    def _rid(region, resource_id, account=None):
+        return '/'.join((account, region, resource_id) if account else (region, resource_id))
+
+    @classmethod
+    def make_urid(cls, region, resource_id, account=None):
+        """
+        urid of a resource of this type, without creating the resource (eg. for relation endpoints)
+        """
+        return AbstractResource.make_urid('AWS', cls.__name__, AWSBaseResource._rid(region, resource_id, account))
+
+    @abstractproperty
+    def deleter(self):
+        """
+        garbo.cleanup.Deleter of the resource type
+        """
+        pass
+
     def cleanup(self):
-        # TODO: implement generic AWS cleanup method
-        super(AWSBaseResource, self).cleanup()
+        """
+        Delete the resource, see garbo.cleanup.execute for deleting many resources in dependency order
+        """
+        self.deleter.delete(self.region, [self])
 
 
 class EBSSnapshot(AWSBaseResource):
-    pass
+    __slots__ = ()
+
+    deleter = AWSDeleter('boto.ec2', 'delete_snapshot')
 
 
 class EBSVolume(AWSBaseResource):
-    pass
+    __slots__ = ()
+
+    deleter = AWSDeleter('boto.ec2', 'delete_volume')
+    usage_probe = CloudWatchActivityProbe('AWS/EBS', 'VolumeReadOps', 'VolumeId')
 
 
 class Image(AWSBaseResource):
-    pass
+    __slots__ = ()
+
+    deleter = AWSDeleter('boto.ec2', 'deregister_image')
 
 
 class LoadBalancer(AWSBaseResource):
-    pass
+    __slots__ = ()
+
+    deleter = AWSDeleter('boto.ec2.elb', 'delete_load_balancer')
+    usage_probe = CloudWatchActivityProbe('AWS/ELB', 'RequestCount', 'LoadBalancerName')
 
 
 class SecurityGroup(AWSBaseResource):
+    __slots__ = ()
+
+    deleter = AWSDeleter('boto.ec2', 'delete_security_group', argument='group_id')
+
     @classmethod
     def is_cleanup_candidate(cls, group):
         return True if group.name != 'default' else False
 
 
 class Instance(AWSBaseResource):
+    __slots__ = ()
+
+    deleter = AWSDeleter('boto.ec2', 'terminate_instances', batch_size=1000)
+
     # Instance state codes considered as used,
     #   see: http://docs.aws.amazon.com/AWSEC2/latest/APIReference/API_InstanceState.html
     __TERMINATING_STATE_CODES = (48, )
     __RUNNING_STATE_CODES = (0, 16)
 
-    def __init__(self, region, resource_id, created=None, used=None, cleanup_candidate=True):
-        super(Instance, self).__init__(region, resource_id, created, used, cleanup_candidate)
+    def __init__(self, region, resource_id, created=None, used=None, cleanup_candidate=True, account=None):
+        super(Instance, self).__init__(region, resource_id, created, used, cleanup_candidate, account)
 
     # TODO: rename/move, running instance doesn't indicate usage
     @classmethod
@@ -71,20 +125,33 @@ class Instance(AWSBaseResource):
 
 
 class AutoScalingGroup(AWSBaseResource):
-    pass
+    __slots__ = ()
+
+    # deleted along with its instances (before them, as it depends on them), only if all of them are unused
+    deleter = AWSDeleter('boto.ec2.autoscale', 'delete_auto_scaling_group', members=('Instance',), force_delete=True)
 
 
 class LaunchConfiguration(AWSBaseResource):
-    pass
+    __slots__ = ()
+
+    deleter = AWSDeleter('boto.ec2.autoscale', 'delete_launch_configuration')
 
 
 class KeyPair(AWSBaseResource):
-    pass
+    __slots__ = ()
+
+    deleter = AWSDeleter('boto.ec2', 'delete_key_pair')
 
 
 class ElasticIP(AWSBaseResource):
-    pass
+    __slots__ = ()
+
+    deleter = ElasticIPDeleter()
 
 
 class CacheCluster(AWSBaseResource):
-    pass
+    __slots__ = ()
+
+    deleter = AWSDeleter('boto.elasticache', 'delete_cache_cluster')
+    usage_probe = CloudWatchActivityProbe('AWS/ElastiCache', 'CurrConnections', 'CacheClusterId',
+                                          statistic='Maximum')
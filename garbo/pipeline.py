@@ -0,0 +1,129 @@
+"""
+    Pipelined discovery- store and index a discovery while it runs
+
+    The discovered items are fed into bounded queues, consumed at the same time by a storage writer stage and
+      an index building stage (a CompactGraph), each on its own thread. Network waits, disk writes and
+      indexing overlap, so the run takes about as long as its slowest stage rather than the sum of the
+      stages, and the sweep starts the moment the discovery finishes, on an already built graph. The bounded
+      queues apply backpressure, so a slow stage slows the discovery down instead of buffering the graph.
+
+    Storage backends dumping a CompactGraph anyway (eg. snapshots) are given the index once it is built, rather
+      than building a second one.
+"""
+
+import functools
+import logging
+import threading
+
+try:
+    import Queue
+except ImportError:
+    # noinspection PyPep8Naming
+    import queue as Queue
+
+from garbo import config, metrics
+from garbo.graph import CompactGraph
+
+__author__ = 'nati'
+
+# items are passed between stages in chunks, amortizing the queue synchronization
+CHUNK_SIZE = 256
+
+_DONE = object()
+_ABORT = object()
+
+
+class PipelineAborted(Exception):
+    """
+    The discovery feeding the pipeline failed
+    """
+
+
+class _Stage(threading.Thread):
+    """
+    A pipeline stage, running consume(items) over the items of its bounded queue
+    """
+
+    def __init__(self, name, consume, queue_size):
+        super(_Stage, self).__init__(name='garbo-pipeline-%s' % name)
+        self.daemon = True
+        self.stage = name
+        self.queue = Queue.Queue(maxsize=max(1, queue_size // CHUNK_SIZE))
+        self.consume = consume
+        self.result = None
+        self.error = None
+        self._ended = False
+
+    def _items(self):
+        while True:
+            item = self.queue.get()
+            self._ended = item is _DONE or item is _ABORT
+            if item is _DONE:
+                return
+            if item is _ABORT:
+                # fail the stage, rather than storing a partial graph
+                raise PipelineAborted()
+            for chunk_item in item:
+                yield chunk_item
+
+    def run(self):
+        try:
+            with metrics.timed_stage(self.stage):
+                self.result = self.consume(self._items())
+        except Exception as e:
+            self.error = e
+            # keep draining, so the producer never blocks on a failed stage
+            while not self._ended:
+                item = self.queue.get()
+                self._ended = item is _DONE or item is _ABORT
+
+
+def run(discovered, storage, queue_size=None):
+    """
+    Store and index a running discovery
+
+    :param discovered: iterable of resources and relations (eg. a running discovery)
+    :param storage: storage plugin, see garbo.plugins
+    :param queue_size: maximal number of items waiting for each stage (default: config.pipeline.queue_size)
+    :return: CompactGraph of the discovered graph
+    :raise: the error of the discovery, or of a failed stage
+    """
+    queue_size = int(queue_size or config.pipeline.queue_size)
+    stages = [_Stage('index', CompactGraph, queue_size)]
+    if not getattr(storage, 'DUMPS_COMPACT_GRAPH', False):
+        stages.append(_Stage('storage', functools.partial(storage.dump_graph, raise_errors=True), queue_size))
+    for stage in stages:
+        stage.start()
+    count = 0
+    end = _ABORT
+    chunk = []
+    try:
+        for item in discovered:
+            chunk.append(item)
+            if len(chunk) == CHUNK_SIZE:
+                for stage in stages:
+                    stage.queue.put(chunk)
+                count += len(chunk)
+                chunk = []
+                failed = next((stage for stage in stages if stage.error is not None), None)
+                if failed is not None:
+                    # stop the discovery, aborting the other stages
+                    raise failed.error
+        for stage in stages:
+            stage.queue.put(chunk)
+        count += len(chunk)
+        end = _DONE
+    finally:
+        for stage in stages:
+            stage.queue.put(end)
+        for stage in stages:
+            stage.join()
+    for stage in stages:
+        if stage.error is not None:
+            raise stage.error
+    graph = stages[0].result
+    if len(stages) == 1:
+        with metrics.timed_stage('storage'):
+            storage.dump_graph(graph)
+    logging.info('pipelined %d discovered items into storage and the graph index', count)
+    return graph
@@ -0,0 +1,58 @@
+"""
+    garbo plugins- discovery providers, storage backends and exporters, imported only when used
+
+    Built-in plugins are registered by module name. Other packages can add plugins with setuptools entry
+      points in the garbo.discovery, garbo.storage and garbo.exporters groups, which are only scanned for
+      plugin names that aren't built-in (so the common paths never pay for scanning installed packages).
+
+    Plugin interfaces:
+      discovery- a module with collect_all(), yielding resources and relations
+      storage- a module with dump_graph(graph, raise_errors=False) and load_graph(), optionally record(graph) for
+        streaming, and DUMPS_COMPACT_GRAPH if dump_graph builds a CompactGraph anyway (see garbo.pipeline)
+      exporters- a module with export_graph(graph, filename, **options)
+"""
+
+import importlib
+
+__author__ = 'nati'
+
+DISCOVERY = 'garbo.discovery'
+STORAGE = 'garbo.storage'
+EXPORTERS = 'garbo.exporters'
+
+_BUILTIN = {
+    DISCOVERY: {'aws': 'garbo.discovery.aws'},
+    STORAGE: {'dummy': 'garbo.storage.dummy',
+              'stream': 'garbo.storage.stream',
+              'sqlite': 'garbo.storage.sqlite',
+              'snapshot': 'garbo.storage.snapshot'},
+    EXPORTERS: {'d3js': 'garbo.storage.d3js'},
+}
+
+
+def _entry_points(group):
+    """
+    :return: dict of plugin name -> module name, of the installed entry points of group
+    """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        import pkg_resources
+        return {ep.name: ep.module_name for ep in pkg_resources.iter_entry_points(group)}
+    installed = entry_points()
+    selected = installed.select(group=group) if hasattr(installed, 'select') else installed.get(group, ())
+    return {ep.name: ep.value.split(':')[0] for ep in selected}
+
+
+def load(group, name):
+    """
+    Import a plugin
+
+    :param group: DISCOVERY, STORAGE or EXPORTERS
+    :param name: plugin name (eg. sqlite)
+    :return: the plugin module
+    """
+    module = _BUILTIN[group].get(name) or _entry_points(group).get(name)
+    if module is None:
+        raise ValueError('unknown %s plugin %s' % (group, name))
+    return importlib.import_module(module)
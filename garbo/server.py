@@ -0,0 +1,310 @@
+"""
+    Graph server- serve the D3.js viewer, and subgraphs of a stored graph
+
+    The graph is loaded once and indexed in memory (by application, region and type), and the viewer fetches
+      only the subgraph it shows:
+      GET /api/graph?application=&region=&rtype=&urid=&depth=&offset=&limit=
+        resources matching all the given filters (urid selects the neighborhood of a resource, up to depth
+        relations away), a page at a time, with the relations between them
+      GET /api/summary
+        number of resources by application, region and type
+    Responses are cached, gzipped when the client accepts it, and carry an ETag (answered by 304 Not Modified).
+      Large static files (eg. an exported garbo.json) are streamed from the disk instead.
+"""
+
+from collections import OrderedDict, defaultdict, deque
+import gzip
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+
+from garbo import config
+from garbo.graph import CompactGraph
+from garbo.storage.d3js import D3JSForce
+
+__author__ = 'nati'
+
+# maximal number of cached responses
+CACHE_SIZE = 256
+# static files larger than this are streamed from the disk, rather than cached (and gzipped) in memory
+MAX_CACHED_FILE = 1 << 20
+
+
+def _dump(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def _read(filename):
+    with open(filename, 'rb') as static_file:
+        return static_file.read()
+
+
+def _gzip(data):
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb') as gzip_file:
+        gzip_file.write(data)
+    return out.getvalue()
+
+
+class GraphIndex(object):
+    """
+    In memory indices of a graph, answering subgraph queries
+    """
+
+    def __init__(self, graph, ownership=None):
+        """
+        :param graph: iterable of resources and relations, or a CompactGraph
+        :param ownership: dict of used urid -> applications using it, see garbo.utils.sweep_applications
+        """
+        self.graph = graph if isinstance(graph, CompactGraph) else CompactGraph(graph)
+        self.nodes = [node for node in range(len(self.graph)) if self.graph.is_resource(node)]
+        self.groups = {}
+        self.regions = defaultdict(list)
+        self.rtypes = defaultdict(list)
+        self.applications = defaultdict(list)
+        self._predecessors = defaultdict(list)
+        for node in self.nodes:
+            rtype = self.graph.rtype(node)
+            self.groups[node] = D3JSForce.group(rtype, self.graph.used(node))
+            self.regions[self.graph.region(node)].append(node)
+            self.rtypes[rtype].append(node)
+            for target in self.graph.successors(node):
+                self._predecessors[target].append(node)
+        for urid, applications in (ownership or {}).items():
+            node = self.graph.node(urid)
+            if node is not None:
+                for application in applications:
+                    self.applications[application].append(node)
+        for nodes in self.applications.values():
+            nodes.sort()
+
+    def neighborhood(self, urid, depth=1):
+        """
+        :param depth: number of relations, between 0 and config.server.max_depth
+        :return: the resources up to depth relations away from urid (in either direction)
+        """
+        depth = min(max(0, depth), int(config.server.max_depth))
+        start = self.graph.node(urid)
+        if start is None or not self.graph.is_resource(start):
+            return []
+        distances = {start: 0}
+        pending = deque([start])
+        while pending:
+            node = pending.popleft()
+            if distances[node] == depth:
+                continue
+            for neighbor in list(self.graph.successors(node)) + self._predecessors.get(node, []):
+                if neighbor not in distances and neighbor in self.groups:
+                    distances[neighbor] = distances[node] + 1
+                    pending.append(neighbor)
+        return sorted(distances)
+
+    def select(self, application=None, region=None, rtype=None, urid=None, depth=1):
+        """
+        :return: sorted node IDs of the resources matching all the given filters
+        """
+        selections = []
+        if application is not None:
+            selections.append(self.applications.get(application, []))
+        if region is not None:
+            selections.append(self.regions.get(region, []))
+        if rtype is not None:
+            selections.append(self.rtypes.get(rtype, []))
+        if urid is not None:
+            selections.append(self.neighborhood(urid, depth))
+        if not selections:
+            return self.nodes
+        selections.sort(key=len)
+        selected = selections[0]
+        for other in selections[1:]:
+            other = set(other)
+            selected = [node for node in selected if node in other]
+        return selected
+
+    def subgraph(self, nodes, offset=0, limit=None):
+        """
+        :param limit: number of nodes per page, up to config.server.page_size (default)
+        :return: a page of nodes, and the relations between them, in the D3.js force directed graph format
+        """
+        page_size = int(config.server.page_size)
+        offset = max(0, offset)
+        limit = min(max(1, limit), page_size) if limit else page_size
+        page = nodes[offset:offset + limit]
+        index = {node: i for i, node in enumerate(page)}
+        links = [{"source": i, "target": index[target], "value": 1}
+                 for i, node in enumerate(page) for target in self.graph.successors(node) if target in index]
+        return {"nodes": [{"name": self.graph.urids[node], "group": self.groups[node]} for node in page],
+                "links": links, "layout": False, "total": len(nodes), "offset": offset, "limit": limit,
+                "next": offset + limit if offset + limit < len(nodes) else None}
+
+    def summary(self):
+        return {"resources": len(self.nodes),
+                "applications": {k: len(v) for k, v in self.applications.items()},
+                "regions": {str(k): len(v) for k, v in self.regions.items()},
+                "rtypes": {k: len(v) for k, v in self.rtypes.items()}}
+
+
+class _ResponseCache(object):
+    """
+    LRU cache of (ETag, body, gzipped body) by request
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, render, version=None):
+        """
+        :param render: function returning the response body
+        :param version: version of the response (eg. a file modification time), a cached response of another
+          version is rendered again and replaced
+        :return: (ETag, body, gzipped body)
+        """
+        with self._lock:
+            cached = self._entries.pop(key, None)
+            if cached is not None and cached[0] == version:
+                self._entries[key] = cached
+                return cached[1]
+        body = render()
+        entry = ('"%s"' % hashlib.sha1(body).hexdigest(), body, _gzip(body))
+        with self._lock:
+            self._entries[key] = (version, entry)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return entry
+
+
+class GraphRequestHandler(BaseHTTPRequestHandler, object):
+    """
+    Serve the API of index, and the viewer files of static_dir
+
+    (a new-style class, so it can be subclassed with type on Python 2 as well)
+    """
+
+    index = None
+    static_dir = None
+    cache = None
+
+    def _not_modified(self, etag):
+        """
+        :return: True if the client has the current version (answered by 304 Not Modified)
+        """
+        if self.headers.get('If-None-Match') != etag:
+            return False
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.end_headers()
+        return True
+
+    def _respond(self, etag, body, gzipped, content_type):
+        if self._not_modified(etag):
+            return
+        compress = 'gzip' in (self.headers.get('Accept-Encoding') or '')
+        data = gzipped if compress else body
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, filename, stat, content_type):
+        etag = '"%x-%x"' % (int(stat.st_mtime * 1e6), stat.st_size)
+        if self._not_modified(etag):
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(stat.st_size))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        with open(filename, 'rb') as static_file:
+            shutil.copyfileobj(static_file, self.wfile)
+
+    def _api(self, path, params):
+        if path == '/api/summary':
+            return lambda: _dump(self.index.summary())
+        if path == '/api/graph':
+            # depth, offset and limit are clamped by the index
+            filters = {k: params[k][0] for k in ('application', 'region', 'rtype', 'urid') if k in params}
+            depth = int(params.get('depth', [1])[0])
+            offset = int(params.get('offset', [0])[0])
+            limit = int(params.get('limit', [0])[0]) or None
+            return lambda: _dump(self.index.subgraph(self.index.select(depth=depth, **filters), offset, limit))
+        return None
+
+    def _static(self, path):
+        path = os.path.normpath(path.lstrip('/') or 'index.html')
+        filename = os.path.join(self.static_dir, path)
+        if path.startswith('..') or os.path.isabs(path) or not os.path.isfile(filename):
+            return None
+        return filename
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            render = self._api(url.path, parse_qs(url.query))
+        except ValueError:
+            self.send_error(400, 'invalid parameters')
+            return
+        if render is not None:
+            etag, body, gzipped = self.cache.get((url.path, url.query), render)
+            self._respond(etag, body, gzipped, 'application/json')
+            return
+        filename = self._static(url.path)
+        if filename is None:
+            self.send_error(404)
+            return
+        stat = os.stat(filename)
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        if stat.st_size > MAX_CACHED_FILE:
+            self._stream(filename, stat, content_type)
+            return
+        etag, body, gzipped = self.cache.get(filename, lambda: _read(filename), version=(stat.st_mtime, stat.st_size))
+        self._respond(etag, body, gzipped, content_type)
+
+    def log_message(self, format, *args):
+        logging.debug('%s - %s', self.address_string(), format % args)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(graph, ownership=None, host=None, port=None):
+    """
+    Serve the viewer and the subgraphs of graph, until interrupted
+
+    :param graph: iterable of resources and relations, or a CompactGraph
+    :param ownership: dict of used urid -> applications using it, to filter by application
+    """
+    host = host or config.server.host
+    port = int(port or config.server.port)
+    index = GraphIndex(graph, ownership)
+    handler = type('Handler', (GraphRequestHandler,),
+                   {'index': index, 'static_dir': config.server.static_dir, 'cache': _ResponseCache()})
+    server = _ThreadingHTTPServer((host, port), handler)
+    logging.info('serving %d resources on http://%s:%d/', len(index.nodes), host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1 +1,4 @@
 __author__ = 'nati'
+
+# D3.js level of detail modes, see garbo.storage.d3js.D3JSForce.export
+LOD_MODES = ('type', 'region', 'component')
@@ -1,49 +1,223 @@
 import json
 import logging
+import os
+from collections import defaultdict
+
+from garbo.graph import CompactGraph
 from garbo.model import Relation, AbstractResource
-from garbo.model.aws import Instance
+from garbo.storage import LOD_MODES
+from garbo.storage.layout import cached_layout
 
 __author__ = 'nati'
 
 # TODO: support more resource types
 # TODO: remove static types
 
+# connected components smaller than this are bucketed by region, instead of an overview node each
+SMALL_COMPONENT = 3
+
+
+def _dump(obj):
+    # compact JSON, no indentation or whitespace
+    return json.dumps(obj, separators=(',', ':'))
+
 
 class D3JSForce(object):
     def __init__(self):
         self.nodes = []
         self.links = []
+        # positions of the added items, a later item replaces an earlier one (see GraphBuilder.feed)
+        self._node_index = {}
+        self._link_index = {}
         super(D3JSForce, self).__init__()
 
     def add_item(self, item):
         if isinstance(item, AbstractResource):
-            self.nodes.append(item)
+            self._add(self.nodes, self._node_index, item.urid(), item)
         elif isinstance(item, Relation):
-            self.links.append(item)
+            self._add(self.links, self._link_index, (item.source, item.target), item)
         else:
             logging.warn('unable to add item, not a valid resource or relation')
 
-    def export(self, filename):
+    @staticmethod
+    def _add(items, index, key, item):
+        position = index.setdefault(key, len(items))
+        if position < len(items):
+            items[position] = item
+        else:
+            items.append(item)
+
+    def export(self, filename, lod=None, layout=False, width=4000):
+        """
+        Export the graph as a D3.js force directed graph JSON file
+
+        :param filename: output file
+        :param lod: level of detail, None to export all the resources, or one of LOD_MODES to export resources
+          aggregated by type, region or connected component (with counts, components smaller than SMALL_COMPONENT
+          are bucketed by region). Each aggregate node refers a detail file (next to filename) containing its
+          resources, loaded on demand by the viewer.
+        :param layout: precompute node positions (cached by graph hash), so the viewer doesn't simulate
+        :param width: layout width (should match the viewer)
+        """
         logging.info('generating D3.js graph with %d resources, and %d relations', len(self.nodes), len(self.links))
-        # convert to D3JSForce
-        nodes = [{"name": str(n), "group": D3JSForce.to_group(n)} for n in self.nodes]
-        nodes_dict = {nd.get('name'): i for i, nd in enumerate(nodes)}
-        links = [{"source": nodes_dict.get(l.source),
-                  "target": nodes_dict.get(l.target),
-                  "value": 1} for l in self.links
-                 if l.source in nodes_dict and l.target in nodes_dict]
-        with open(filename, 'wb') as file_out:
-            json.dump({"nodes": nodes, "links": links}, file_out, indent=2)
+        layout = self._layout(filename, width) if layout else None
+        if lod:
+            self._export_lod(filename, lod, layout)
+        else:
+            self._write_graph(filename, self.nodes, self.links, layout)
+
+    def export_compact(self, graph, filename, layout=False, width=4000):
+        """
+        Export a CompactGraph (eg. a mapped garbo.storage.snapshot) straight from its arrays, without
+          materializing resource and relation objects. See export for the parameters.
+
+        :type graph: CompactGraph
+        """
+        nodes = [node for node in range(len(graph)) if graph.is_resource(node)]
+        index = {node: i for i, node in enumerate(nodes)}
+        links = ((index[node], index[target]) for node in nodes for target in graph.successors(node)
+                 if target in index)
+        logging.info('generating D3.js graph with %d resources', len(nodes))
+        self._write_nodes(filename, [graph.urids[node] for node in nodes],
+                          [D3JSForce.group(graph.rtype(node), graph.used(node)) for node in nodes], links,
+                          self._layout(filename, width) if layout else None)
+
+    @staticmethod
+    def _layout(filename, width):
+        """
+        :return: (layout width, layout cache directory) of an export into filename
+        """
+        return width, os.path.join(os.path.dirname(os.path.abspath(filename)), '.layout-cache')
+
+    def _write_graph(self, filename, nodes, links, layout=None):
+        """
+        Stream resources and relations into a D3JSForce JSON file, a node at a time
+        """
+        names = [str(n) for n in nodes]
+        nodes_dict = {name: i for i, name in enumerate(names)}
+        links = ((nodes_dict[l.source], nodes_dict[l.target]) for l in links
+                 if l.source in nodes_dict and l.target in nodes_dict)
+        self._write_nodes(filename, names, [D3JSForce.to_group(n) for n in nodes], links, layout)
+
+    def _write_nodes(self, filename, names, groups, links, layout=None):
+        """
+        :param links: iterable of (source index, target index) pairs, streamed into the file unless laid out
+        :param layout: (width, cache directory) to precompute the node positions, None to let the viewer simulate
+        """
+        positions = None
+        if layout:
+            links = list(links)
+            positions = cached_layout(names, links, *layout)
+        with open(filename, 'w') as file_out:
+            file_out.write('{"nodes":[')
+            for i, name in enumerate(names):
+                node = {"name": name, "group": groups[i]}
+                if positions:
+                    node["x"], node["y"] = positions[i]
+                file_out.write((',' if i else '') + _dump(node))
+            file_out.write('],"links":[')
+            for i, (source, target) in enumerate(links):
+                file_out.write((',' if i else '') + _dump({"source": source, "target": target, "value": 1}))
+            file_out.write('],"layout":%s}' % _dump(bool(positions)))
+
+    def _clusters(self, lod):
+        """
+        :return: dict of urid -> cluster key
+        """
+        if lod == 'type':
+            return {n.urid(): n.rtype for n in self.nodes}
+        if lod == 'region':
+            return {n.urid(): getattr(n, 'region', None) or n.provider for n in self.nodes}
+        if lod == 'component':
+            # weakly connected components, using union-find
+            parents = {n.urid(): n.urid() for n in self.nodes}
+
+            def find(urid):
+                while parents[urid] != urid:
+                    parents[urid] = parents[parents[urid]]
+                    urid = parents[urid]
+                return urid
+
+            for l in self.links:
+                if l.source in parents and l.target in parents:
+                    parents[find(l.source)] = find(l.target)
+            roots = {urid: find(urid) for urid in parents}
+            sizes = defaultdict(int)
+            for root in roots.values():
+                sizes[root] += 1
+            regions = {n.urid(): getattr(n, 'region', None) or n.provider for n in self.nodes}
+            # the roots of large components are resource URIDs, buckets of small components are named by region
+            return {urid: root if sizes[root] >= SMALL_COMPONENT else '%s (small components)' % regions[urid]
+                    for urid, root in roots.items()}
+        raise ValueError('unknown level of detail %s, expected one of %s' % (lod, ', '.join(LOD_MODES)))
+
+    def _export_lod(self, filename, lod, layout=None):
+        clusters = self._clusters(lod)
+        members = defaultdict(list)
+        for n in self.nodes:
+            members[clusters[n.urid()]].append(n)
+        keys = sorted(members, key=lambda k: -len(members[k]))
+        index = {k: i for i, k in enumerate(keys)}
+
+        base, extension = os.path.splitext(filename)
+        detail_links = defaultdict(list)
+        cluster_links = defaultdict(int)
+        for l in self.links:
+            source, target = clusters.get(l.source), clusters.get(l.target)
+            if source is None or target is None:
+                continue
+            if source == target:
+                detail_links[source].append(l)
+            else:
+                cluster_links[(index[source], index[target])] += 1
+
+        nodes = []
+        for i, k in enumerate(keys):
+            detail = '%s.%d%s' % (base, i, extension)
+            self._write_graph(detail, members[k], detail_links.pop(k, []), layout)
+            group = D3JSForce.to_group(members[k][0]) if lod == 'type' else i % 20 + 2
+            name = '%s (+%d)' % (k, len(members[k]) - 1) if lod == 'component' and k in clusters else k
+            nodes.append({"name": name, "group": group, "count": len(members[k]),
+                          "detail": os.path.basename(detail)})
+        links = [{"source": s, "target": t, "value": count} for (s, t), count in sorted(cluster_links.items())]
+        positions = cached_layout([n["name"] for n in nodes], sorted(cluster_links), *layout) if layout else None
+        for node, position in zip(nodes, positions or ()):
+            node["x"], node["y"] = position
+        with open(filename, 'w') as file_out:
+            file_out.write(_dump({"nodes": nodes, "links": links, "lod": lod, "layout": bool(positions)}))
+        logging.info('generated D3.js overview of %d %s clusters', len(nodes), lod)
 
     TYPE_TO_GROUP = ['SecurityGroup', 'LoadBalancer', 'EBSVolume', 'EBSSnapshot', 'Image', 'ElasticIP',
                      'KeyPair', 'LaunchConfiguration', 'AutoScalingGroup', 'CacheCluster']
 
     @classmethod
     def to_group(cls, item):
-        item_type = item.rtype
-        if isinstance(item, Instance) and item.used:
+        return cls.group(item.rtype, item.used)
+
+    @classmethod
+    def group(cls, rtype, used):
+        if rtype == 'Instance' and used:
             return 0
-        elif isinstance(item, Instance):
+        elif rtype == 'Instance':
             return 1
         else:
-            return D3JSForce.TYPE_TO_GROUP.index(item_type) + 2
+            return D3JSForce.TYPE_TO_GROUP.index(rtype) + 2
+
+
+def export_graph(graph, filename, **options):
+    """
+    Export a graph as a D3.js force directed graph JSON file (the exporter plugin interface)
+
+    :param graph: iterable of resources and relations, or a CompactGraph (exported from its arrays, unless
+      exporting by level of detail)
+    :param options: see D3JSForce.export
+    """
+    fdg = D3JSForce()
+    if isinstance(graph, CompactGraph) and not options.get('lod'):
+        # (garbo.py always passes lod, None without --d3js-lod)
+        options.pop('lod', None)
+        fdg.export_compact(graph, filename, **options)
+        return
+    for item in graph:
+        fdg.add_item(item)
+    fdg.export(filename, **options)
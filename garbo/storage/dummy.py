@@ -15,20 +15,25 @@ def _graph_file():
     return os.path.join(config.dummy_storage.working_dir, config.dummy_storage.graph_filename)
 
 
-def dump_graph(graph):
+def dump_graph(graph, raise_errors=False):
+    """
+    :param raise_errors: raise storage errors (eg. to fail a pipeline, see garbo.pipeline), instead of logging them
+    """
     graph = list(graph)  # if graph is a generator, get all the resources/relation
     try:
-        with open(_graph_file(), 'w') as graph_file:
+        with open(_graph_file(), 'wb') as graph_file:
             pickle.dump(graph, graph_file)
         logging.info('exported pickled graph to %s', _graph_file())
     except Exception:
         logging.exception('unable to dump graph to file')
+        if raise_errors:
+            raise
 
 
 def load_graph():
     graph = []
     try:
-        with open(_graph_file()) as graph_file:
+        with open(_graph_file(), 'rb') as graph_file:
             graph = pickle.load(graph_file)
         logging.info('loaded pickled graph from %s', _graph_file())
     except Exception:
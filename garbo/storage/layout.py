@@ -0,0 +1,119 @@
+"""
+    Offline graph layout for the D3.js viewer
+
+    A layered layout over the (mostly acyclic) dependency graph: every resource is placed below the
+      resources depending on it, and resources of a layer are ordered by their dependents' positions.
+      Layouts are cached by graph hash, so unchanged graphs skip the computation.
+"""
+
+from collections import defaultdict, deque
+import hashlib
+import json
+import logging
+import os
+
+__author__ = 'nati'
+
+LAYER_HEIGHT = 60
+NODE_SPACING = 20
+
+
+def graph_hash(names, links):
+    """
+    :param names: node names
+    :param links: (source index, target index) tuples
+    :return: hex digest identifying the graph
+    """
+    digest = hashlib.sha1()
+    for name in names:
+        digest.update(name.encode('utf-8') + b'\n')
+    for source, target in links:
+        digest.update(('%d,%d\n' % (source, target)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _layers(count, links):
+    """
+    Longest path layering, nodes on cycles are layered once the rest of the graph is done
+    """
+    successors = defaultdict(list)
+    in_degree = [0] * count
+    for source, target in links:
+        if source != target:
+            successors[source].append(target)
+            in_degree[target] += 1
+    layer = [0] * count
+    pending = deque(n for n in range(count) if in_degree[n] == 0)
+    done = bytearray(count)
+    remaining = 0
+    while True:
+        while pending:
+            node = pending.popleft()
+            done[node] = 1
+            for target in successors[node]:
+                layer[target] = max(layer[target], layer[node] + 1)
+                in_degree[target] -= 1
+                if in_degree[target] == 0:
+                    pending.append(target)
+        # break a cycle at its first remaining node
+        while remaining < count and done[remaining]:
+            remaining += 1
+        if remaining == count:
+            return layer
+        in_degree[remaining] = 0
+        pending.append(remaining)
+
+
+def layered_layout(count, links, width):
+    """
+    :param count: number of nodes
+    :param links: (source index, target index) tuples
+    :param width: maximal layout width, wide layers are wrapped into multiple rows
+    :return: list of (x, y) positions by node index
+    """
+    layer = _layers(count, links)
+    predecessors = defaultdict(list)
+    for source, target in links:
+        predecessors[target].append(source)
+
+    per_row = max(1, width // NODE_SPACING - 1)
+    positions = [None] * count
+    order = {}
+    y = LAYER_HEIGHT
+    for current in range(max(layer) + 1 if count else 0):
+        nodes = [n for n in range(count) if layer[n] == current]
+        # barycenter ordering, place nodes under their dependents
+        nodes.sort(key=lambda n: sum(order.get(p, 0) for p in predecessors[n]) / float(len(predecessors[n]))
+                   if predecessors[n] else 0)
+        for i, node in enumerate(nodes):
+            order[node] = i * per_row / float(max(1, len(nodes)))
+            row, column = divmod(i, per_row)
+            positions[node] = (NODE_SPACING * (column + 1), y + row * NODE_SPACING)
+        y += LAYER_HEIGHT + (len(nodes) - 1) // per_row * NODE_SPACING
+    return positions
+
+
+def cached_layout(names, links, width, cache_dir):
+    """
+    Layered layout, cached by graph hash in cache_dir
+
+    :return: list of (x, y) positions by node index
+    """
+    cache_file = os.path.join(cache_dir, '%s-%d.json' % (graph_hash(names, links), width))
+    try:
+        with open(cache_file) as cached:
+            positions = [tuple(p) for p in json.load(cached)]
+        logging.info('using cached graph layout %s', cache_file)
+        return positions
+    except (IOError, ValueError):
+        pass
+
+    positions = layered_layout(len(names), links, width)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(cache_file, 'w') as cached:
+            json.dump(positions, cached, separators=(',', ':'))
+    except (IOError, OSError):
+        logging.exception('unable to cache graph layout')
+    return positions
@@ -0,0 +1,97 @@
+"""
+    Retention index- why is a resource kept?
+
+    A sweep can record, for every used resource, the BFS parent it was first marked from, the applications
+      keeping it, and the applications it is a root of. explain() then answers from this SQLite index alone:
+      the shortest retention path from a root to the resource, and the applications it is reachable from.
+"""
+
+import logging
+import os
+import sqlite3
+
+from garbo import config
+from garbo.utils import atomic_file
+
+__author__ = 'nati'
+
+_SCHEMA = """
+CREATE TABLE retention (
+    node INTEGER PRIMARY KEY,
+    urid TEXT UNIQUE,
+    parent INTEGER,
+    applications TEXT,
+    root_of TEXT
+);
+"""
+
+# separates application names in the applications and root_of columns
+_SEPARATOR = '\n'
+
+
+def _retention_file():
+    return os.path.join(config.retention.working_dir, config.retention.filename)
+
+
+def dump_retention(graph, applications, names, masks, parents, filename=None):
+    """
+    Replace the retention index by the marks of a sweep
+
+    :type graph: garbo.graph.CompactGraph
+    :param applications: dict of application name -> iterable of root urids
+    :param names: application names by bit, see garbo.graph.reachability
+    :param masks: application bitsets by node ID
+    :param parents: BFS parents by node ID
+    """
+    filename = filename or _retention_file()
+    root_of = {}
+    for name in sorted(applications):
+        for urid in applications[name]:
+            root_of.setdefault(urid, []).append(name)
+
+    def rows():
+        for node, mask in enumerate(masks):
+            if mask:
+                urid = graph.urids[node]
+                yield (node, urid, parents[node] if parents[node] >= 0 else None,
+                       _SEPARATOR.join(name for bit, name in enumerate(names) if mask >> bit & 1),
+                       _SEPARATOR.join(root_of[urid]) if urid in root_of else None)
+
+    # written aside, so explain never reads a partial index
+    with atomic_file(filename) as temporary:
+        conn = sqlite3.connect(temporary)
+        try:
+            with conn:
+                conn.executescript(_SCHEMA)
+                conn.executemany('INSERT INTO retention VALUES (?, ?, ?, ?, ?)', rows())
+        finally:
+            conn.close()
+    logging.info('recorded retention index %s', filename)
+
+
+def explain(urid, filename=None):
+    """
+    Explain why a resource is kept
+
+    :return: (retention path, applications keeping the resource), where the path is a list of
+      (urid, applications it is a root of) from a root to the resource. None if the resource isn't kept.
+    """
+    filename = filename or _retention_file()
+    if not os.path.exists(filename):
+        raise IOError('no retention index %s, record one with a sweep (garbo.py -a ... --retention)' % filename)
+    conn = sqlite3.connect(filename)
+    try:
+        row = conn.execute('SELECT parent, applications, root_of FROM retention WHERE urid = ?', (urid,)).fetchone()
+        if row is None:
+            return None
+        parent, applications, root_of = row
+        path = [(urid, root_of.split(_SEPARATOR) if root_of else [])]
+        while parent is not None:
+            node = parent
+            parent_urid, parent, root_of = conn.execute(
+                'SELECT urid, parent, root_of FROM retention WHERE node = ?', (node,)).fetchone()
+            path.append((parent_urid, root_of.split(_SEPARATOR) if root_of else []))
+        path.reverse()
+        return path, applications.split(_SEPARATOR)
+    finally:
+        conn.close()
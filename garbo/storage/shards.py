@@ -0,0 +1,159 @@
+"""
+    Discovery shards- checkpoint the discovery output of every (account, region, collector)
+
+    A shard is written as a temporary graph log (see garbo.storage.stream), and renamed into place only once
+      its collector completes, so a crashed discovery leaves behind just its completed shards. A shard's
+      modification time is the time its collector started, and is used to decide whether it is fresh.
+"""
+
+import logging
+import os
+import pickle
+import time
+
+from garbo import config
+from garbo.storage.stream import _LENGTH, _read_records
+from garbo.utils import replace_file
+
+__author__ = 'nati'
+
+# marks a running discovery, holding its start time
+_RUN_FILENAME = 'running'
+
+
+class Shard(object):
+    """
+    A shard being written, committed explicitly once its collector completes
+    """
+
+    def __init__(self, path, on_commit=None):
+        self.path = path
+        self._on_commit = on_commit
+        self.started = time.time()
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                # created concurrently
+                pass
+        self._file = open('%s.%d.tmp' % (path, id(self)), 'wb')
+
+    def write(self, item):
+        data = pickle.dumps(item, 2)
+        self._file.write(_LENGTH.pack(len(data)))
+        self._file.write(data)
+
+    def commit(self):
+        self._file.close()
+        os.utime(self._file.name, (self.started, self.started))
+        replace_file(self._file.name, self.path)
+        if self._on_commit:
+            self._on_commit()
+
+    def close(self):
+        """
+        Discard the shard, unless it was committed
+        """
+        if not self._file.closed:
+            self._file.close()
+            os.remove(self._file.name)
+
+
+class ShardStore(object):
+    """
+    Directory of discovery shards, keyed by (account, region, collector)
+
+    The store keeps the keys of the shards committed or read through it, see completed
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.completed = set()
+
+    def _path(self, account, region, collector):
+        return os.path.join(self.directory, account, region, '%s.shard' % collector)
+
+    def started(self, account, region, collector):
+        """
+        :return: the time the shard's collector started, or None if there is no such shard
+        """
+        try:
+            return os.path.getmtime(self._path(account, region, collector))
+        except OSError:
+            return None
+
+    def is_fresh(self, account, region, collector, since):
+        """
+        :param since: oldest start time of a fresh shard, None if no shard is fresh
+        """
+        started = self.started(account, region, collector)
+        return started is not None and since is not None and started >= since
+
+    def read(self, account, region, collector):
+        """
+        Yield the resources and relations of a committed shard
+        """
+        self.completed.add((account, region, collector))
+        with open(self._path(account, region, collector), 'rb') as shard_file:
+            for data in _read_records(shard_file):
+                yield pickle.loads(data)
+
+    def writer(self, account, region, collector):
+        """
+        :return: a new Shard, replacing the stored one when committed
+        """
+        return Shard(self._path(account, region, collector),
+                     on_commit=lambda: self.completed.add((account, region, collector)))
+
+    def _discard_partial_shards(self, account):
+        """
+        Remove the partial shards left behind by crashed discoveries of an account
+        """
+        for directory, _, filenames in os.walk(os.path.join(self.directory, account)):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    try:
+                        os.remove(os.path.join(directory, filename))
+                    except OSError:
+                        pass
+
+    def begin_run(self, account, max_age=None):
+        """
+        Mark a discovery of an account as running, keeping the start time of an interrupted one
+
+        :param max_age: maximal age in seconds of a resumed discovery (default: config.shards.resume_max_age)
+        :return: the start time of an interrupted discovery, or None
+        """
+        max_age = float(max_age if max_age is not None else config.shards.resume_max_age)
+        run_file = os.path.join(self.directory, account, _RUN_FILENAME)
+        self._discard_partial_shards(account)
+        try:
+            with open(run_file) as f:
+                interrupted = float(f.read())
+            if time.time() - interrupted <= max_age:
+                logging.info('resuming an interrupted discovery, started %d seconds ago', time.time() - interrupted)
+                return interrupted
+            logging.info('not resuming an interrupted discovery, started %d seconds ago', time.time() - interrupted)
+        except (IOError, ValueError):
+            pass
+        if not os.path.isdir(os.path.dirname(run_file)):
+            os.makedirs(os.path.dirname(run_file))
+        with open(run_file, 'w') as f:
+            f.write(repr(time.time()))
+        return None
+
+    def end_run(self, account):
+        """
+        Mark a discovery of an account as completed (or failed), so it isn't resumed
+        """
+        try:
+            os.remove(os.path.join(self.directory, account, _RUN_FILENAME))
+        except OSError:
+            pass
+
+
+def shard_store():
+    """
+    :return: the ShardStore configured by config.shards
+    """
+    return ShardStore(os.path.join(config.shards.working_dir, config.shards.dirname))
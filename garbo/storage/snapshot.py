@@ -0,0 +1,314 @@
+"""
+    Snapshot storage- a memory-mapped, columnar graph snapshot
+
+    The snapshot holds a sorted urid string table, fixed-width resource columns (rtype, region, account,
+      created, used, cleanup candidate) and the CSR edge arrays of a CompactGraph. load_graph maps the file
+      and returns a SnapshotGraph reading the columns through zero-copy memoryviews, so loading takes no time
+      regardless of the graph size, the sweep runs directly on the arrays, and processes sharing a snapshot
+      share its pages through the page cache. Resource objects are only materialized when accessed.
+
+    Python 2 has no memoryview.cast, so there load_graph copies the columns out of the mapping into arrays:
+      loading takes time and memory proportional to the graph, and mapped pages aren't shared.
+
+    Columns are written in native byte order, snapshots are not portable across architectures.
+"""
+
+from array import array
+import bisect
+import calendar
+from datetime import datetime
+import importlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+
+from garbo import config
+from garbo.graph import CompactGraph
+from garbo.utils import atomic_file
+
+__author__ = 'nati'
+
+_MAGIC = b'GARBOSN1'
+_HEADER_LENGTH = struct.Struct('<Q')
+_ALIGNMENT = 8
+_NONE = -1
+
+try:
+    array('q')
+    _OFFSET_TYPECODE = 'q'
+except ValueError:
+    # Python 2 arrays have no 'q', its 'l' is 64 bit on 64 bit Unix
+    _OFFSET_TYPECODE = 'l'
+
+# dump_graph is given the graph index of a pipelined discovery, instead of a second copy (see garbo.pipeline)
+DUMPS_COMPACT_GRAPH = True
+
+
+def _graph_file():
+    return os.path.join(config.snapshot_storage.working_dir, config.snapshot_storage.snapshot_filename)
+
+
+def _timestamp(created):
+    if created is None:
+        return float('nan')
+    return calendar.timegm(created.utctimetuple()) + created.microsecond / 1e6
+
+
+class _Symbols(object):
+    """
+    Small string table of the repeated column values (types, regions, accounts, classes)
+    """
+
+    def __init__(self):
+        self.values = []
+        self._ids = {}
+
+    def id(self, value):
+        if value is None:
+            return _NONE
+        if value not in self._ids:
+            self._ids[value] = len(self.values)
+            self.values.append(value)
+        return self._ids[value]
+
+
+def dump_graph(graph, filename=None):
+    """
+    Write a graph snapshot (written aside and renamed into place, so mapped snapshots are never modified)
+
+    :param graph: iterable of resources and relations, or a CompactGraph
+    """
+    filename = filename or _graph_file()
+    graph = graph if isinstance(graph, CompactGraph) else CompactGraph(graph)
+    n = len(graph)
+    # nodes are ordered by urid, so urids are looked up by a binary search over the mapped string table
+    order = sorted(range(n), key=graph.urids.__getitem__)
+    position = array('i', [0]) * n
+    for new, old in enumerate(order):
+        position[old] = new
+
+    symbols = _Symbols()
+    columns = {name: array(typecode) for name, typecode in
+               (('urid_offsets', _OFFSET_TYPECODE), ('rtype', 'i'), ('cls', 'i'), ('provider', 'i'), ('region', 'i'),
+                ('account', 'i'), ('created', 'd'), ('used', 'B'), ('cleanup_candidate', 'B'),
+                ('offsets', 'i'), ('targets', 'i'), ('dependency', 'B'))}
+    blob = bytearray()
+    columns['offsets'].append(0)
+    for old in order:
+        columns['urid_offsets'].append(len(blob))
+        blob += graph.urids[old].encode('utf-8')
+        resource = graph.resources[old]
+        cls = type(resource) if resource is not None else None
+        columns['rtype'].append(symbols.id(resource.rtype) if resource is not None else _NONE)
+        columns['cls'].append(symbols.id('%s.%s' % (cls.__module__, cls.__name__)) if cls else _NONE)
+        columns['provider'].append(symbols.id(resource.provider) if resource is not None else _NONE)
+        columns['region'].append(symbols.id(getattr(resource, 'region', None)))
+        columns['account'].append(symbols.id(getattr(resource, 'account', None)))
+        columns['created'].append(_timestamp(resource.created) if resource is not None else float('nan'))
+        columns['used'].append(1 if resource is not None and resource.used else 0)
+        columns['cleanup_candidate'].append(graph.cleanup_candidate[old])
+        edges = sorted((position[graph.targets[edge]], graph.dependency[edge]) for edge in graph.edges(old))
+        columns['targets'].extend(target for target, _ in edges)
+        columns['dependency'].extend(dependency for _, dependency in edges)
+        columns['offsets'].append(len(columns['targets']))
+    columns['urid_offsets'].append(len(blob))
+
+    sections = [(name, columns[name].tobytes() if hasattr(columns[name], 'tobytes') else columns[name].tostring(),
+                 columns[name].typecode) for name in sorted(columns)]
+    sections.append(('urids', bytes(blob), 'B'))
+    header = {'nodes': n, 'edges': len(graph.targets), 'byteorder': sys.byteorder, 'symbols': symbols.values,
+              'sections': {}}
+    offset = 0
+    for name, data, typecode in sections:
+        header['sections'][name] = [offset, len(data), typecode]
+        offset += len(data) + -len(data) % _ALIGNMENT
+    header_data = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    base = len(_MAGIC) + _HEADER_LENGTH.size + len(header_data)
+    base += -base % _ALIGNMENT
+
+    with atomic_file(filename) as temporary:
+        with open(temporary, 'wb') as snapshot_file:
+            snapshot_file.write(_MAGIC + _HEADER_LENGTH.pack(len(header_data)) + header_data)
+            snapshot_file.write(b'\0' * (base - snapshot_file.tell()))
+            for name, data, _ in sections:
+                snapshot_file.write(data + b'\0' * (-len(data) % _ALIGNMENT))
+    logging.info('exported graph snapshot of %d nodes and %d edges to %s', n, len(graph.targets), filename)
+
+
+def _column(mapped, view, offset, length, typecode):
+    """
+    Zero-copy view of a column (a copy on Pythons without memoryview.cast)
+    """
+    if hasattr(view, 'cast'):
+        return view[offset:offset + length].cast(typecode)
+    column = array(str(typecode))
+    column.fromstring(mapped[offset:offset + length])
+    return column
+
+
+class _UridTable(object):
+    """
+    Read-only UridTable over the sorted urid string table of a snapshot
+    """
+
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __getitem__(self, node):
+        data = self._blob[self._offsets[node]:self._offsets[node + 1]]
+        return (data.tobytes() if hasattr(data, 'tobytes') else data.tostring()).decode('utf-8')
+
+    def get(self, urid):
+        node = bisect.bisect_left(self, urid)
+        return node if node < len(self) and self[node] == urid else None
+
+    def __contains__(self, urid):
+        return self.get(urid) is not None
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+
+class _Resources(object):
+    """
+    Resources by node ID, materialized from the snapshot columns on access (None for nodes without a resource)
+    """
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, node):
+        return self._graph.resource(node)
+
+    def __len__(self):
+        return len(self._graph)
+
+    def __iter__(self):
+        for node in range(len(self._graph)):
+            yield self._graph.resource(node)
+
+
+class SnapshotGraph(CompactGraph):
+    """
+    CompactGraph over a memory-mapped snapshot, see garbo.graph.CompactGraph
+
+    Its resources are materialized copies, usage is marked on the graph (see set_used) rather than on them
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as snapshot_file:
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(_MAGIC)] != _MAGIC:
+            raise ValueError('%s is not a garbo graph snapshot' % filename)
+        header_length, = _HEADER_LENGTH.unpack(self._mmap[len(_MAGIC):len(_MAGIC) + _HEADER_LENGTH.size])
+        start = len(_MAGIC) + _HEADER_LENGTH.size
+        header = json.loads(self._mmap[start:start + header_length].decode('utf-8'))
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError('%s was written on a %s endian machine' % (filename, header['byteorder']))
+        base = start + header_length
+        base += -base % _ALIGNMENT
+
+        try:
+            self._view = memoryview(self._mmap)
+        except TypeError:
+            self._view = None
+        columns = {name: _column(self._mmap, self._view, base + offset, length, typecode)
+                   for name, (offset, length, typecode) in header['sections'].items()}
+        self._columns = list(columns.values())
+        self._symbols = header['symbols']
+        self._classes = {}
+        self._rtype = columns['rtype']
+        self._cls = columns['cls']
+        self._provider = columns['provider']
+        self._region = columns['region']
+        self._account = columns['account']
+        self._created = columns['created']
+        self._used = columns['used']
+        self.urids = _UridTable(columns['urid_offsets'], columns['urids'])
+        self.resources = _Resources(self)
+        self.cleanup_candidate = columns['cleanup_candidate']
+        self.offsets = columns['offsets']
+        self.targets = columns['targets']
+        self.dependency = columns['dependency']
+
+    def _symbol(self, column, node):
+        value = column[node]
+        return self._symbols[value] if value != _NONE else None
+
+    def _class(self, name):
+        if name not in self._classes:
+            module, _, cls = name.rpartition('.')
+            self._classes[name] = getattr(importlib.import_module(module), cls)
+        return self._classes[name]
+
+    def is_resource(self, node):
+        return self._rtype[node] != _NONE
+
+    def rtype(self, node):
+        return self._symbol(self._rtype, node)
+
+    def used(self, node):
+        return bool(self._used[node])
+
+    def set_used(self, node, used=True):
+        # the mapped column is read-only, usage is marked on a copy of it (a byte per node)
+        if not isinstance(self._used, bytearray):
+            self._used = bytearray(self._used)
+        self._used[node] = 1 if used else 0
+
+    def region(self, node):
+        return self._symbol(self._region, node)
+
+    def used_urids(self):
+        return [self.urids[node] for node in range(len(self)) if self._used[node] and self._rtype[node] != _NONE]
+
+    def resource(self, node):
+        """
+        :return: the resource of node, materialized from the columns, or None if node has no resource
+        """
+        if self._rtype[node] == _NONE:
+            return None
+        cls = self._class(self._symbol(self._cls, node))
+        urid = self.urids[node]
+        rid = urid.split('://', 1)[1].split('/', 1)[1]
+        created = self._created[node]
+        state = {'rtype': self._symbol(self._rtype, node), 'provider': self._symbol(self._provider, node),
+                 'rid': rid, 'created': datetime.utcfromtimestamp(created) if created == created else None,
+                 '_used': bool(self._used[node]),
+                 'cleanup_candidate': bool(self.cleanup_candidate[node]), '_urid': urid}
+        region, account = self._symbol(self._region, node), self._symbol(self._account, node)
+        if region is not None:
+            prefix = '%s/%s/' % (account, region) if account else '%s/' % region
+            state.update(region=region, account=account, resource_id=rid[len(prefix):])
+        resource = cls.__new__(cls)
+        resource.__setstate__(state)
+        return resource
+
+    def close(self):
+        """
+        Unmap the snapshot (the graph can't be used afterwards, resources materialized from it can)
+        """
+        if hasattr(self._view, 'release'):
+            for column in self._columns:
+                column.release()
+            self._view.release()
+        self._mmap.close()
+
+
+def load_graph(filename=None):
+    """
+    :return: a SnapshotGraph of the stored snapshot (an iterable of resources and relations), or an empty
+      graph if there is no snapshot
+    """
+    filename = filename or _graph_file()
+    try:
+        graph = SnapshotGraph(filename)
+        logging.info('mapped graph snapshot %s', filename)
+        return graph
+    except (IOError, OSError, ValueError):
+        logging.exception('unable to load graph from file')
+        return []
@@ -0,0 +1,171 @@
+"""
+    SQLite storage- store garbo resources and relations in an indexed SQLite database
+
+    Besides dumping and loading whole graphs, GraphIndex answers point queries (neighbors, filtered
+      resource scans) directly from the database, without loading the graph into memory.
+"""
+
+import logging
+import os
+import pickle
+import sqlite3
+
+from garbo import config
+from garbo.model import AbstractResource, Relation
+
+__author__ = 'nati'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    urid TEXT PRIMARY KEY,
+    provider TEXT,
+    rtype TEXT,
+    region TEXT,
+    rid TEXT,
+    created TEXT,
+    used INTEGER,
+    cleanup_candidate INTEGER,
+    data BLOB
+);
+CREATE TABLE IF NOT EXISTS relations (
+    source TEXT,
+    target TEXT,
+    dependency INTEGER
+);
+CREATE INDEX IF NOT EXISTS resources_rtype ON resources (rtype);
+CREATE INDEX IF NOT EXISTS resources_region ON resources (region);
+CREATE INDEX IF NOT EXISTS relations_source ON relations (source);
+CREATE INDEX IF NOT EXISTS relations_target ON relations (target);
+"""
+
+_BATCH_SIZE = 10000
+
+
+def _graph_file():
+    return os.path.join(config.sqlite_storage.working_dir, config.sqlite_storage.db_filename)
+
+
+def _connect(filename=None):
+    conn = sqlite3.connect(filename or _graph_file())
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _resource_row(resource):
+    return (resource.urid(), resource.provider, resource.rtype, getattr(resource, 'region', None), resource.rid,
+            resource.created.isoformat() if resource.created else None,
+            1 if resource.used else 0, 1 if resource.cleanup_candidate else 0,
+            sqlite3.Binary(pickle.dumps(resource, 2)))
+
+
+def _batches(graph):
+    """
+    Split a graph to batches of resource rows and relation rows
+    """
+    resources, relations = [], []
+    for item in graph:
+        if isinstance(item, AbstractResource):
+            resources.append(_resource_row(item))
+        elif isinstance(item, Relation):
+            relations.append((item.source, item.target, 1 if item.dependency else 0))
+        if len(resources) + len(relations) >= _BATCH_SIZE:
+            yield resources, relations
+            resources, relations = [], []
+    yield resources, relations
+
+
+def dump_graph(graph, raise_errors=False):
+    """
+    :param raise_errors: raise storage errors (eg. to fail a pipeline, see garbo.pipeline), instead of logging them
+    """
+    try:
+        conn = _connect()
+        with conn:
+            conn.execute('DELETE FROM resources')
+            conn.execute('DELETE FROM relations')
+            for resources, relations in _batches(graph):
+                conn.executemany('INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', resources)
+                conn.executemany('INSERT INTO relations VALUES (?, ?, ?)', relations)
+        conn.close()
+        logging.info('exported graph to SQLite database %s', _graph_file())
+    except Exception:
+        logging.exception('unable to dump graph to file')
+        if raise_errors:
+            raise
+
+
+def load_graph():
+    """
+    Lazily yield all the resources and relations stored in the database
+    """
+    index = GraphIndex()
+    try:
+        for resource in index.resources():
+            yield resource
+        for relation in index.relations():
+            yield relation
+        logging.info('loaded graph from SQLite database %s', _graph_file())
+    finally:
+        index.close()
+
+
+class GraphIndex(object):
+    """
+    Query API over a stored graph
+    """
+
+    def __init__(self, filename=None):
+        self._conn = _connect(filename)
+
+    def close(self):
+        self._conn.close()
+
+    def resource(self, urid):
+        """
+        :return: the resource with the given urid, or None if it doesn't exist
+        """
+        row = self._conn.execute('SELECT data FROM resources WHERE urid = ?', (urid,)).fetchone()
+        return pickle.loads(bytes(row[0])) if row else None
+
+    def resources(self, rtype=None, region=None, cleanup_candidate=None):
+        """
+        Yield resources, optionally filtered by type, region and cleanup candidacy
+        """
+        conditions, params = [], []
+        for column, value in (('rtype', rtype), ('region', region), ('cleanup_candidate', cleanup_candidate)):
+            if value is not None:
+                conditions.append('%s = ?' % column)
+                params.append(int(value) if isinstance(value, bool) else value)
+        query = 'SELECT data FROM resources'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        for row in self._conn.execute(query, params):
+            yield pickle.loads(bytes(row[0]))
+
+    def relations(self, dependency=None):
+        """
+        Yield relations, optionally only dependency (or non-dependency) relations
+        """
+        query, params = 'SELECT source, target, dependency FROM relations', ()
+        if dependency is not None:
+            query, params = query + ' WHERE dependency = ?', (int(dependency),)
+        for source, target, is_dependency in self._conn.execute(query, params):
+            yield Relation(source, target, dependency=bool(is_dependency))
+
+    def _adjacent(self, column, other, urid, dependency):
+        query, params = 'SELECT %s FROM relations WHERE %s = ?' % (other, column), (urid,)
+        if dependency is not None:
+            query, params = query + ' AND dependency = ?', params + (int(dependency),)
+        return {row[0] for row in self._conn.execute(query, params)}
+
+    def neighbors(self, urid, dependency=None):
+        """
+        :return: set of urids related from the given urid (eg. what an instance depends on)
+        """
+        return self._adjacent('source', 'target', urid, dependency)
+
+    def reverse_neighbors(self, urid, dependency=None):
+        """
+        :return: set of urids related to the given urid (eg. what depends on a security group)
+        """
+        return self._adjacent('target', 'source', urid, dependency)
@@ -0,0 +1,110 @@
+"""
+    Stream storage- append garbo resources and relations to a log file while they are being discovered
+
+    Each item is stored as a length-prefixed pickle record, and a complete log ends with an empty record. The
+      log is written aside and renamed into place once complete, so a crashed discovery leaves the previous log
+      in place. A log without its end (eg. copied while written) is still read up to its last complete record,
+      but is recorded as a failure (see garbo.metrics.discovery_failures), so it isn't cleaned up.
+"""
+
+import gzip
+import logging
+import os
+import pickle
+import struct
+
+from garbo import config, metrics
+from garbo.utils import atomic_file
+
+__author__ = 'nati'
+
+_LENGTH = struct.Struct('>I')
+# flush the log every so many records, so a crashed discovery keeps most of its items
+_FLUSH_INTERVAL = 1000
+
+
+def _graph_file():
+    return os.path.join(config.stream_storage.working_dir, config.stream_storage.graph_filename)
+
+
+def _compress():
+    return str(config.stream_storage.compress).lower() in ('1', 'true', 'yes', 'on')
+
+
+def _open(filename, mode):
+    return gzip.open(filename, mode) if _compress() else open(filename, mode)
+
+
+def record(graph):
+    """
+    Yield the items of a graph, while appending them to the graph log (replacing the stored one once the graph
+      is exhausted)
+
+    :param graph: iterable of resources and relations (eg. a running discovery)
+    """
+    count = 0
+    with atomic_file(_graph_file()) as temporary:
+        with _open(temporary, 'wb') as graph_file:
+            for item in graph:
+                data = pickle.dumps(item, 2)
+                graph_file.write(_LENGTH.pack(len(data)))
+                graph_file.write(data)
+                count += 1
+                if count % _FLUSH_INTERVAL == 0:
+                    graph_file.flush()
+                yield item
+            # end of log
+            graph_file.write(_LENGTH.pack(0))
+    logging.info('streamed %d items to graph log %s', count, _graph_file())
+
+
+def dump_graph(graph, raise_errors=False):
+    """
+    :param raise_errors: raise storage errors (eg. to fail a pipeline, see garbo.pipeline), instead of logging them
+    """
+    try:
+        for _ in record(graph):
+            pass
+    except Exception:
+        logging.exception('unable to dump graph to file')
+        if raise_errors:
+            raise
+
+
+def _read_records(graph_file):
+    """
+    Yield the raw records of a graph log, stopping at a truncated record
+    """
+    while True:
+        header = graph_file.read(_LENGTH.size)
+        if not header:
+            return
+        data = b''
+        if len(header) == _LENGTH.size:
+            length, = _LENGTH.unpack(header)
+            data = graph_file.read(length)
+        if len(header) < _LENGTH.size or len(data) < length:
+            raise EOFError('truncated record')
+        yield data
+
+
+def load_graph():
+    """
+    Lazily yield the resources and relations stored in the graph log
+    """
+    count = 0
+    try:
+        with _open(_graph_file(), 'rb') as graph_file:
+            for data in _read_records(graph_file):
+                if not data:
+                    logging.info('loaded %d items from graph log %s', count, _graph_file())
+                    return
+                count += 1
+                yield pickle.loads(data)
+        logging.warn('graph log %s has no end, loaded only its first %d items', _graph_file(), count)
+    except EOFError:
+        logging.warn('graph log %s is truncated, loaded only its first %d items', _graph_file(), count)
+    except IOError:
+        logging.exception('unable to load graph from file')
+        return
+    metrics.count_failure('graph log %s' % _graph_file())
@@ -0,0 +1,133 @@
+"""
+    Synthetic AWS accounts- seeded, reproducible garbo graphs for benchmarks and offline discovery
+"""
+
+import random
+
+from garbo.model import Relation
+from garbo.model.aws import EBSSnapshot, EBSVolume, Image, Instance, LoadBalancer, SecurityGroup, ElasticIP, \
+    KeyPair, AutoScalingGroup, LaunchConfiguration, CacheCluster
+
+__author__ = 'nati'
+
+DEFAULT_REGIONS = ('us-east-1', 'eu-west-1')
+
+# share of each resource type in an account, roughly following real accounts (snapshots pile up)
+TYPE_WEIGHTS = (
+    (EBSSnapshot, 30),
+    (EBSVolume, 20),
+    (Instance, 18),
+    (SecurityGroup, 8),
+    (Image, 8),
+    (LaunchConfiguration, 4),
+    (ElasticIP, 3),
+    (AutoScalingGroup, 3),
+    (LoadBalancer, 3),
+    (CacheCluster, 2),
+    (KeyPair, 1),
+)
+
+_ID_PREFIXES = {
+    EBSSnapshot: 'snap-', EBSVolume: 'vol-', Instance: 'i-', SecurityGroup: 'sg-', Image: 'ami-',
+    LaunchConfiguration: 'lc-', ElasticIP: '10.0.', AutoScalingGroup: 'asg-', LoadBalancer: 'elb-',
+    CacheCluster: 'cc-', KeyPair: 'key-',
+}
+
+
+class SyntheticAccount(object):
+    """
+    A seeded synthetic AWS account
+
+    Relations follow the shapes emitted by the AWS collectors (eg. ASG -> Instance -> SecurityGroup)
+
+    :ivar resources: dict of resource class -> list of (region, resource_id)
+    :ivar relations: list of (source class, source (region, resource_id), target class, target, dependency)
+    """
+
+    def __init__(self, size, seed=0, regions=DEFAULT_REGIONS):
+        """
+        :param size: approximate number of resources
+        :param seed: random seed, the same seed and size always generate the same account
+        :param regions: regions to spread the resources over
+        """
+        self.random = random.Random(seed)
+        self.regions = list(regions)
+        total_weight = sum(w for _, w in TYPE_WEIGHTS)
+        self.resources = {}
+        for cls, weight in TYPE_WEIGHTS:
+            count = max(len(self.regions), size * weight // total_weight)
+            self.resources[cls] = [(self.regions[n % len(self.regions)], '%s%08x' % (_ID_PREFIXES[cls], n))
+                                   for n in range(count)]
+        self._by_region = {cls: {region: [r for r in keys if r[0] == region] for region in self.regions}
+                           for cls, keys in self.resources.items()}
+        self.relations = []
+        self._relate()
+
+    def _pick(self, cls, region, count=1):
+        candidates = self._by_region[cls][region]
+        return [self.random.choice(candidates) for _ in range(count)]
+
+    def _link(self, source_cls, source, target_cls, probability=1.0, count=(1, 1), dependency=True):
+        if self.random.random() >= probability:
+            return
+        for target in set(self._pick(target_cls, source[0], self.random.randint(*count))):
+            self.relations.append((source_cls, source, target_cls, target, dependency))
+
+    def _relate(self):
+        link = self._link
+        for snapshot in self.resources[EBSSnapshot]:
+            link(EBSSnapshot, snapshot, EBSVolume, probability=0.7, dependency=False)
+        for lb in self.resources[LoadBalancer]:
+            link(LoadBalancer, lb, SecurityGroup, count=(1, 2))
+            link(LoadBalancer, lb, Instance, count=(0, 3))
+        for group in self.resources[SecurityGroup]:
+            link(SecurityGroup, group, SecurityGroup, probability=0.1)
+        for lc in self.resources[LaunchConfiguration]:
+            link(LaunchConfiguration, lc, KeyPair)
+            link(LaunchConfiguration, lc, Image, probability=0.8)
+            link(LaunchConfiguration, lc, SecurityGroup, count=(1, 2))
+        for asg in self.resources[AutoScalingGroup]:
+            link(AutoScalingGroup, asg, Instance, count=(1, 4))
+            link(AutoScalingGroup, asg, LaunchConfiguration)
+        for lb in self.resources[LoadBalancer]:
+            link(LoadBalancer, lb, AutoScalingGroup, probability=0.5)
+        for address in self.resources[ElasticIP]:
+            if self.random.random() < 0.6:
+                instance, = self._pick(Instance, address[0])
+                self.relations.append((Instance, instance, ElasticIP, address, True))
+        for image in self.resources[Image]:
+            link(Image, image, EBSSnapshot, count=(1, 2))
+        for instance in self.resources[Instance]:
+            link(Instance, instance, KeyPair)
+            link(Instance, instance, Image, probability=0.7, dependency=False)
+            link(Instance, instance, SecurityGroup, count=(1, 2))
+        for volume in self.resources[EBSVolume]:
+            if self.random.random() < 0.7:
+                instance, = self._pick(Instance, volume[0])
+                self.relations.append((Instance, instance, EBSVolume, volume, True))
+            link(EBSVolume, volume, EBSSnapshot, probability=0.5, dependency=False)
+        for cluster in self.resources[CacheCluster]:
+            link(CacheCluster, cluster, SecurityGroup)
+
+    def __len__(self):
+        return sum(len(keys) for keys in self.resources.values())
+
+    def graph(self):
+        """
+        Yield the resources and relations of the account, like a discovery would
+        """
+        for cls, keys in self.resources.items():
+            for region, resource_id in keys:
+                yield cls(region=region, resource_id=resource_id)
+        for source_cls, source, target_cls, target, dependency in self.relations:
+            yield Relation(source_cls.make_urid(*source), target_cls.make_urid(*target), dependency=dependency)
+
+    def applications(self, count=10):
+        """
+        :return: dict of application name -> core resource urids (auto scaling groups and stand-alone instances)
+        """
+        groups = self.resources[AutoScalingGroup]
+        instances = self.resources[Instance]
+        return {'app-%d' % n: [AutoScalingGroup.make_urid(*r) for r in groups[n::count]] +
+                              [Instance.make_urid(*r) for r in instances[n::count * 10]]
+                for n in range(count)}
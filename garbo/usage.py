@@ -0,0 +1,220 @@
+"""
+    Batched usage probes- dynamic usage checks for AbstractResource.used
+
+    Resources declare a usage_probe. Pending checks are grouped by (probe, region, account), evaluated with a few
+      bulk API calls running concurrently, and cached with a TTL so repeated sweeps reuse recent answers.
+"""
+
+from abc import ABCMeta, abstractmethod
+from collections import defaultdict
+from datetime import datetime, timedelta
+import logging
+import os
+import pickle
+import time
+
+from garbo import config
+from garbo.graph import CompactGraph
+from garbo.utils import aws_connection
+
+__author__ = 'nati'
+
+
+def _tag(element):
+    # XML tag without its namespace
+    return element.tag.rsplit('}', 1)[-1]
+
+
+class UsageProbe(object):
+    """
+    Base class of usage probes, checking the usage of many resources of a single region at once
+    """
+
+    __metaclass__ = ABCMeta
+
+    # maximal number of resources per probe call
+    batch_size = 100
+
+    @abstractmethod
+    def probe(self, region, resources):
+        """
+        :param region: region of all the resources
+        :param resources: list of up to batch_size resources to check, all of the same account
+        :return: dict of urid -> True if the resource is being used, False otherwise
+        """
+        pass
+
+
+class CloudWatchActivityProbe(UsageProbe):
+    """
+    A resource is used if a CloudWatch metric of it was above a threshold during the last days
+
+    Uses GetMetricData, checking up to 500 resources per API call
+    """
+
+    batch_size = 500
+
+    def __init__(self, namespace, metric, dimension, statistic='Sum', threshold=0):
+        self.namespace = namespace
+        self.metric = metric
+        self.dimension = dimension
+        self.statistic = statistic
+        self.threshold = threshold
+
+    def _params(self, resources):
+        days = int(config.usage.period_days)
+        now = datetime.utcnow()
+        params = {'StartTime': (now - timedelta(days=days)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                  'EndTime': now.strftime('%Y-%m-%dT%H:%M:%SZ')}
+        for n, resource in enumerate(resources, 1):
+            prefix = 'MetricDataQueries.member.%d.' % n
+            params.update({prefix + 'Id': 'r%d' % n,
+                           prefix + 'ReturnData': 'true',
+                           prefix + 'MetricStat.Metric.Namespace': self.namespace,
+                           prefix + 'MetricStat.Metric.MetricName': self.metric,
+                           prefix + 'MetricStat.Metric.Dimensions.member.1.Name': self.dimension,
+                           prefix + 'MetricStat.Metric.Dimensions.member.1.Value': resource.resource_id,
+                           prefix + 'MetricStat.Period': str(days * 24 * 3600),
+                           prefix + 'MetricStat.Stat': self.statistic})
+        return params
+
+    @staticmethod
+    def _get_metric_data(conn, params):
+        from xml.etree import ElementTree
+
+        response = conn.make_request('GetMetricData', params, verb='POST')
+        body = response.read()
+        if response.status != 200:
+            raise conn.ResponseError(response.status, response.reason, body)
+        return ElementTree.fromstring(body)
+
+    def _read_page(self, root, used):
+        """
+        Read a GetMetricData response page into used
+
+        :param root: response XML root element
+        :param used: dict of query ID -> True if the resource is being used, updated by the page values (the
+          values of a query might span several pages)
+        :return: the next page token, None if it is the last page
+        """
+        next_token = None
+        for element in root.iter():
+            if _tag(element) == 'NextToken':
+                next_token = element.text
+            elif _tag(element) == 'member':
+                children = {_tag(c): c for c in element}
+                if 'Id' in children and 'Values' in children:
+                    values = [float(v.text) for v in children['Values']]
+                    used[children['Id'].text] = used[children['Id'].text] or any(v > self.threshold for v in values)
+        return next_token
+
+    def probe(self, region, resources):
+        from garbo.discovery.aws.scheduler import scheduler
+
+        conn = aws_connection('boto.ec2.cloudwatch', region, resources[0].account)
+        params = self._params(resources)
+        used = {'r%d' % n: False for n in range(1, len(resources) + 1)}
+        while True:
+            root = scheduler().call('boto.ec2.cloudwatch', region, self._get_metric_data, conn, params)
+            next_token = self._read_page(root, used)
+            if not next_token:
+                break
+            params['NextToken'] = next_token
+        return {r.urid(): used['r%d' % n] for n, r in enumerate(resources, 1)}
+
+
+class UsageCache(object):
+    """
+    TTL cache of usage probe results, persisted between runs
+    """
+
+    def __init__(self, filename, ttl):
+        self.filename = filename
+        self.ttl = ttl
+        self._entries = {}
+        try:
+            with open(filename, 'rb') as cache_file:
+                self._entries = pickle.load(cache_file)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            pass
+
+    def get(self, urid):
+        """
+        :return: the cached usage of urid, or None if it is unknown or expired
+        """
+        entry = self._entries.get(urid)
+        if entry and time.time() - entry[0] < self.ttl:
+            return entry[1]
+        return None
+
+    def set(self, urid, used):
+        self._entries[urid] = (time.time(), used)
+
+    def save(self):
+        now = time.time()
+        self._entries = {k: v for k, v in self._entries.items() if now - v[0] < self.ttl}
+        try:
+            with open(self.filename, 'wb') as cache_file:
+                pickle.dump(self._entries, cache_file, 2)
+        except IOError:
+            logging.exception('unable to save usage cache')
+
+
+def _cache():
+    return UsageCache(os.path.join(config.usage.working_dir, config.usage.cache_filename), float(config.usage.ttl))
+
+
+def evaluate(graph, cache=None):
+    """
+    Evaluate the usage probes of all the resources in the graph, marking used resources as used
+
+    :param graph: iterable of resources and relations, or a CompactGraph (marked through CompactGraph.set_used)
+    :param cache: UsageCache (default: configured by config.usage)
+    :return: number of resources found in use
+    """
+    cache = cache or _cache()
+    resources = [i for i in graph if getattr(i, 'usage_probe', None) is not None]
+    pending = defaultdict(list)
+    results = {}
+    for resource in resources:
+        cached = cache.get(resource.urid())
+        if cached is None:
+            pending[(resource.usage_probe, resource.region, getattr(resource, 'account', None))].append(resource)
+        else:
+            results[resource.urid()] = cached
+
+    batches = [(probe, region, group[i:i + probe.batch_size])
+               for (probe, region, _), group in pending.items()
+               for i in range(0, len(group), probe.batch_size)]
+    logging.info('evaluating usage of %d resources (%d cached) in %d batches',
+                 len(resources), len(results), len(batches))
+
+    def run(batch):
+        probe, region, group = batch
+        try:
+            return probe.probe(region, group)
+        except Exception:
+            logging.exception('unable to probe usage of %d resources in %s', len(group), region)
+            return {}
+
+    if batches:
+        # imported here, loading resources (and their usage probes) shouldn't import multiprocessing
+        from multiprocessing.pool import ThreadPool
+
+        pool = ThreadPool(min(int(config.usage.workers), len(batches)))
+        try:
+            for probed in pool.imap_unordered(run, batches):
+                for urid, used in probed.items():
+                    cache.set(urid, used)
+                    results[urid] = used
+        finally:
+            pool.close()
+        cache.save()
+
+    for resource in resources:
+        if results.get(resource.urid()):
+            resource.used = True
+            if isinstance(graph, CompactGraph):
+                # the resources of some graphs are materialized copies (eg. of a SnapshotGraph)
+                graph.set_used(graph.node(resource.urid()))
+    return sum(1 for used in results.values() if used)
@@ -1,38 +1,113 @@
-from collections import defaultdict
+from array import array
+from contextlib import contextmanager
+import importlib
 import logging
+import os
 
-from garbo.model import AbstractResource, Relation
+from garbo.graph import CompactGraph, reachability
+from garbo.model import Relation
 
 __author__ = 'nati'
 
+# pseudo application owning the resources being used, see sweep_applications
+USED_APPLICATION = '(in use)'
+
+
+def aws_connection(service, region, account=None):
+    """
+    Pooled (and scheduled) AWS connection with the credentials of an account, eg. to probe or delete its resources
+
+    boto is imported on the first call, so resource definitions (with their usage probes and deleters) don't
+      require it
+
+    :param service: boto service module name, with a connect_to_region function (eg. boto.ec2)
+    :param account: account ID qualifying the resources, None for a single account discovery
+    """
+    from garbo.discovery.aws.accounts import account_credentials
+    from garbo.discovery.aws.connections import get_connection
+
+    connect = importlib.import_module(service).connect_to_region
+    return get_connection(connect, region, *account_credentials(account))
+
+
+def replace_file(temporary, filename):
+    """
+    Rename a fully written temporary file into place, replacing filename (Windows can't rename over a file)
+    """
+    if os.name == 'nt' and os.path.exists(filename):
+        os.remove(filename)
+    os.rename(temporary, filename)
+
+
+@contextmanager
+def atomic_file(filename):
+    """
+    Write a file aside and rename it into place once written, so readers never see a partially written file
+
+    :return: context yielding the temporary filename to write, removed if the writing fails
+    """
+    temporary = filename + '.tmp'
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    try:
+        yield temporary
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    replace_file(temporary, filename)
+
+
+def _unused_graph(graph, used):
+    """
+    Generate a subset of the graph containing only unused cleanup candidates, and the relations between them
+
+    :type graph: CompactGraph
+    :param used: per node truth values
+    """
+    unused = bytearray(1 if c and not u else 0 for c, u in zip(graph.cleanup_candidate, used))
+    unused_graph = [graph.resources[node] for node in range(len(graph)) if unused[node]]
+    logging.info('found the following unused resources: %s', {str(r) for r in unused_graph})
+    unused_graph += [Relation(graph.urids[source], graph.urids[graph.targets[edge]],
+                              dependency=bool(graph.dependency[edge]))
+                     for source in range(len(graph)) if unused[source]
+                     for edge in graph.edges(source) if unused[graph.targets[edge]]]
+    return unused_graph
+
 
 def mark_and_sweep(graph, root_resources):
     """
     Go over a directed graph of resources, starting from given set of roots, and yield non-connected resources
-    :param graph:
+    :param graph: iterable of resources and relations (iterated once), or a CompactGraph
     :param root_resources:
     :return:
     """
-    resources = {i.urid(): i for i in graph if isinstance(i, AbstractResource)}
-    relations = defaultdict(set)
-    for r in (i for i in graph if isinstance(i, Relation) and i.dependency):
-        relations[r.source].add(r.target)
-    used_resources = set()
-    new_used_resources = {r for r in root_resources if r in resources}  # TODO: add newly created resources as roots
-
-    while new_used_resources:
-        used_resources |= new_used_resources
-        expanded_resources = {target for urid in new_used_resources
-                              for target in relations.get(urid, [])
-                              if target in resources}
-        new_used_resources = expanded_resources - used_resources
-
-    # Generate a subset of the original graph containing only unused resources
-    unused_resource_urids = set([r for r in resources if resources[r].cleanup_candidate]) - used_resources
-    logging.info('found the following unused resources: %s', unused_resource_urids)
-    unused_graph = [i for i in graph if (isinstance(i, AbstractResource) and i.urid() in unused_resource_urids) or
-                    (isinstance(i, Relation) and
-                     i.source in unused_resource_urids and
-                     i.target in unused_resource_urids)]
-
+    # TODO: add newly created resources as roots
+    unused_graph, _ = sweep_applications(graph, {'': root_resources})
     return unused_graph
+
+
+def sweep_applications(graph, applications, used_as_roots=False, retention=False):
+    """
+    Mark the resources used by each application (in a single traversal), and sweep the unused ones
+
+    :param graph: iterable of resources and relations (iterated once), or a CompactGraph
+    :param applications: dict of application name -> list of root urids
+    :param used_as_roots: also keep resources being used (and their dependencies), owned by USED_APPLICATION
+    :param retention: record why every used resource is kept, in the retention index (see garbo.storage.retention)
+    :return: (unused graph, dict of used urid -> set of the applications using it)
+    """
+    graph = graph if isinstance(graph, CompactGraph) else CompactGraph(graph)
+    if used_as_roots:
+        applications = dict(applications)
+        applications[USED_APPLICATION] = graph.used_urids()
+    parents = array('i', [-1]) * len(graph) if retention else None
+    names, masks = reachability(graph, applications, parents)
+    if retention:
+        from garbo.storage.retention import dump_retention
+        dump_retention(graph, applications, names, masks, parents)
+    ownership = {graph.urids[node]: {name for bit, name in enumerate(names) if mask >> bit & 1}
+                 for node, mask in enumerate(masks) if mask}
+    shared = sum(1 for apps in ownership.values() if len(apps) > 1)
+    logging.info('%d resources are used by applications, %d of them are shared', len(ownership), shared)
+    return _unused_graph(graph, masks), ownership
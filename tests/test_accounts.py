@@ -0,0 +1,141 @@
+import shutil
+import tempfile
+import unittest
+
+from garbo import config, metrics
+from garbo.model import AbstractResource
+from garbo.synthetic import SyntheticAccount
+
+try:
+    import boto
+    import yaml
+except ImportError:
+    boto = yaml = None
+
+__author__ = 'nati'
+
+REGION = 'us-east-1'
+OWNER, USER, BROKEN = '111111111111', '222222222222', '333333333333'
+
+
+class AccountsAWS(object):
+    """
+    Fake AWS backends of several accounts, by the access key of the account
+    """
+
+    def __init__(self, backends):
+        self.backends = backends
+
+    def connect(self, connect, region, **credentials):
+        return self.backends[credentials['aws_access_key_id']].connect(connect, region, **credentials)
+
+    def __enter__(self):
+        from garbo.discovery.aws import connections
+
+        connections.set_backend(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        from garbo.discovery.aws import connections
+
+        connections.set_backend(None)
+
+
+@unittest.skipIf(boto is None or yaml is None, 'the multi-account discovery requires boto and yaml')
+class CollectAccountsTest(unittest.TestCase):
+    """
+    Discover synthetic accounts through fake AWS backends: the user account runs an image shared by the owner
+      account, in a security group peered with the owner's, and the broken account fails its discovery
+    """
+
+    def setUp(self):
+        from garbo.discovery.aws import Account, scheduler
+        from garbo.discovery.aws.fake import FakeAWS, _Item
+        from garbo.model.aws import Image, SecurityGroup
+
+        self.directory = tempfile.mkdtemp()
+        self._regions, config.aws.regions = config.aws.regions, [REGION]
+        self._scheduler = scheduler._scheduler
+        scheduler._scheduler = scheduler.Scheduler(rate=1000, concurrency=8, max_concurrency=8, max_retries=8)
+        metrics.reset()
+
+        self.synthetic = {account_id: SyntheticAccount(100, seed=n, regions=[REGION])
+                          for n, account_id in enumerate((OWNER, USER, BROKEN))}
+        self.image = self.synthetic[OWNER].resources[Image][0][1]
+        self.group = self.synthetic[OWNER].resources[SecurityGroup][0][1]
+        image = self.image
+
+        class SharingAWS(FakeAWS):
+            def respond(self, region, action, params):
+                if action == 'DescribeImages' and params.get('ExecutableBy'):
+                    return [_Item(id=image, owner_id=OWNER)] if params.get('Owner') == [OWNER] else []
+                return super(SharingAWS, self).respond(region, action, params)
+
+        class BrokenAWS(FakeAWS):
+            def respond(self, region, action, params):
+                if action == 'DescribeKeyPairs':
+                    raise RuntimeError('unexpected response')
+                return super(BrokenAWS, self).respond(region, action, params)
+
+        self.backends = {OWNER: FakeAWS(self.synthetic[OWNER]), USER: SharingAWS(self.synthetic[USER]),
+                         BROKEN: BrokenAWS(self.synthetic[BROKEN])}
+        self.accounts = [Account(account_id, access_key=account_id, secret_key='fake')
+                         for account_id in (OWNER, USER, BROKEN)]
+
+    def tearDown(self):
+        from garbo.discovery.aws import scheduler
+
+        scheduler._scheduler = self._scheduler
+        config.aws.regions = self._regions
+        metrics.reset()
+        shutil.rmtree(self.directory)
+
+    def collect(self, accounts):
+        from garbo.discovery.aws import collect_accounts
+        from garbo.storage.shards import ShardStore
+
+        with AccountsAWS(self.backends):
+            return list(collect_accounts(accounts, ShardStore(self.directory), processes=2))
+
+    def test_urids_are_qualified_by_account(self):
+        discovered = self.collect(self.accounts[:2])
+        resources = {item.urid() for item in discovered if isinstance(item, AbstractResource)}
+        expected = {type(item).make_urid(item.region, item.resource_id, account_id)
+                    for account_id in (OWNER, USER) for item in self.synthetic[account_id].graph()
+                    if isinstance(item, AbstractResource)}
+        self.assertEqual(resources, expected)
+        self.assertEqual({item.account for item in discovered if isinstance(item, AbstractResource)}, {OWNER, USER})
+
+    def test_cross_account_edges(self):
+        from garbo.discovery.aws.fake import _Item
+        from garbo.model.aws import Image, Instance, SecurityGroup
+
+        # (the synthetic accounts have the same resource IDs, so the user account doesn't own the shared image)
+        data = self.backends[USER]._regions[REGION]
+        data.images = [i for i in data.images if i.id != self.image]
+        instance = data.reservations[0].instances[0]
+        instance.image_id = self.image
+        peer = data.security_groups[0]
+        peer.rules[0].grants.append(_Item(group_id=self.group, owner_id=OWNER))
+
+        discovered = self.collect(self.accounts[:2])
+        relations = {(item.source, item.target) for item in discovered if not isinstance(item, AbstractResource)}
+        resources = {item.urid() for item in discovered if isinstance(item, AbstractResource)}
+        # the shared image and the peered group resolve to the resources of the owner account
+        shared = (Instance.make_urid(REGION, instance.id, USER), Image.make_urid(REGION, self.image, OWNER))
+        peered = (SecurityGroup.make_urid(REGION, peer.id, USER),
+                  SecurityGroup.make_urid(REGION, self.group, OWNER))
+        for source, target in (shared, peered):
+            self.assertIn((source, target), relations)
+            self.assertIn(target, resources)
+
+    def test_failed_account_is_skipped(self):
+        discovered = self.collect(self.accounts)
+        self.assertEqual({item.account for item in discovered if isinstance(item, AbstractResource)}, {OWNER, USER})
+        self.assertFalse([item for item in discovered if not isinstance(item, AbstractResource) and
+                          BROKEN in (item.source + item.target)])
+        self.assertEqual(metrics.discovery_failures(), ['account %s' % BROKEN])
+
+
+if __name__ == '__main__':
+    unittest.main()
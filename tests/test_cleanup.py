@@ -0,0 +1,257 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from garbo import cleanup, utils
+from garbo.graph import CompactGraph
+from garbo.model import Relation
+from garbo.model.aws import AWSBaseResource
+
+__author__ = 'nati'
+
+
+class RecordingDeleter(cleanup.Deleter):
+    """
+    Record the deleted batches, failing the deletion of some urids
+    """
+
+    def __init__(self, deleted, batch_size=1, members=(), fail=()):
+        self.deleted = deleted
+        self.batch_size = batch_size
+        self.members = members
+        self.fail = set(fail)
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def delete(self, region, resources):
+        urids = [r.urid() for r in resources]
+        if self.fail.intersection(urids):
+            raise Exception('unable to delete %s' % urids)
+        with self._lock:
+            self.batches.append(urids)
+            self.deleted.extend(urids)
+
+
+def resource_types(deleted, fail=()):
+    """
+    :return: dict of resource type name -> AWSBaseResource class, deleted by RecordingDeleters
+    """
+    def resource_type(name, **kwargs):
+        return type(name, (AWSBaseResource,), {'__slots__': (),
+                                               'deleter': RecordingDeleter(deleted, fail=fail, **kwargs)})
+
+    return {'Instance': resource_type('Instance', batch_size=10),
+            'AutoScalingGroup': resource_type('AutoScalingGroup', members=('Instance',)),
+            'SecurityGroup': resource_type('SecurityGroup'),
+            'Image': resource_type('Image'),
+            'EBSSnapshot': resource_type('EBSSnapshot')}
+
+
+class CleanupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.deleted = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def log(self):
+        return cleanup.CleanupLog(os.path.join(self.directory, 'cleanup.log'))
+
+    def graph(self, fail=()):
+        """
+        snapshot <- image <- instances -> security group, and an auto scaling group of two of the instances
+        """
+        types = resource_types(self.deleted, fail)
+        snapshot = types['EBSSnapshot']('r', 'snap-1')
+        image = types['Image']('r', 'ami-1')
+        group = types['SecurityGroup']('r', 'sg-1')
+        instances = [types['Instance']('r', 'i-%d' % n) for n in range(3)]
+        asg = types['AutoScalingGroup']('r', 'asg-1')
+        graph = [snapshot, image, group, asg] + instances + [Relation(image, snapshot, dependency=True)]
+        for instance in instances:
+            graph += [Relation(instance, image, dependency=True), Relation(instance, group, dependency=True)]
+        graph += [Relation(asg, instance, dependency=True) for instance in instances[:2]]
+        return graph
+
+    def test_plan_orders_dependents_first(self):
+        graph = self.graph()
+        waves, refused, blocked = cleanup.plan(graph, CompactGraph(graph))
+        self.assertEqual([[r.urid() for r in wave] for wave in waves],
+                         [['AWS://AutoScalingGroup/r/asg-1', 'AWS://Instance/r/i-2'],
+                          ['AWS://Instance/r/i-0', 'AWS://Instance/r/i-1'],
+                          ['AWS://Image/r/ami-1', 'AWS://SecurityGroup/r/sg-1'],
+                          ['AWS://EBSSnapshot/r/snap-1']])
+        self.assertEqual(refused, [])
+        self.assertEqual(blocked, [])
+
+    def test_execute_in_dependency_order(self):
+        graph = self.graph()
+        deleted, failed, blocked = cleanup.execute(graph, workers=4, log=self.log(), graph=CompactGraph(graph))
+        self.assertEqual((len(deleted), failed, blocked), (7, {}, []))
+        position = {urid: n for n, urid in enumerate(self.deleted)}
+        for item in graph:
+            if isinstance(item, Relation):
+                self.assertLess(position[item.source], position[item.target])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'cleanup.log')))
+
+    def test_failure_blocks_dependencies(self):
+        graph = self.graph(fail=['AWS://Image/r/ami-1'])
+        deleted, failed, blocked = cleanup.execute(graph, workers=4, log=self.log(), graph=CompactGraph(graph))
+        self.assertEqual(list(failed), ['AWS://Image/r/ami-1'])
+        self.assertEqual(blocked, ['AWS://EBSSnapshot/r/snap-1'])
+        self.assertNotIn('AWS://EBSSnapshot/r/snap-1', self.deleted)
+        self.assertIn('AWS://SecurityGroup/r/sg-1', deleted)
+
+    def test_cycles_are_blocked(self):
+        types = resource_types(self.deleted)
+        first, second = types['SecurityGroup']('r', 'sg-1'), types['SecurityGroup']('r', 'sg-2')
+        graph = [first, second, Relation(first, second, dependency=True), Relation(second, first, dependency=True)]
+        deleted, failed, blocked = cleanup.execute(graph, log=self.log())
+        self.assertEqual((deleted, failed), ([], {}))
+        self.assertEqual(blocked, ['AWS://SecurityGroup/r/sg-1', 'AWS://SecurityGroup/r/sg-2'])
+
+    def test_group_of_kept_instances_is_refused(self):
+        graph = CompactGraph(self.graph())
+        # i-0 is kept, along with its image, snapshot and security group, but not its auto scaling group
+        unused_graph, _ = utils.sweep_applications(graph, {'app': ['AWS://Instance/r/i-0']})
+        deleted, failed, blocked = cleanup.execute(unused_graph, log=self.log(), graph=graph)
+        self.assertEqual(list(failed), ['AWS://AutoScalingGroup/r/asg-1'])
+        self.assertIsInstance(failed['AWS://AutoScalingGroup/r/asg-1'], cleanup.CleanupRefused)
+        # the other instance of the group waits for it
+        self.assertEqual(blocked, ['AWS://Instance/r/i-1'])
+        self.assertEqual(sorted(deleted), ['AWS://Instance/r/i-2'])
+
+    def test_used_resources_are_refused(self):
+        graph = self.graph()
+        graph[4].used = True
+        # swept without the resources in use as roots
+        unused_graph, _ = utils.sweep_applications(CompactGraph(graph), {})
+        deleted, failed, blocked = cleanup.execute(unused_graph, log=self.log(), graph=CompactGraph(graph))
+        # along with its auto scaling group
+        self.assertEqual(sorted(failed), ['AWS://AutoScalingGroup/r/asg-1', 'AWS://Instance/r/i-0'])
+        self.assertIsInstance(failed['AWS://Instance/r/i-0'], cleanup.CleanupRefused)
+        self.assertEqual(self.deleted, ['AWS://Instance/r/i-2'])
+        # and the resources they depend on are kept
+        self.assertEqual(blocked, ['AWS://EBSSnapshot/r/snap-1', 'AWS://Image/r/ami-1', 'AWS://Instance/r/i-1',
+                                   'AWS://SecurityGroup/r/sg-1'])
+
+    def test_members_are_refused_without_the_graph(self):
+        waves, refused, blocked = cleanup.plan(self.graph())
+        self.assertEqual([r.urid() for r, _ in refused], ['AWS://AutoScalingGroup/r/asg-1'])
+        # the instances of the group wait for it, and their dependencies wait for them
+        self.assertEqual([r.urid() for r in blocked],
+                         ['AWS://EBSSnapshot/r/snap-1', 'AWS://Image/r/ami-1', 'AWS://Instance/r/i-0',
+                          'AWS://Instance/r/i-1', 'AWS://SecurityGroup/r/sg-1'])
+
+    def test_instances_are_batched(self):
+        graph = self.graph()
+        cleanup.execute(graph, log=self.log(), graph=CompactGraph(graph))
+        deleter = graph[4].deleter
+        self.assertEqual(sorted(len(batch) for batch in deleter.batches), [1, 2])
+
+    def test_resume(self):
+        graph = self.graph()
+        log = self.log()
+        log.record(['AWS://AutoScalingGroup/r/asg-1', 'AWS://Instance/r/i-0'])
+        log.close()
+        deleted, failed, blocked = cleanup.execute(graph, log=self.log(), graph=CompactGraph(graph))
+        self.assertEqual((len(deleted), failed, blocked), (7, {}, []))
+        self.assertNotIn('AWS://AutoScalingGroup/r/asg-1', self.deleted)
+        self.assertNotIn('AWS://Instance/r/i-0', self.deleted)
+        self.assertEqual(len(self.deleted), 5)
+
+    def test_dry_run(self):
+        graph = self.graph()
+        deleted, failed, blocked = cleanup.execute(graph, dry_run=True, graph=CompactGraph(graph))
+        self.assertEqual(len(deleted), 7)
+        self.assertEqual(self.deleted, [])
+
+
+class FakeEC2Connection(object):
+
+    def __init__(self, addresses):
+        self.addresses = addresses
+        self.released = []
+        self.terminated = set()
+
+    def get_all_addresses(self, addresses=None):
+        return [a for a in self.addresses if a.public_ip in addresses]
+
+    def release_address(self, public_ip=None, allocation_id=None):
+        self.released.append(allocation_id or public_ip)
+
+    def terminate_instances(self, instance_ids):
+        self.terminated.update(instance_ids)
+
+
+class FakeAutoScaleConnection(object):
+    """
+    Auto scaling groups by name, with their instance IDs, rejecting the deletion of a group with instances
+      unless it is forced (which terminates them)
+    """
+
+    def __init__(self, ec2, groups):
+        self.ec2 = ec2
+        self.groups = groups
+
+    def delete_auto_scaling_group(self, name, force_delete=False):
+        if self.groups[name] and not force_delete:
+            raise Exception('ResourceInUse: you cannot delete an AutoScalingGroup while there are instances')
+        self.ec2.terminate_instances(self.groups.pop(name))
+
+
+class Address(object):
+
+    def __init__(self, public_ip, allocation_id=None):
+        self.public_ip = public_ip
+        self.allocation_id = allocation_id
+
+
+class AWSDeleterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.conn = FakeEC2Connection([Address('1.1.1.1'), Address('2.2.2.2', 'eipalloc-2')])
+        self.services = {'boto.ec2': self.conn}
+        self.connections = []
+        self._aws_connection = cleanup.aws_connection
+
+        def aws_connection(service, region, account=None):
+            self.connections.append((service, region, account))
+            return self.services[service]
+
+        cleanup.aws_connection = aws_connection
+
+    def tearDown(self):
+        cleanup.aws_connection = self._aws_connection
+        shutil.rmtree(self.directory)
+
+    def test_elastic_ips(self):
+        from garbo.model.aws import ElasticIP
+
+        addresses = [ElasticIP('r', '1.1.1.1', account='123'), ElasticIP('r', '2.2.2.2', account='123')]
+        ElasticIP.deleter.delete('r', addresses)
+        # VPC addresses are released by their allocation ID
+        self.assertEqual(self.conn.released, ['1.1.1.1', 'eipalloc-2'])
+        self.assertEqual(self.connections, [('boto.ec2', 'r', '123')])
+
+    def test_auto_scaling_group_of_unused_instances(self):
+        from garbo.model.aws import AutoScalingGroup, Instance
+
+        autoscale = self.services['boto.ec2.autoscale'] = FakeAutoScaleConnection(self.conn, {'asg-1': ['i-0', 'i-1']})
+        asg, instances = AutoScalingGroup('r', 'asg-1'), [Instance('r', 'i-%d' % n) for n in range(2)]
+        graph = [asg] + instances + [Relation(asg, instance, dependency=True) for instance in instances]
+        # the group is deleted before its instances, while it still has them
+        deleted, failed, blocked = cleanup.execute(graph, log=cleanup.CleanupLog(os.path.join(self.directory, 'log')),
+                                                   graph=CompactGraph(graph))
+        self.assertEqual((len(deleted), failed, blocked), (3, {}, []))
+        self.assertEqual(autoscale.groups, {})
+        self.assertEqual(self.conn.terminated, {'i-0', 'i-1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from garbo.graph import CompactGraph
+from garbo.model import Relation
+from garbo.model.aws import Instance, KeyPair, SecurityGroup
+from garbo.storage import d3js
+
+__author__ = 'nati'
+
+
+class D3JSExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'garbo.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def graph(self):
+        """
+        a component of three instances sharing a security group, an instance and its key pair, and lone key pairs
+        """
+        group = SecurityGroup('us-east-1', 'sg-1')
+        instances = [Instance('us-east-1', 'i-%d' % n) for n in range(3)]
+        graph = [group] + instances + [Relation(instance, group, dependency=True) for instance in instances]
+        lone, key = Instance('eu-west-1', 'i-9'), KeyPair('eu-west-1', 'key-9')
+        graph += [lone, key, Relation(lone, key, dependency=True)]
+        graph += [KeyPair('us-east-1', 'key-%d' % n) for n in range(2)]
+        return graph
+
+    def load(self, filename):
+        with open(filename) as json_file:
+            return json.load(json_file)
+
+    def test_export(self):
+        d3js.export_graph(self.graph(), self.filename)
+        exported = self.load(self.filename)
+        self.assertEqual(len(exported['nodes']), 8)
+        self.assertEqual(len(exported['links']), 4)
+        names = [node['name'] for node in exported['nodes']]
+        self.assertIn({'source': names.index('AWS://Instance/us-east-1/i-0'),
+                       'target': names.index('AWS://SecurityGroup/us-east-1/sg-1'), 'value': 1}, exported['links'])
+
+    def test_export_compact(self):
+        # as exported by garbo.py -g, without --d3js-lod
+        d3js.export_graph(CompactGraph(self.graph()), self.filename, lod=None, layout=False)
+        exported = self.load(self.filename)
+        d3js.export_graph(self.graph(), self.filename)
+        self.assertEqual(exported, self.load(self.filename))
+
+    def test_layout(self):
+        fdg = d3js.D3JSForce()
+        for item in self.graph():
+            fdg.add_item(item)
+        fdg.export(self.filename, layout=True)
+        laid_out = self.load(self.filename)
+        self.assertTrue(laid_out['layout'])
+        self.assertTrue(all('x' in node and 'y' in node for node in laid_out['nodes']))
+        # the layout of an export doesn't carry over to the next one
+        fdg.export(self.filename)
+        exported = self.load(self.filename)
+        self.assertFalse(exported['layout'])
+        self.assertEqual(exported['links'], laid_out['links'])
+
+    def test_small_components_are_bucketed(self):
+        d3js.export_graph(self.graph(), self.filename, lod='component')
+        overview = self.load(self.filename)
+        counts = {node['name']: node['count'] for node in overview['nodes']}
+        self.assertEqual(counts, {'AWS://SecurityGroup/us-east-1/sg-1 (+3)': 4,
+                                  'us-east-1 (small components)': 2,
+                                  'eu-west-1 (small components)': 2})
+        self.assertEqual(overview['links'], [])
+        for node in overview['nodes']:
+            detail = self.load(os.path.join(self.directory, node['detail']))
+            self.assertEqual(len(detail['nodes']), node['count'])
+
+    def test_replaced_items_are_exported_once(self):
+        instance = Instance('us-east-1', 'i-1')
+        graph = self.graph() + [Instance('us-east-1', 'i-1', used=True),
+                                Relation(instance, SecurityGroup('us-east-1', 'sg-1'), dependency=True)]
+        d3js.export_graph(graph, self.filename)
+        exported = self.load(self.filename)
+        self.assertEqual((len(exported['nodes']), len(exported['links'])), (8, 4))
+        self.assertEqual(exported['nodes'][2], {'name': 'AWS://Instance/us-east-1/i-1',
+                                                'group': d3js.D3JSForce.group('Instance', True)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import shutil
+import tempfile
+import unittest
+
+from garbo import config
+from garbo.graph import GraphBuilder
+from garbo.model import AbstractResource, Relation
+from garbo.synthetic import SyntheticAccount
+
+try:
+    import boto
+except ImportError:
+    boto = None
+
+__author__ = 'nati'
+
+
+def _graph(items):
+    """
+    :return: (resource urids, relations) of a graph
+    """
+    resources, relations = set(), set()
+    for item in items:
+        if isinstance(item, AbstractResource):
+            resources.add(item.urid())
+        else:
+            relations.add((item.source, item.target, item.dependency))
+    return resources, relations
+
+
+@unittest.skipIf(boto is None, 'the AWS discovery requires boto')
+class CollectAllTest(unittest.TestCase):
+    """
+    Discover a synthetic account through the fake AWS backend
+    """
+
+    def setUp(self):
+        from garbo.discovery.aws import scheduler
+
+        self.account = SyntheticAccount(300, seed=1)
+        self.directory = tempfile.mkdtemp()
+        self._regions, config.aws.regions = config.aws.regions, self.account.regions
+        # a fresh scheduler, fast enough for the throttled fake requests
+        self._scheduler = scheduler._scheduler
+        scheduler._scheduler = scheduler.Scheduler(rate=1000, concurrency=8, max_concurrency=8, max_retries=8)
+
+    def tearDown(self):
+        from garbo.discovery.aws import scheduler
+
+        scheduler._scheduler = self._scheduler
+        config.aws.regions = self._regions
+        shutil.rmtree(self.directory)
+
+    def collect(self, **kwargs):
+        from garbo.discovery.aws import collect_all
+
+        return list(GraphBuilder().feed(collect_all('fake', 'fake', **kwargs)))
+
+    def test_paging_and_throttling(self):
+        from garbo.discovery.aws.fake import FakeAWS
+
+        with FakeAWS(self.account, page_size=7, throttling_rate=0.1, seed=2) as fake:
+            discovered = self.collect()
+        self.assertEqual(_graph(discovered), _graph(self.account.graph()))
+        self.assertGreater(fake.calls['DescribeSnapshots'], 2 * len(self.account.regions))
+        self.assertGreater(sum(fake.throttled.values()), 0)
+
+    def test_listings_are_walked_once(self):
+        from garbo.discovery.aws.fake import FakeAWS
+        from garbo.model.aws import EBSSnapshot, EBSVolume
+
+        with FakeAWS(self.account, page_size=7) as fake:
+            self.collect()
+        for cls, action in ((EBSSnapshot, 'DescribeSnapshots'), (EBSVolume, 'DescribeVolumes')):
+            pages = [(len([k for k in self.account.resources[cls] if k[0] == region]) + 6) // 7 or 1
+                     for region in self.account.regions]
+            self.assertEqual(fake.calls[action], sum(pages))
+
+    def test_snapshots_are_yielded_while_listed(self):
+        from garbo.discovery.aws.ec2 import ebs_volumes, snapshots
+        from garbo.discovery.aws.fake import FakeAWS
+        from garbo.discovery.aws.utils import RegionInventory
+        from garbo.model.aws import EBSSnapshot, EBSVolume
+
+        region = self.account.regions[0]
+        with FakeAWS(self.account, page_size=7) as fake:
+            inventory = RegionInventory(region, 'fake', 'fake')
+            collected = snapshots(inventory.connection(), inventory)
+            first = next(collected)
+            self.assertIsInstance(first, EBSSnapshot)
+            # the first page, before the volumes are listed
+            self.assertEqual((fake.calls['DescribeSnapshots'], fake.calls['DescribeVolumes']), (1, 0))
+            discovered = [first] + list(collected) + list(ebs_volumes(inventory.connection(), inventory))
+        # the snapshots and volumes of the region, their relations, and the attachments of the volumes
+        graph = list(self.account.graph())
+        resources = {item.urid() for item in graph
+                     if isinstance(item, (EBSSnapshot, EBSVolume)) and item.region == region}
+        expected = [item for item in graph if isinstance(item, AbstractResource) and item.urid() in resources or
+                    isinstance(item, Relation) and (item.source in resources or item.target in resources and
+                                                    item.source.startswith('AWS://Instance/'))]
+        self.assertEqual(_graph(discovered), _graph(expected))
+
+    def test_failed_discovery_is_not_resumed(self):
+        from garbo.discovery.aws.fake import FakeAWS
+        from garbo.storage.shards import ShardStore
+
+        class FailingAWS(FakeAWS):
+            def respond(self, region, action, params):
+                if action == 'DescribeKeyPairs':
+                    raise RuntimeError('unexpected response')
+                return super(FailingAWS, self).respond(region, action, params)
+
+        shards = ShardStore(self.directory)
+        with FailingAWS(self.account):
+            self.assertRaises(RuntimeError, self.collect, shards=shards)
+        # the failed discovery isn't resumed by the next one
+        self.assertIsNone(shards.begin_run('default'))
+        with FakeAWS(self.account):
+            self.assertEqual(_graph(self.collect(shards=shards)), _graph(self.account.graph()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+from datetime import datetime
+import unittest
+
+from garbo.graph import CompactGraph, GraphBuilder
+from garbo.model import AbstractResource, Relation
+from garbo.model.aws import Instance, SecurityGroup
+
+__author__ = 'nati'
+
+
+def _state(item):
+    if isinstance(item, AbstractResource):
+        return item.urid(), item.created, item.used, item.cleanup_candidate
+    return item.source, item.target, item.dependency
+
+
+class GraphBuilderTest(unittest.TestCase):
+
+    def discovered(self):
+        created = datetime(2016, 1, 1)
+        return [Instance('r', 'i-1'), SecurityGroup('r', 'sg-1'),
+                Relation(Instance.make_urid('r', 'i-1'), SecurityGroup.make_urid('r', 'sg-1')),
+                Relation(Instance.make_urid('r', 'i-1'), Instance.make_urid('r', 'i-2'), dependency=True),
+                # duplicates
+                Instance('r', 'i-1', created=created, used=True),
+                SecurityGroup('r', 'sg-1', cleanup_candidate=False),
+                Relation(Instance.make_urid('r', 'i-1'), SecurityGroup.make_urid('r', 'sg-1'), dependency=True),
+                Relation(Instance.make_urid('r', 'i-1'), Instance.make_urid('r', 'i-2'))]
+
+    def final(self, fed):
+        """
+        :return: states of the last fed item of every urid (or source and target)
+        """
+        final = {}
+        for item in fed:
+            final[item.urid() if isinstance(item, AbstractResource) else (item.source, item.target)] = _state(item)
+        return sorted(final.values(), key=str)
+
+    def test_duplicates_are_merged(self):
+        builder = GraphBuilder()
+        fed = list(builder.feed(self.discovered()))
+        merged = [('AWS://Instance/r/i-1', 'AWS://Instance/r/i-2', True),
+                  ('AWS://Instance/r/i-1', 'AWS://SecurityGroup/r/sg-1', True),
+                  ('AWS://Instance/r/i-1', datetime(2016, 1, 1), True, True),
+                  ('AWS://SecurityGroup/r/sg-1', None, False, False)]
+        self.assertEqual(self.final(fed), merged)
+        self.assertEqual(self.final(builder), merged)
+        self.assertEqual(len(list(builder)), 4)
+        # the duplicate relation adding nothing is dropped
+        self.assertEqual(len(fed), 7)
+
+    def test_yielded_items_are_final(self):
+        yielded = [(item, _state(item)) for item in GraphBuilder().feed(self.discovered())]
+        for item, state in yielded:
+            self.assertEqual(_state(item), state)
+
+    def test_items_are_streamed(self):
+        exhausted = []
+
+        def discovered():
+            for item in self.discovered():
+                yield item
+            exhausted.append(True)
+
+        fed = GraphBuilder().feed(discovered())
+        self.assertEqual([_state(next(fed)) for _ in range(4)],
+                         [_state(item) for item in self.discovered()[:4]])
+        self.assertEqual(exhausted, [])
+
+    def test_replaced_items_are_merged_by_the_compact_graph(self):
+        graph = CompactGraph(GraphBuilder().feed(self.discovered()))
+        node = graph.node('AWS://Instance/r/i-1')
+        self.assertTrue(graph.used(node))
+        self.assertEqual(sorted((graph.urids[graph.targets[edge]], graph.dependency[edge])
+                                for edge in graph.edges(node)),
+                         [('AWS://Instance/r/i-2', 1), ('AWS://SecurityGroup/r/sg-1', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import random
+import unittest
+
+from garbo import utils
+from garbo.graph import CompactGraph
+from garbo.incremental import IncrementalSweep
+from garbo.model import AbstractResource, Relation
+from garbo.model.aws import Image, Instance, SecurityGroup
+
+__author__ = 'nati'
+
+_TYPES = (Instance, Image, SecurityGroup)
+
+
+class RandomGraph(object):
+    """
+    A random graph (with cycles, and relations to resources that weren't discovered), changed a step at a time
+    """
+
+    def __init__(self, seed, size=60):
+        self.random = random.Random(seed)
+        self.size = size
+        self.resources = {}
+        self.relations = {}
+        self.applications = {}
+        for _ in range(size):
+            self.add_resource()
+        for _ in range(size * 2):
+            self.add_relation()
+        for name in ('app-1', 'app-2', 'app-3'):
+            self.applications[name] = set(self.random.sample(self.urids(), 3))
+
+    def urids(self):
+        return sorted(self.resources)
+
+    def add_resource(self):
+        cls = self.random.choice(_TYPES)
+        resource = cls('r', 'x-%d' % self.random.randrange(self.size * 2),
+                       used=self.random.random() < 0.1, cleanup_candidate=self.random.random() < 0.9)
+        self.resources[resource.urid()] = resource
+
+    def add_relation(self):
+        # mostly between discovered resources
+        source = self.random.choice(self.urids())
+        target = self.random.choice(self.urids()) if self.random.random() < 0.9 else \
+            Instance.make_urid('r', 'missing-%d' % self.random.randrange(5))
+        if source != target:
+            self.relations[(source, target)] = Relation(source, target, dependency=self.random.random() < 0.7)
+
+    def change(self):
+        """
+        Add, remove and replace some resources, relations and roots
+        """
+        for _ in range(self.random.randint(0, 4)):
+            del self.resources[self.random.choice(self.urids())]
+        for _ in range(self.random.randint(0, 4)):
+            self.add_resource()
+        for _ in range(self.random.randint(0, 8)):
+            del self.relations[self.random.choice(sorted(self.relations))]
+        for _ in range(self.random.randint(0, 8)):
+            self.add_relation()
+        for _ in range(self.random.randint(0, 2)):
+            key = self.random.choice(sorted(self.relations))
+            self.relations[key] = Relation(*key, dependency=not self.relations[key].dependency)
+        for _ in range(self.random.randint(0, 2)):
+            urid = self.random.choice(self.urids())
+            resource = self.resources[urid]
+            self.resources[urid] = type(resource)('r', resource.resource_id, used=not resource.used,
+                                                  cleanup_candidate=not resource.cleanup_candidate)
+        for roots in self.applications.values():
+            if roots and self.random.random() < 0.3:
+                roots.discard(self.random.choice(sorted(roots)))
+            if self.random.random() < 0.3:
+                roots.add(self.random.choice(self.urids()))
+        if self.random.random() < 0.1:
+            self.applications.pop(self.random.choice(sorted(self.applications)), None)
+
+    def graph(self):
+        return list(self.resources.values()) + list(self.relations.values())
+
+
+class IncrementalSweepTest(unittest.TestCase):
+
+    def assertSweepsEqual(self, sweep, graph, used_as_roots):
+        unused_graph, ownership = utils.sweep_applications(CompactGraph(graph.graph()), graph.applications,
+                                                           used_as_roots=used_as_roots)
+        self.assertEqual(sweep.ownership(), ownership)
+        self.assertEqual(sorted(r.urid() for r in sweep.unused_graph() if isinstance(r, AbstractResource)),
+                         sorted(r.urid() for r in unused_graph if isinstance(r, AbstractResource)))
+        self.assertEqual(sorted((r.source, r.target) for r in sweep.unused_graph() if isinstance(r, Relation)),
+                         sorted((r.source, r.target) for r in unused_graph if isinstance(r, Relation)))
+
+    def test_equivalent_to_a_full_sweep(self):
+        for seed in range(20):
+            graph = RandomGraph(seed)
+            sweep = IncrementalSweep()
+            used_as_roots = seed % 2 == 0
+            for _ in range(15):
+                sweep.update(graph.graph(), graph.applications, used_as_roots=used_as_roots)
+                self.assertSweepsEqual(sweep, graph, used_as_roots)
+                graph.change()
+
+    def test_removed_root_unmarks_its_dependencies(self):
+        instance, image, group = Instance('r', 'i-1'), Image('r', 'ami-1'), SecurityGroup('r', 'sg-1')
+        graph = [instance, image, group, Relation(instance, image, dependency=True),
+                 Relation(image, group, dependency=True), Relation(group, image, dependency=True)]
+        sweep = IncrementalSweep()
+        sweep.update(graph, {'app': [instance.urid()]})
+        self.assertEqual(sweep.unused_graph(), [])
+        sweep.update(graph, {'app': []})
+        # the image and security group keep each other, but nothing keeps them
+        self.assertEqual(sorted(r.urid() for r in sweep.unused_graph() if isinstance(r, AbstractResource)),
+                         sorted([instance.urid(), image.urid(), group.urid()]))
+
+    def test_sweep_visits_only_the_change(self):
+        graph = RandomGraph(0, size=500)
+        sweep = IncrementalSweep()
+        sweep.update(graph.graph(), graph.applications)
+        self.assertEqual(sweep.update(graph.graph(), graph.applications), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
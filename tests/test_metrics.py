@@ -0,0 +1,50 @@
+import unittest
+
+from garbo import metrics
+from garbo.model.aws import Instance
+
+__author__ = 'nati'
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.reset()
+
+    def test_merge_collectors(self):
+        def discovered():
+            # eg. a throttled request, retried by the scheduler
+            metrics.count_throttle()
+            yield Instance('r', 'i-1')
+
+        list(metrics.instrument('instances', 'r', discovered()))
+        metrics.count_error('instances', 'r')
+        # eg. discovered by an account worker process
+        collected = metrics.collectors()
+        metrics.merge_collectors(collected)
+        metrics.merge_collectors([('volumes', 'r', dict(collected[0][2], first_item_time=None))])
+
+        collectors = {c['collector']: c for c in metrics.summary()['collectors']}
+        self.assertEqual((collectors['instances']['resources'], collectors['instances']['errors'],
+                          collectors['instances']['throttles']), (2, 2, 2))
+        self.assertEqual(collectors['instances']['first_item_time'], collected[0][2]['first_item_time'])
+        self.assertEqual(collectors['volumes']['resources'], 1)
+        self.assertIsNone(collectors['volumes']['first_item_time'])
+
+    def test_discovery_failures(self):
+        list(metrics.instrument('instances', 'r', [Instance('r', 'i-1')]))
+        self.assertEqual(metrics.discovery_failures(), [])
+        metrics.count_error('volumes', 'r')
+        metrics.count_failure('account 123456789012')
+        self.assertEqual(metrics.discovery_failures(), ['account 123456789012', 'collector volumes in r'])
+        self.assertEqual(metrics.summary()['failures'], ['account 123456789012'])
+        self.assertIn('garbo_failures 1', metrics.prometheus())
+        metrics.reset()
+        self.assertEqual(metrics.discovery_failures(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import shutil
+import tempfile
+import unittest
+
+from garbo import config
+from garbo.model import AbstractResource, Relation
+from garbo.model.aws import Instance, KeyPair, SecurityGroup
+from garbo.storage import sqlite
+
+__author__ = 'nati'
+
+
+class UridTest(unittest.TestCase):
+
+    def test_unicode_urids(self):
+        relation = Relation(u'AWS://Instance/r/i-1', u'AWS://SecurityGroup/r/sg-1', dependency=True)
+        self.assertEqual(relation.source, 'AWS://Instance/r/i-1')
+        self.assertIs(relation.source, Instance.make_urid('r', 'i-1'))
+
+    def test_non_ascii_urids(self):
+        urid = KeyPair.make_urid(u'r', u'cl\xe9')
+        self.assertEqual(urid, u'AWS://KeyPair/r/cl\xe9')
+        self.assertEqual(Relation(urid, u'AWS://Instance/r/i-1').source, urid)
+        self.assertEqual(AbstractResource.make_urid('AWS', 'KeyPair', u'r/cl\xe9'), urid)
+
+
+class SQLiteUnicodeTest(unittest.TestCase):
+    """
+    sqlite3 returns TEXT columns as unicode
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self._working_dir = config.sqlite_storage.working_dir
+        config.sqlite_storage.working_dir = self.directory
+
+    def tearDown(self):
+        config.sqlite_storage.working_dir = self._working_dir
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        instance, group, key = Instance('r', 'i-1'), SecurityGroup('r', 'sg-1'), KeyPair('r', u'cl\xe9')
+        sqlite.dump_graph([instance, group, key, Relation(instance, group, dependency=True),
+                           Relation(instance, key, dependency=True)])
+        loaded = list(sqlite.load_graph())
+        self.assertEqual(sorted(i.urid() for i in loaded if isinstance(i, AbstractResource)),
+                         sorted([instance.urid(), group.urid(), key.urid()]))
+        self.assertEqual(sorted((r.source, r.target, r.dependency) for r in loaded if isinstance(r, Relation)),
+                         [(instance.urid(), key.urid(), True), (instance.urid(), group.urid(), True)])
+
+
+if __name__ == '__main__':
+    unittest.main()
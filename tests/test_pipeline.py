@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from garbo import config, pipeline
+from garbo.graph import CompactGraph
+from garbo.storage import snapshot, stream
+from garbo.synthetic import SyntheticAccount
+
+__author__ = 'nati'
+
+
+class RecordingStorage(object):
+    """
+    A storage plugin recording the dumped items, optionally waiting for an event before consuming them
+    """
+
+    def __init__(self, wait=None):
+        self.wait = wait
+        self.dumped = None
+        self.error = None
+
+    def dump_graph(self, graph, raise_errors=False):
+        if self.wait:
+            self.wait.wait()
+        try:
+            self.dumped = list(graph)
+        except Exception as e:
+            self.error = e
+            raise
+
+
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.graph = list(SyntheticAccount(2000, seed=1).graph())
+        self._stream_dir, config.stream_storage.working_dir = config.stream_storage.working_dir, self.directory
+        self._snapshot_dir, config.snapshot_storage.working_dir = config.snapshot_storage.working_dir, self.directory
+
+    def tearDown(self):
+        config.stream_storage.working_dir = self._stream_dir
+        config.snapshot_storage.working_dir = self._snapshot_dir
+        shutil.rmtree(self.directory)
+
+    def test_store_and_index(self):
+        storage = RecordingStorage()
+        graph = pipeline.run(iter(self.graph), storage)
+        self.assertIsInstance(graph, CompactGraph)
+        self.assertEqual(len(graph.resources), len(CompactGraph(self.graph).resources))
+        self.assertEqual(storage.dumped, self.graph)
+
+    def test_storage_errors_are_raised(self):
+        config.stream_storage.working_dir = os.path.join(self.directory, 'missing')
+        self.assertRaises(IOError, pipeline.run, iter(self.graph), stream)
+
+    def test_failed_discovery_aborts(self):
+        def discovered():
+            for item in self.graph[:1000]:
+                yield item
+            raise RuntimeError('discovery failed')
+
+        storage = RecordingStorage()
+        self.assertRaises(RuntimeError, pipeline.run, discovered(), storage)
+        # nothing is stored
+        self.assertIsNone(storage.dumped)
+        self.assertIsInstance(storage.error, pipeline.PipelineAborted)
+
+    def test_backpressure(self):
+        produced = []
+
+        def discovered():
+            for item in self.graph:
+                produced.append(item)
+                yield item
+
+        resume = threading.Event()
+        storage = RecordingStorage(wait=resume)
+        result = []
+        runner = threading.Thread(target=lambda: result.append(pipeline.run(discovered(), storage, queue_size=512)))
+        runner.start()
+        try:
+            runner.join(0.5)
+            # the discovery waits for the stalled storage, a couple of queued chunks ahead of it
+            self.assertTrue(runner.is_alive())
+            self.assertLessEqual(len(produced), 4 * pipeline.CHUNK_SIZE)
+        finally:
+            resume.set()
+            runner.join()
+        self.assertEqual(len(produced), len(self.graph))
+        self.assertEqual(storage.dumped, self.graph)
+
+    def test_snapshot_is_dumped_from_the_index(self):
+        graph = pipeline.run(iter(self.graph), snapshot)
+        mapped = snapshot.load_graph()
+        try:
+            self.assertEqual(sorted(mapped.urids), sorted(graph.urids))
+        finally:
+            mapped.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from garbo import config, plugins
+from garbo.model import Relation
+from garbo.model.aws import Instance, SecurityGroup
+from garbo.storage import stream
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+__author__ = 'nati'
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# graphs exported by this module, as a dummy exporter plugin
+exported = []
+
+
+def export_graph(graph, filename, **options):
+    exported.append((list(graph), filename, options))
+
+
+def _imported(code, modules, cwd=_ROOT):
+    """
+    Run code in a fresh interpreter
+
+    :return: dict of module name -> whether the code imported it
+    """
+    check = 'import json, sys\n%s\nprint(json.dumps({m: m in sys.modules for m in %r}))' % (code, modules)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([_ROOT] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+    output = subprocess.check_output([sys.executable, '-c', check], cwd=cwd, env=env, universal_newlines=True)
+    return json.loads(output.splitlines()[-1])
+
+
+class PluginsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._entry_points = plugins._entry_points
+        del exported[:]
+
+    def tearDown(self):
+        plugins._entry_points = self._entry_points
+
+    def test_registered_plugin(self):
+        # as registered by an entry point of an installed package
+        plugins._entry_points = lambda group: {'recording': __name__} if group == plugins.EXPORTERS else {}
+        exporter = plugins.load(plugins.EXPORTERS, 'recording')
+        exporter.export_graph([Instance('r', 'i-1')], 'graph.json', lod=None)
+        self.assertEqual([(len(graph), filename, options) for graph, filename, options in exported],
+                         [(1, 'graph.json', {'lod': None})])
+        self.assertRaises(ValueError, plugins.load, plugins.STORAGE, 'recording')
+
+    def test_builtin_plugins_dont_scan_entry_points(self):
+        def entry_points(group):
+            raise AssertionError('scanned the entry points of %s' % group)
+
+        plugins._entry_points = entry_points
+        self.assertEqual(plugins.load(plugins.STORAGE, 'sqlite').__name__, 'garbo.storage.sqlite')
+
+    def test_lazy_imports(self):
+        modules = ['garbo.storage.d3js', 'garbo.storage.sqlite', 'garbo.discovery.aws', 'boto']
+        self.assertEqual(_imported('from garbo import plugins', modules), dict.fromkeys(modules, False))
+        self.assertEqual(_imported('from garbo import plugins\n'
+                                   'plugins.load(plugins.EXPORTERS, "d3js")\n'
+                                   'plugins.load(plugins.STORAGE, "sqlite")', modules),
+                         {'garbo.storage.d3js': True, 'garbo.storage.sqlite': True, 'garbo.discovery.aws': False,
+                          'boto': False})
+
+
+@unittest.skipIf(yaml is None, 'sweeping applications requires yaml')
+class StoredGraphRunTest(unittest.TestCase):
+    """
+    A sweep and an export of a stored graph, without a discovery
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self._working_dir, config.stream_storage.working_dir = config.stream_storage.working_dir, self.directory
+        instance, group = Instance('r', 'i-1'), SecurityGroup('r', 'sg-1')
+        stream.dump_graph([instance, group, Relation(instance, group, dependency=True)])
+        with open(os.path.join(self.directory, 'garbo.cfg'), 'w') as config_file:
+            config_file.write('[storage]\nbackend = stream\n')
+        with open(os.path.join(self.directory, 'applications.yml'), 'w') as applications_file:
+            yaml.safe_dump({'app': [instance.urid()]}, applications_file)
+        os.mkdir(os.path.join(self.directory, 'd3js'))
+
+    def tearDown(self):
+        config.stream_storage.working_dir = self._working_dir
+        shutil.rmtree(self.directory)
+
+    def test_boto_is_not_imported(self):
+        run = ('import runpy\n'
+               'sys.argv = ["garbo.py", "-a", "applications.yml", "-g"]\n'
+               'try:\n'
+               '    runpy.run_path(%r, run_name="__main__")\n'
+               'except SystemExit as e:\n'
+               '    assert not e.code, e.code\n') % os.path.join(_ROOT, 'garbo.py')
+        self.assertEqual(_imported(run, ['boto', 'garbo.discovery.aws', 'garbo.storage.stream'], cwd=self.directory),
+                         {'boto': False, 'garbo.discovery.aws': False, 'garbo.storage.stream': True})
+        # the unused (swept) graph was exported
+        with open(os.path.join(self.directory, 'd3js', 'garbo.json')) as exported_file:
+            self.assertEqual(json.load(exported_file)['nodes'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from garbo import config, utils
+from garbo.graph import CompactGraph
+from garbo.model import Relation
+from garbo.model.aws import AutoScalingGroup, EBSSnapshot, Image, Instance, SecurityGroup
+from garbo.storage import retention
+
+__author__ = 'nati'
+
+_GARBO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'garbo.py')
+
+
+class RetentionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self._working_dir, config.retention.working_dir = config.retention.working_dir, self.directory
+        # auto scaling group -> instance -> image -> snapshot, and an instance -> security group
+        self.asg, self.instance = AutoScalingGroup('r', 'asg-1'), Instance('r', 'i-1')
+        self.image, self.snapshot = Image('r', 'ami-1'), EBSSnapshot('r', 'snap-1')
+        self.group = SecurityGroup('r', 'sg-1')
+        self.graph = CompactGraph([self.asg, self.instance, self.image, self.snapshot, self.group,
+                                   Relation(self.asg, self.instance, dependency=True),
+                                   Relation(self.instance, self.image, dependency=True),
+                                   Relation(self.image, self.snapshot, dependency=True),
+                                   Relation(self.instance, self.group, dependency=True)])
+
+    def tearDown(self):
+        config.retention.working_dir = self._working_dir
+        shutil.rmtree(self.directory)
+
+    def sweep(self, applications):
+        return utils.sweep_applications(self.graph, applications, retention=True)
+
+    def test_explain_chain(self):
+        self.sweep({'web': [self.asg.urid()], 'batch': [self.image.urid()]})
+        path, applications = retention.explain(self.snapshot.urid())
+        # the shortest path, from the closest root
+        self.assertEqual(path, [(self.image.urid(), ['batch']), (self.snapshot.urid(), [])])
+        self.assertEqual(sorted(applications), ['batch', 'web'])
+        path, applications = retention.explain(self.group.urid())
+        self.assertEqual(path, [(self.asg.urid(), ['web']), (self.instance.urid(), []), (self.group.urid(), [])])
+        self.assertEqual(applications, ['web'])
+
+    def test_record_and_lookup(self):
+        unused, ownership = self.sweep({'web': [self.instance.urid()]})
+        self.assertEqual(retention.explain(self.instance.urid()), ([(self.instance.urid(), ['web'])], ['web']))
+        # the unused group isn't kept, and unknown resources aren't either
+        self.assertEqual([r.urid() for r in unused], [self.asg.urid()])
+        self.assertIsNone(retention.explain(self.asg.urid()))
+        self.assertIsNone(retention.explain(Instance.make_urid('r', 'i-2')))
+        # every used resource is recorded
+        for urid in ownership:
+            self.assertEqual(retention.explain(urid)[0][-1][0], urid)
+
+    def test_expiry(self):
+        self.sweep({'web': [self.asg.urid()]})
+        self.assertEqual(retention.explain(self.group.urid())[1], ['web'])
+        # the next sweep replaces the index, so resources it doesn't keep are no longer explained
+        self.sweep({'batch': [self.image.urid()]})
+        self.assertIsNone(retention.explain(self.group.urid()))
+        self.assertEqual(retention.explain(self.snapshot.urid())[1], ['batch'])
+        self.assertEqual(os.listdir(self.directory), [config.retention.filename])
+
+    def test_missing_index(self):
+        self.assertRaises(IOError, retention.explain, self.group.urid())
+
+    def explain(self, urid):
+        process = subprocess.Popen([sys.executable, _GARBO, '--explain', urid], cwd=self.directory,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        out, err = process.communicate()
+        return process.returncode, out, err
+
+    def test_explain_command(self):
+        self.sweep({'web': [self.asg.urid()]})
+        status, out, _ = self.explain(self.image.urid())
+        self.assertEqual(status, 0)
+        self.assertEqual(out.splitlines(), ['%s is kept by: web' % self.image.urid(),
+                                            '  %s (root of web)' % self.asg.urid(),
+                                            '  -> %s' % self.instance.urid(),
+                                            '  -> %s' % self.image.urid()])
+
+    def test_explain_command_without_an_index(self):
+        status, out, err = self.explain(self.image.urid())
+        self.assertEqual((status, out), (1, ''))
+        self.assertEqual(len(err.splitlines()), 1)
+        self.assertIn('no retention index', err)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+
+from garbo import metrics
+from garbo.model.aws import Instance
+
+try:
+    import boto
+except ImportError:
+    boto = None
+
+__author__ = 'nati'
+
+
+def _error(code):
+    import boto.exception
+
+    return boto.exception.BotoServerError(400, 'Bad Request', '<Response><Errors><Error><Code>%s</Code>'
+                                                              '</Error></Errors></Response>' % code)
+
+
+@unittest.skipIf(boto is None, 'the request scheduler requires boto')
+class AdaptiveLimitsTest(unittest.TestCase):
+
+    def limits(self):
+        from garbo.discovery.aws.scheduler import AdaptiveLimits
+
+        return AdaptiveLimits(rate=8, concurrency=4, max_concurrency=6)
+
+    def request(self, limits, throttled=False):
+        # a running request, completed right away
+        limits.active += 1
+        limits.release(throttled)
+
+    def test_decrease_on_throttling(self):
+        limits = self.limits()
+        self.request(limits, throttled=True)
+        self.assertEqual((limits.rate, limits.concurrency), (4, 2))
+        for _ in range(10):
+            self.request(limits, throttled=True)
+        # down to the minimal limits
+        self.assertEqual((limits.rate, limits.concurrency), (0.5, 1))
+
+    def test_additive_recovery(self):
+        limits = self.limits()
+        self.request(limits, throttled=True)
+        self.request(limits)
+        self.assertEqual((limits.rate, limits.concurrency), (4.25, 2.5))
+        limits.rate = 127.9
+        for _ in range(20):
+            self.request(limits)
+        # up to the maximal limits
+        self.assertEqual((limits.rate, limits.concurrency), (128, 6))
+
+
+@unittest.skipIf(boto is None, 'the request scheduler requires boto')
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        from garbo.discovery.aws import scheduler
+
+        metrics.reset()
+        # retry right away
+        self._backoff_base, scheduler._BACKOFF_BASE = scheduler._BACKOFF_BASE, 0
+        self.scheduler = scheduler.Scheduler(rate=1000, concurrency=4, max_concurrency=4, max_retries=2)
+        self.calls = 0
+
+    def tearDown(self):
+        from garbo.discovery.aws import scheduler
+
+        scheduler._BACKOFF_BASE = self._backoff_base
+        metrics.reset()
+
+    def request(self, *errors):
+        """
+        :return: a request raising errors, one per attempt, and then succeeding
+        """
+        def request():
+            self.calls += 1
+            if self.calls <= len(errors):
+                raise errors[self.calls - 1]
+            return 'ok'
+
+        return request
+
+    def call(self, request):
+        """
+        Call a request as a collector would, returning its collector stats
+        """
+        def collector():
+            yield Instance('r', self.scheduler.call('ec2', 'r', request))
+
+        try:
+            list(metrics.instrument('instances', 'r', collector()))
+        finally:
+            stats = metrics.collector_stats('instances', 'r')
+        return stats
+
+    def test_throttled_requests_are_retried(self):
+        stats = self.call(self.request(_error('Throttling'), _error('RequestLimitExceeded')))
+        self.assertEqual((self.calls, stats.throttles, stats.resources), (3, 2, 1))
+        self.assertLess(self.scheduler.limits('ec2', 'r').rate, 1000)
+
+    def test_retries_are_capped(self):
+        import boto.exception
+
+        request = self.request(*[_error('Throttling')] * 10)
+        self.assertRaises(boto.exception.BotoServerError, self.call, request)
+        self.assertEqual((self.calls, metrics.collector_stats('instances', 'r').throttles), (3, 3))
+
+    def test_errors_are_not_retried(self):
+        import boto.exception
+
+        self.assertRaises(boto.exception.BotoServerError, self.call, self.request(_error('InvalidParameterValue')))
+        self.assertEqual((self.calls, metrics.collector_stats('instances', 'r').throttles), (1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from httplib import HTTPConnection
+except ImportError:
+    from http.client import HTTPConnection
+
+from garbo import config, server
+from garbo.model import Relation
+from garbo.model.aws import EBSSnapshot, Image, Instance, SecurityGroup
+
+__author__ = 'nati'
+
+
+def _graph():
+    """
+    instances -> image -> snapshot, instances -> security group, and a resource of another region
+    """
+    image, snapshot = Image('us-east-1', 'ami-1'), EBSSnapshot('us-east-1', 'snap-1')
+    group = SecurityGroup('us-east-1', 'sg-1')
+    instances = [Instance('us-east-1', 'i-%d' % n) for n in range(3)]
+    graph = [image, snapshot, group, Instance('eu-west-1', 'i-9'), Relation(image, snapshot, dependency=True)]
+    graph += instances
+    for instance in instances:
+        graph += [Relation(instance, image, dependency=True), Relation(instance, group, dependency=True)]
+    return graph
+
+
+class GraphIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = server.GraphIndex(_graph(), {'AWS://Instance/us-east-1/i-0': ['app'],
+                                                  'AWS://Image/us-east-1/ami-1': ['app', 'other']})
+
+    def urids(self, nodes):
+        return sorted(self.index.graph.urids[node] for node in nodes)
+
+    def test_select(self):
+        self.assertEqual(len(self.index.select()), 7)
+        self.assertEqual(self.urids(self.index.select(application='app')),
+                         ['AWS://Image/us-east-1/ami-1', 'AWS://Instance/us-east-1/i-0'])
+        self.assertEqual(self.urids(self.index.select(application='app', rtype='Image')),
+                         ['AWS://Image/us-east-1/ami-1'])
+        self.assertEqual(self.urids(self.index.select(region='eu-west-1')), ['AWS://Instance/eu-west-1/i-9'])
+        self.assertEqual(self.index.select(application='missing'), [])
+
+    def test_neighborhood(self):
+        self.assertEqual(self.urids(self.index.neighborhood('AWS://Instance/us-east-1/i-0')),
+                         ['AWS://Image/us-east-1/ami-1', 'AWS://Instance/us-east-1/i-0',
+                          'AWS://SecurityGroup/us-east-1/sg-1'])
+        # the other instances, through the image and security group
+        self.assertEqual(len(self.index.neighborhood('AWS://Instance/us-east-1/i-0', depth=2)), 6)
+        self.assertEqual(self.urids(self.index.neighborhood('AWS://Instance/us-east-1/i-0', depth=-1)),
+                         ['AWS://Instance/us-east-1/i-0'])
+        self.assertEqual(self.index.neighborhood('AWS://Instance/us-east-1/missing'), [])
+
+    def test_depth_is_bounded(self):
+        max_depth, config.server.max_depth = config.server.max_depth, 1
+        try:
+            self.assertEqual(len(self.index.neighborhood('AWS://Instance/us-east-1/i-0', depth=100)), 3)
+        finally:
+            config.server.max_depth = max_depth
+
+    def test_pages(self):
+        nodes = self.index.select(region='us-east-1')
+        first = self.index.subgraph(nodes, 0, 4)
+        second = self.index.subgraph(nodes, first['next'], 4)
+        self.assertEqual((len(first['nodes']), len(second['nodes']), second['next']), (4, 2, None))
+        self.assertEqual(len(set(n['name'] for n in first['nodes'] + second['nodes'])), 6)
+        # invalid pages are clamped
+        self.assertEqual(self.index.subgraph(nodes, -5, -1)['nodes'], first['nodes'][:1])
+        page_size, config.server.page_size = config.server.page_size, 2
+        try:
+            self.assertEqual(self.index.subgraph(nodes, 0, 100)['limit'], 2)
+        finally:
+            config.server.page_size = page_size
+
+
+class ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.static_dir = tempfile.mkdtemp()
+        self.write('index.html', b'<html></html>')
+        handler = type('Handler', (server.GraphRequestHandler,),
+                       {'index': server.GraphIndex(_graph()), 'static_dir': self.static_dir,
+                        'cache': server._ResponseCache()})
+        self.server = server._ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.static_dir)
+
+    def write(self, filename, data):
+        with open(os.path.join(self.static_dir, filename), 'wb') as static_file:
+            static_file.write(data)
+
+    def get(self, path, **headers):
+        conn = HTTPConnection('127.0.0.1', self.server.server_address[1])
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            return response.status, dict((k.lower(), v) for k, v in response.getheaders()), response.read()
+        finally:
+            conn.close()
+
+    def test_etag(self):
+        status, headers, body = self.get('/api/graph?region=us-east-1')
+        self.assertEqual((status, json.loads(body.decode('utf-8'))['total']), (200, 6))
+        status, _, body = self.get('/api/graph?region=us-east-1', **{'If-None-Match': headers['etag']})
+        self.assertEqual((status, body), (304, b''))
+
+    def test_gzip(self):
+        _, _, body = self.get('/api/summary')
+        status, headers, gzipped = self.get('/api/summary', **{'Accept-Encoding': 'gzip'})
+        self.assertEqual((status, headers['content-encoding']), (200, 'gzip'))
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(gzipped)).read(), body)
+        self.assertEqual(json.loads(body.decode('utf-8'))['resources'], 7)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.get('/api/graph?depth=deep')[0], 400)
+
+    def test_static_files(self):
+        self.assertEqual(self.get('/')[2], b'<html></html>')
+        self.assertEqual(self.get('/../secret')[0], 404)
+        # modified files aren't served from the cache
+        _, headers, _ = self.get('/index.html')
+        self.write('index.html', b'<html>modified</html>')
+        os.utime(os.path.join(self.static_dir, 'index.html'), (0, 0))
+        status, modified, body = self.get('/index.html', **{'If-None-Match': headers['etag']})
+        self.assertEqual((status, body), (200, b'<html>modified</html>'))
+        self.assertNotEqual(modified['etag'], headers['etag'])
+
+    def test_large_files_are_streamed(self):
+        data = b'0123456789abcdef' * (server.MAX_CACHED_FILE // 16 + 1)
+        self.write('garbo.json', data)
+        status, headers, body = self.get('/garbo.json', **{'Accept-Encoding': 'gzip'})
+        self.assertEqual((status, body), (200, data))
+        self.assertNotIn('content-encoding', headers)
+        self.assertEqual(self.get('/garbo.json', **{'If-None-Match': headers['etag']})[0], 304)
+        self.assertEqual(len(self.server.RequestHandlerClass.cache._entries), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
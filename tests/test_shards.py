@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from garbo.model.aws import Instance
+from garbo.storage.shards import ShardStore
+
+__author__ = 'nati'
+
+
+class ShardStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.shards = ShardStore(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_file(self):
+        return os.path.join(self.directory, 'default', 'running')
+
+    def marked_start(self):
+        with open(self.run_file()) as f:
+            return float(f.read())
+
+    def test_commit(self):
+        shard = self.shards.writer('default', 'r', 'instances')
+        shard.write(Instance('r', 'i-1'))
+        shard.commit()
+        shard.close()
+        self.assertEqual([i.urid() for i in self.shards.read('default', 'r', 'instances')],
+                         ['AWS://Instance/r/i-1'])
+        # modification times are rounded by the file system
+        self.assertTrue(self.shards.is_fresh('default', 'r', 'instances', shard.started - 1))
+
+    def test_discarded_shard(self):
+        shard = self.shards.writer('default', 'r', 'instances')
+        shard.write(Instance('r', 'i-1'))
+        shard.close()
+        self.assertIsNone(self.shards.started('default', 'r', 'instances'))
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'default', 'r')), [])
+
+    def test_resume_interrupted_run(self):
+        self.assertIsNone(self.shards.begin_run('default'))
+        started = self.marked_start()
+        self.assertEqual(self.shards.begin_run('default'), started)
+        self.shards.end_run('default')
+        self.assertIsNone(self.shards.begin_run('default'))
+
+    def test_stale_run_is_not_resumed(self):
+        self.shards.begin_run('default')
+        with open(self.run_file(), 'w') as f:
+            f.write(repr(time.time() - 7200))
+        self.assertIsNone(self.shards.begin_run('default', max_age=3600))
+        # replaced by a new marker
+        self.assertLess(time.time() - self.marked_start(), 60)
+
+    def test_partial_shards_are_removed(self):
+        # a crashed discovery never commits nor closes its shards
+        self.shards.writer('default', 'r', 'instances')._file.close()
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, 'default', 'r'))), 1)
+        self.shards.begin_run('default')
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'default', 'r')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from garbo import usage, utils
+from garbo.graph import CompactGraph
+from garbo.model import AbstractResource, Relation
+from garbo.model.aws import EBSVolume, Instance, KeyPair, SecurityGroup
+from garbo.storage import snapshot
+from garbo.synthetic import SyntheticAccount
+
+__author__ = 'nati'
+
+
+def _state(item):
+    if isinstance(item, AbstractResource):
+        return (type(item), item.urid(), item.rtype, item.region, item.resource_id, item.account, item.created,
+                bool(item.used), item.cleanup_candidate)
+    return item.source, item.target, item.dependency
+
+
+class VolumeProbe(usage.UsageProbe):
+    """
+    vol-1 is in use
+    """
+
+    batch_size = 10
+
+    def probe(self, region, resources):
+        return {r.urid(): r.resource_id == 'vol-1' for r in resources}
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'graph.snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        instance = Instance('r', 'i-1', created=datetime(2016, 1, 1, 12, 30), used=True, account='123')
+        group = SecurityGroup('r', 'sg-1', cleanup_candidate=False, account='123')
+        key = KeyPair('r', u'cl\xe9')
+        graph = [instance, group, key, Relation(instance, group, dependency=True), Relation(instance, key),
+                 # a relation to a resource that wasn't discovered
+                 Relation(instance, Instance.make_urid('r', 'i-2'), dependency=True)]
+        snapshot.dump_graph(graph, self.filename)
+        mapped = snapshot.load_graph(self.filename)
+        try:
+            self.assertEqual(set(_state(item) for item in mapped), set(_state(item) for item in graph))
+            self.assertEqual(mapped.used_urids(), [instance.urid()])
+            self.assertIsNone(mapped.resources[mapped.node(Instance.make_urid('r', 'i-2'))])
+        finally:
+            mapped.close()
+
+    def test_sweep(self):
+        account = SyntheticAccount(500, seed=1)
+        graph = CompactGraph(account.graph())
+        snapshot.dump_graph(graph, self.filename)
+        mapped = snapshot.load_graph(self.filename)
+        try:
+            applications = account.applications(3)
+            unused, ownership = utils.sweep_applications(mapped, applications)
+            expected_unused, expected_ownership = utils.sweep_applications(graph, applications)
+            self.assertEqual(set(_state(item) for item in unused), set(_state(item) for item in expected_unused))
+            self.assertEqual(ownership, expected_ownership)
+        finally:
+            mapped.close()
+
+    def test_usage(self):
+        graph = [EBSVolume('r', 'vol-%d' % n) for n in range(3)]
+        snapshot.dump_graph(graph, self.filename)
+        mapped = snapshot.load_graph(self.filename)
+        probe, EBSVolume.usage_probe = EBSVolume.usage_probe, VolumeProbe()
+        try:
+            # as swept by garbo.py -u
+            self.assertEqual(usage.evaluate(mapped, usage.UsageCache(os.path.join(self.directory, 'usage.p'), 0)), 1)
+            self.assertEqual(mapped.used_urids(), [EBSVolume.make_urid('r', 'vol-1')])
+            self.assertTrue(mapped.resource(mapped.node(EBSVolume.make_urid('r', 'vol-1'))).used)
+            unused, _ = utils.sweep_applications(mapped, {}, used_as_roots=True)
+            self.assertEqual(sorted(r.urid() for r in unused),
+                             [EBSVolume.make_urid('r', 'vol-0'), EBSVolume.make_urid('r', 'vol-2')])
+        finally:
+            EBSVolume.usage_probe = probe
+            mapped.close()
+
+    def test_missing_snapshot(self):
+        self.assertEqual(snapshot.load_graph(os.path.join(self.directory, 'missing')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
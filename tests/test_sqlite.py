@@ -0,0 +1,90 @@
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from garbo import config
+from garbo.model import Relation
+from garbo.model.aws import EBSVolume, Image, Instance, SecurityGroup
+from garbo.storage import sqlite
+
+__author__ = 'nati'
+
+
+class GraphIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self._working_dir, config.sqlite_storage.working_dir = config.sqlite_storage.working_dir, self.directory
+        self.instance = Instance('us-east-1', 'i-1', created=datetime(2016, 1, 1), used=True)
+        self.stopped = Instance('us-west-1', 'i-2', cleanup_candidate=False)
+        self.group = SecurityGroup('us-east-1', 'sg-1')
+        self.image = Image('us-east-1', 'ami-1')
+        self.volume = EBSVolume('us-west-1', 'vol-1')
+        sqlite.dump_graph([self.instance, self.stopped, self.group, self.image, self.volume,
+                           Relation(self.instance, self.group, dependency=True),
+                           Relation(self.stopped, self.group, dependency=True),
+                           Relation(self.instance, self.image),
+                           Relation(self.stopped, self.volume, dependency=True)])
+        self.index = sqlite.GraphIndex(os.path.join(self.directory, config.sqlite_storage.db_filename))
+
+    def tearDown(self):
+        self.index.close()
+        config.sqlite_storage.working_dir = self._working_dir
+        shutil.rmtree(self.directory)
+
+    def urids(self, resources):
+        return sorted(r.urid() for r in resources)
+
+    def test_resource(self):
+        resource = self.index.resource(self.instance.urid())
+        self.assertEqual((resource.urid(), resource.created, resource.used),
+                         (self.instance.urid(), datetime(2016, 1, 1), True))
+        self.assertIsNone(self.index.resource(Instance.make_urid('us-east-1', 'i-3')))
+
+    def test_neighbors(self):
+        self.assertEqual(self.index.neighbors(self.instance.urid()), {self.group.urid(), self.image.urid()})
+        self.assertEqual(self.index.neighbors(self.instance.urid(), dependency=True), {self.group.urid()})
+        self.assertEqual(self.index.neighbors(self.instance.urid(), dependency=False), {self.image.urid()})
+        self.assertEqual(self.index.neighbors(self.group.urid()), set())
+
+    def test_reverse_neighbors(self):
+        self.assertEqual(self.index.reverse_neighbors(self.group.urid()),
+                         {self.instance.urid(), self.stopped.urid()})
+        self.assertEqual(self.index.reverse_neighbors(self.image.urid(), dependency=True), set())
+        self.assertEqual(self.index.reverse_neighbors(self.volume.urid(), dependency=True), {self.stopped.urid()})
+        self.assertEqual(self.index.reverse_neighbors(self.instance.urid()), set())
+
+    def test_resources(self):
+        self.assertEqual(self.urids(self.index.resources()),
+                         self.urids([self.instance, self.stopped, self.group, self.image, self.volume]))
+        self.assertEqual(self.urids(self.index.resources(rtype='Instance')),
+                         self.urids([self.instance, self.stopped]))
+        self.assertEqual(self.urids(self.index.resources(region='us-west-1')),
+                         self.urids([self.stopped, self.volume]))
+        self.assertEqual(self.urids(self.index.resources(rtype='Instance', region='us-east-1')),
+                         [self.instance.urid()])
+        self.assertEqual(self.urids(self.index.resources(rtype='Instance', cleanup_candidate=False)),
+                         [self.stopped.urid()])
+        self.assertEqual(self.urids(self.index.resources(rtype='Instance', cleanup_candidate=True)),
+                         [self.instance.urid()])
+
+    def test_relations(self):
+        def edges(relations):
+            return sorted((r.source, r.target, r.dependency) for r in relations)
+
+        self.assertEqual(edges(self.index.relations(dependency=False)),
+                         [(self.instance.urid(), self.image.urid(), False)])
+        self.assertEqual(edges(self.index.relations(dependency=True)),
+                         sorted([(self.instance.urid(), self.group.urid(), True),
+                                 (self.stopped.urid(), self.group.urid(), True),
+                                 (self.stopped.urid(), self.volume.urid(), True)]))
+        self.assertEqual(len(list(self.index.relations())), 4)
+
+    def test_load_graph(self):
+        self.assertEqual(len(list(sqlite.load_graph())), 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from garbo import config, metrics
+from garbo.model import Relation
+from garbo.model.aws import Instance, SecurityGroup
+from garbo.storage import stream
+
+__author__ = 'nati'
+
+
+class StreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self._working_dir, config.stream_storage.working_dir = config.stream_storage.working_dir, self.directory
+        instance, group = Instance('r', 'i-1'), SecurityGroup('r', 'sg-1')
+        self.graph = [instance, group, Relation(instance, group, dependency=True)]
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.reset()
+        config.stream_storage.working_dir = self._working_dir
+        shutil.rmtree(self.directory)
+
+    def urids(self, graph):
+        return [str(item) for item in graph]
+
+    def test_round_trip(self):
+        self.assertEqual(self.urids(stream.record(iter(self.graph))), self.urids(self.graph))
+        self.assertEqual(self.urids(stream.load_graph()), self.urids(self.graph))
+        self.assertEqual(metrics.discovery_failures(), [])
+
+    def test_crashed_discovery_keeps_the_previous_log(self):
+        stream.dump_graph(self.graph)
+
+        def crashing():
+            yield Instance('r', 'i-2')
+            raise RuntimeError('discovery crashed')
+
+        self.assertRaises(RuntimeError, list, stream.record(crashing()))
+        self.assertEqual(self.urids(stream.load_graph()), self.urids(self.graph))
+        self.assertEqual(os.listdir(self.directory), [config.stream_storage.graph_filename])
+
+    def test_log_without_an_end(self):
+        stream.dump_graph(self.graph)
+        filename = os.path.join(self.directory, config.stream_storage.graph_filename)
+        with open(filename, 'rb') as graph_file:
+            data = graph_file.read()
+        # without the end of log, and with a truncated last item
+        for log, count in ((data[:-stream._LENGTH.size], 3), (data[:-stream._LENGTH.size - 1], 2)):
+            metrics.reset()
+            with open(filename, 'wb') as graph_file:
+                graph_file.write(log)
+            # loaded up to the last complete item, but recorded as incomplete
+            self.assertEqual(len(list(stream.load_graph())), count)
+            self.assertEqual(metrics.discovery_failures(), ['graph log %s' % filename])
+
+
+if __name__ == '__main__':
+    unittest.main()
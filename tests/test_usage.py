@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+from xml.etree import ElementTree
+
+from garbo import usage
+from garbo.model.aws import Instance
+
+__author__ = 'nati'
+
+_PAGE = '''<GetMetricDataResponse xmlns="http://monitoring.amazonaws.com/doc/2010-08-01/">
+  <GetMetricDataResult>
+    <MetricDataResults>
+      <member><Id>r1</Id><Values>%s</Values></member>
+      <member><Id>r2</Id><Values>%s</Values></member>
+    </MetricDataResults>
+    %s
+  </GetMetricDataResult>
+</GetMetricDataResponse>'''
+
+
+def _page(first, second, next_token=None):
+    def values(vs):
+        return ''.join('<member>%s</member>' % v for v in vs)
+
+    return ElementTree.fromstring(_PAGE % (values(first), values(second),
+                                           '<NextToken>%s</NextToken>' % next_token if next_token else ''))
+
+
+class RecordingProbe(usage.UsageProbe):
+    """
+    Resources are used by their ID, recording the probed batches
+    """
+
+    batch_size = 2
+
+    def __init__(self, used):
+        self.used = used
+        self.batches = []
+
+    def probe(self, region, resources):
+        self.batches.append((region, resources[0].account, [r.resource_id for r in resources]))
+        return {r.urid(): r.resource_id in self.used for r in resources}
+
+
+class CloudWatchActivityProbeTest(unittest.TestCase):
+
+    def test_pages_are_merged(self):
+        probe = usage.CloudWatchActivityProbe('AWS/EC2', 'CPUUtilization', 'InstanceId', threshold=1)
+        used = {'r1': False, 'r2': False}
+        self.assertEqual(probe._read_page(_page([5], [0], next_token='t'), used), 't')
+        # the values of r1 on the next page don't override its usage
+        self.assertIsNone(probe._read_page(_page([0], [0, 2]), used))
+        self.assertEqual(used, {'r1': True, 'r2': True})
+
+
+class EvaluateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def instances(self, probe, accounts=(None,)):
+        probed_instance = type('ProbedInstance', (Instance,), {'__slots__': (), 'usage_probe': probe})
+        return [probed_instance('r', 'i-%d' % n, account=account) for account in accounts for n in range(4)]
+
+    def test_evaluate(self):
+        probe = RecordingProbe({'i-1', 'i-3'})
+        instances = self.instances(probe)
+        cache = usage.UsageCache(os.path.join(self.directory, 'usage.p'), 3600)
+        self.assertEqual(usage.evaluate(instances, cache), 2)
+        self.assertEqual([bool(i.used) for i in instances], [False, True, False, True])
+        self.assertEqual(sorted(probe.batches), [('r', None, ['i-0', 'i-1']), ('r', None, ['i-2', 'i-3'])])
+
+        # cached between runs
+        probe.batches = []
+        cache = usage.UsageCache(os.path.join(self.directory, 'usage.p'), 3600)
+        self.assertEqual(usage.evaluate(instances, cache), 2)
+        self.assertEqual(probe.batches, [])
+
+    def test_batches_of_a_single_account(self):
+        probe = RecordingProbe(())
+        probe.batch_size = 3
+        usage.evaluate(self.instances(probe, accounts=['111', '222']),
+                       usage.UsageCache(os.path.join(self.directory, 'usage.p'), 3600))
+        # probed with the credentials of the resources account
+        self.assertEqual(sorted(probe.batches), [('r', '111', ['i-0', 'i-1', 'i-2']), ('r', '111', ['i-3']),
+                                                 ('r', '222', ['i-0', 'i-1', 'i-2']), ('r', '222', ['i-3'])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from garbo import utils
+
+__author__ = 'nati'
+
+
+class AtomicFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'garbo.json')
+        with open(self.filename, 'w') as previous:
+            previous.write('previous')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self):
+        with open(self.filename) as written:
+            return written.read()
+
+    def test_replaced_once_written(self):
+        with utils.atomic_file(self.filename) as temporary:
+            with open(temporary, 'w') as written:
+                written.write('next')
+            self.assertEqual(self.read(), 'previous')
+        self.assertEqual(self.read(), 'next')
+        self.assertEqual(os.listdir(self.directory), ['garbo.json'])
+
+    def test_failed_write_is_discarded(self):
+        with self.assertRaises(IOError):
+            with utils.atomic_file(self.filename) as temporary:
+                with open(temporary, 'w') as written:
+                    written.write('partial')
+                raise IOError('disk full')
+        self.assertEqual(self.read(), 'previous')
+        self.assertEqual(os.listdir(self.directory), ['garbo.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()